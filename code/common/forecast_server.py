@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from pathlib import Path
+
+
+class DataCache():
+    '''
+    Data kept in memory by a forecast server across jobs, such as the flu
+    data loaded for a reference date, with the least recently used entries
+    removed once there are more than `max_entries`.
+    '''
+    def __init__(self, max_entries=8):
+        '''
+        Parameters
+        ----------
+        max_entries: maximum number of entries to keep
+        '''
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+    
+    
+    def get(self, key, load):
+        '''
+        Get the entry for a key, loading it if it is not in the cache.
+        
+        Parameters
+        ----------
+        key: hashable key of the entry
+        load: function with no arguments that returns the entry
+        
+        Returns
+        -------
+        the entry, which is shared with later jobs and must not be modified
+        '''
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        else:
+            self._entries[key] = load()
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        
+        return self._entries[key]
+
+
+def parse_server_args(argv):
+    '''
+    Separate the forecast server arguments from the other command line
+    arguments of a model's entry point.
+    
+    Parameters
+    ----------
+    argv: list of command line arguments
+    
+    Returns
+    -------
+    tuple of the `--server_socket` path, or None, the `--serve` flag, and the
+    list of other arguments
+    '''
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--server_socket', type=lambda s: Path(s), default=None)
+    parser.add_argument('--serve', action='store_true')
+    args, argv = parser.parse_known_args(argv)
+    if args.serve and args.server_socket is None:
+        raise SystemExit('--serve requires --server_socket')
+    
+    return args.server_socket, args.serve, argv
+
+
+def serve(socket_path, run_job):
+    '''
+    Run a forecast server, which runs jobs submitted with `submit` in this
+    process until it is stopped with `stop`. Modules imported and data cached
+    by earlier jobs are reused by later jobs. Jobs run one at a time, in the
+    order they are received; each runs with the working directory of the
+    client that submitted it.
+    
+    Parameters
+    ----------
+    socket_path: `pathlib.Path` of the Unix socket to listen on
+    run_job: function that takes a list of command line arguments for the
+        model's entry point, runs the job and returns the `pathlib.Path` of
+        the saved model outputs
+    '''
+    if socket_path.exists():
+        try:
+            with socket.socket(socket.AF_UNIX) as s:
+                s.connect(str(socket_path))
+            raise RuntimeError(f'a forecast server is already running at {socket_path}')
+        except ConnectionRefusedError:
+            # left by a server that stopped
+            socket_path.unlink()
+    
+    job_lock = threading.Lock()
+    
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.readline())
+            if request.get('command') == 'stop':
+                response = {'status': 'stopped'}
+                threading.Thread(target=self.server.shutdown).start()
+            else:
+                with job_lock:
+                    response = _run_request(request, run_job)
+            self.wfile.write((json.dumps(response) + '\n').encode())
+    
+    with socketserver.ThreadingUnixStreamServer(str(socket_path), Handler) as server:
+        print(f'forecast server listening on {socket_path}', flush=True)
+        try:
+            server.serve_forever()
+        finally:
+            socket_path.unlink(missing_ok=True)
+
+
+def submit(socket_path, argv):
+    '''
+    Run a job on a forecast server and wait for it to finish.
+    
+    Parameters
+    ----------
+    socket_path: `pathlib.Path` of the server's Unix socket
+    argv: list of command line arguments for the model's entry point;
+        relative paths are relative to the current working directory
+    
+    Returns
+    -------
+    dictionary with the job's `status` ('success' or 'failed'), the
+    `save_path` of the model outputs, the `error` traceback of a failed job,
+    and the elapsed time in `seconds`
+    '''
+    return _request(socket_path, {'argv': argv, 'cwd': os.getcwd()})
+
+
+def stop(socket_path):
+    '''
+    Stop a forecast server once the jobs it is running have finished.
+    
+    Parameters
+    ----------
+    socket_path: `pathlib.Path` of the server's Unix socket
+    '''
+    _request(socket_path, {'command': 'stop'})
+
+
+def run_client(socket_path, argv):
+    '''
+    Run a job on a forecast server from a model's entry point, printing the
+    path of the model outputs, or the error and exiting with status 1 if the
+    job failed.
+    '''
+    response = submit(socket_path, argv)
+    if response['status'] != 'success':
+        print(response['error'])
+        raise SystemExit(1)
+    
+    print(response['save_path'])
+
+
+def _run_request(request, run_job):
+    start_time = time.time()
+    cwd = os.getcwd()
+    try:
+        os.chdir(request['cwd'])
+        save_path = run_job(request['argv'])
+        response = {'status': 'success', 'save_path': str(Path(save_path).resolve()),
+                    'error': None}
+    except (Exception, SystemExit):
+        # argparse exits on invalid arguments; the server keeps running
+        response = {'status': 'failed', 'save_path': None,
+                    'error': traceback.format_exc()}
+    finally:
+        os.chdir(cwd)
+    
+    response['seconds'] = time.time() - start_time
+    return response
+
+
+def _request(socket_path, request):
+    with socket.socket(socket.AF_UNIX) as s:
+        s.connect(str(socket_path))
+        with s.makefile('rwb') as f:
+            f.write((json.dumps(request) + '\n').encode())
+            f.flush()
+            return json.loads(f.readline())
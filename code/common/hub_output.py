@@ -0,0 +1,190 @@
+import datetime
+import functools
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather
+import pyarrow.parquet
+
+
+# file formats for model outputs supported by hubverse hubs, and the file
+# name suffix used for each
+OUTPUT_FORMATS = ['csv', 'parquet', 'arrow']
+FILE_SUFFIXES = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+# schema of the FluSight hub's model outputs, used if an output root is not in
+# a hub with a `hub-config/tasks.json` file
+FLUSIGHT_SCHEMA = pa.schema([
+    ('reference_date', pa.date32()),
+    ('target', pa.string()),
+    ('horizon', pa.int32()),
+    ('location', pa.string()),
+    ('target_end_date', pa.date32()),
+    ('output_type', pa.string()),
+    ('output_type_id', pa.string()),
+    ('value', pa.float64())
+])
+
+
+def write_model_output(preds_df, save_path, output_format='csv', schema=None):
+    '''
+    Save model outputs in a hub-supported file format. The file is written to
+    a temporary file in the same directory and then renamed, so readers of
+    the hub never see a partially written file.
+    
+    Parameters
+    ----------
+    preds_df: Pandas data frame with model outputs in hub format
+    save_path: `pathlib.Path` of the file to save, with the suffix given by
+        `FILE_SUFFIXES[output_format]`
+    output_format: one of `OUTPUT_FORMATS`. 'csv' files are written as by
+        `preds_df.to_csv`; 'parquet' and 'arrow' (Arrow IPC) files are typed
+        according to `schema`
+    schema: `pyarrow.Schema` for 'parquet' and 'arrow' files; by default,
+        `FLUSIGHT_SCHEMA`. See `get_hub_schema`.
+    '''
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'output_format must be one of {OUTPUT_FORMATS}')
+    
+    tmp_path = save_path.with_name(save_path.name + f'.tmp{os.getpid()}')
+    try:
+        if output_format == 'csv':
+            preds_df.to_csv(tmp_path, index=False)
+        else:
+            if schema is None:
+                schema = FLUSIGHT_SCHEMA
+            table = pa.Table.from_pandas(_conform(preds_df, schema),
+                                         schema=schema, preserve_index=False)
+            if output_format == 'parquet':
+                pyarrow.parquet.write_table(table, tmp_path)
+            else:
+                pyarrow.feather.write_feather(table, tmp_path,
+                                              compression='uncompressed')
+        
+        os.replace(tmp_path, save_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def read_model_output(path):
+    '''
+    Load model outputs saved by `write_model_output` in any format.
+    
+    Parameters
+    ----------
+    path: `pathlib.Path` of the saved file
+    
+    Returns
+    -------
+    Pandas data frame with model outputs. Dates are `datetime64` columns, and
+    `location` and `output_type_id` are strings, for all formats.
+    '''
+    if path.suffix == '.parquet':
+        df = pd.read_parquet(path)
+    elif path.suffix == '.arrow':
+        df = pyarrow.feather.read_table(path).to_pandas()
+    else:
+        df = pd.read_csv(path, dtype={'location': str, 'output_type_id': str})
+    
+    for c in ['reference_date', 'target_end_date']:
+        if c in df.columns:
+            df[c] = pd.to_datetime(df[c])
+    
+    return df
+
+
+@functools.lru_cache()
+def get_hub_schema(output_root):
+    '''
+    Schema for model outputs in the hub whose model outputs are saved in
+    `output_root`, derived from the hub's `hub-config/tasks.json` following
+    the hubverse conventions:
+    - task id columns, in the order they are listed in `tasks.json`, have
+      type date for values in format YYYY-MM-DD, int32 for integer values,
+      float64 for other numbers and string otherwise
+    - `output_type_id` has the type of the ids of all output types, and is
+      string if they have different types
+    - `value` is int32 if the values of all output types are integers, and
+      float64 otherwise
+    
+    Parameters
+    ----------
+    output_root: `pathlib.Path` with the hub's model output directory
+    
+    Returns
+    -------
+    `pyarrow.Schema`; `FLUSIGHT_SCHEMA` if `output_root` is not in a hub with
+    a `tasks.json` file
+    '''
+    tasks_path = output_root.parent / 'hub-config' / 'tasks.json'
+    if not tasks_path.exists():
+        return FLUSIGHT_SCHEMA
+    
+    with open(tasks_path) as f:
+        tasks = json.load(f)
+    
+    task_id_values = dict()
+    output_type_ids = list()
+    value_types = set()
+    for model_round in tasks['rounds']:
+        for model_task in model_round['model_tasks']:
+            for task_id, spec in model_task['task_ids'].items():
+                task_id_values.setdefault(task_id, []).extend(_spec_values(spec))
+            for output_type in model_task['output_type'].values():
+                output_type_ids.extend(_spec_values(output_type['output_type_id']))
+                value_types.add(output_type['value']['type'])
+    
+    fields = [(task_id, _infer_type(values)) for task_id, values in task_id_values.items()]
+    id_type = _infer_type(output_type_ids)
+    if id_type == pa.date32():
+        id_type = pa.string()
+    value_type = pa.int32() if value_types == {'integer'} else pa.float64()
+    fields += [('output_type', pa.string()),
+               ('output_type_id', id_type),
+               ('value', value_type)]
+    
+    return pa.schema(fields)
+
+
+def _conform(preds_df, schema):
+    # columns of preds_df in schema order; numbers and strings such as
+    # quantile levels are converted to the type in the schema
+    df = preds_df[schema.names].copy()
+    for field in schema:
+        if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+            df[field.name] = pd.to_numeric(df[field.name])
+        elif pa.types.is_string(field.type):
+            df[field.name] = df[field.name].astype(str)
+    
+    return df
+
+
+def _spec_values(spec):
+    # all values listed as required or optional for a task id or output type id
+    if 'required' not in spec:
+        return []
+    
+    return (spec['required'] or []) + (spec['optional'] or [])
+
+
+def _infer_type(values):
+    if len(values) > 0 and all(isinstance(v, str) and _is_date(v) for v in values):
+        return pa.date32()
+    
+    if len(values) > 0 and all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return pa.int32()
+    
+    if len(values) > 0 and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return pa.float64()
+    
+    return pa.string()
+
+
+def _is_date(value):
+    try:
+        datetime.date.fromisoformat(value)
+        return len(value) == 10
+    except ValueError:
+        return False
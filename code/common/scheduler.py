@@ -0,0 +1,370 @@
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+import pandas as pd
+
+from hub_output import FILE_SUFFIXES
+
+
+# directories of the entry points for the model types that jobs can run
+GBQ_DIR = Path(__file__).resolve().parent.parent / 'gbq'
+SARIX_DIR = Path(__file__).resolve().parent.parent / 'sarix_model'
+
+# name of the progress log in a scheduler's log directory
+PROGRESS_FILE = 'progress.jsonl'
+
+# environment variables limiting the threads of OpenMP and BLAS libraries
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+# command line arguments that can be a job's `threads_arg`: they set the
+# number of threads of the models' entry points without affecting their
+# results, so they can be lowered to run a job on fewer cores
+THREADS_ARGS = ['--num_threads']
+
+
+def make_job(model_name, ref_date, command, cwd, output_root, threads=1,
+             threads_arg=None, output_model_names=None):
+    '''
+    Describe a job that runs one model, or several models, for one reference
+    date as a command in a separate process.
+    
+    Parameters
+    ----------
+    model_name: string name of the model, identifying the job
+    ref_date: reference date, as a `datetime.date` object or a string in
+        format YYYY-MM-DD
+    command: list of strings with the command and its arguments
+    cwd: `pathlib.Path` with the working directory of the command
+    output_root: `pathlib.Path` with the root directory in which the command
+        saves model outputs; relative paths are relative to the current
+        working directory
+    threads: integer number of cores the job uses
+    threads_arg: optional command line argument in `command` whose value is
+        the number of threads the command uses, one of `THREADS_ARGS`; when
+        the job is run on fewer cores than `threads`, as by a `work_queue`
+        worker with fewer cores, its value is set to the number of cores the
+        job is run on. Arguments that affect the results of the command, such
+        as `--num_chains` of `sarix_model.py`, are not accepted, so that the
+        results do not depend on the host running the job
+    output_model_names: optional list of names of the models whose outputs
+        the command saves; by default, `model_name`. The job is complete when
+        the outputs of all of them exist
+    
+    Returns
+    -------
+    dictionary describing the job
+    '''
+    if threads_arg is not None and threads_arg not in THREADS_ARGS:
+        raise ValueError(f'threads_arg must be one of {THREADS_ARGS}, which '
+                         'do not affect the results of a job')
+    
+    return {
+        'model_name': model_name,
+        'ref_date': str(ref_date),
+        'command': [str(arg) for arg in command],
+        'cwd': str(cwd),
+        'output_root': str(Path(output_root).resolve()),
+        'threads': threads,
+        'threads_arg': threads_arg,
+        'output_model_names': output_model_names or [model_name]
+    }
+
+
+def gbq_job(model_name, ref_date, output_root, threads=1, args=[]):
+    '''
+    Job that runs a gbq model with `gbq.py`, with LightGBM limited to
+    `threads` threads in total.
+    
+    Parameters
+    ----------
+    model_name, ref_date, output_root, threads: as for `make_job`
+    args: list of further command line arguments to `gbq.py`
+    
+    Returns
+    -------
+    dictionary describing the job
+    '''
+    output_root = Path(output_root).resolve()
+    command = [sys.executable, 'gbq.py',
+               '--model_name', model_name,
+               '--ref_date', ref_date,
+               '--output_root', output_root,
+               '--num_threads', threads] + args
+    return make_job(model_name, ref_date, command, GBQ_DIR, output_root, threads,
+                    threads_arg='--num_threads')
+
+
+def gbq_batch_job(model_names, ref_date, output_root, threads=1, args=[]):
+    '''
+    Job that runs several gbq models for one reference date with `batch.py`,
+    which loads and featurizes the data once for models with the same data
+    settings, with LightGBM limited to `threads` threads. The job is named
+    by joining the model names with '+'.
+    
+    Parameters
+    ----------
+    model_names: list of model names
+    ref_date, output_root, threads: as for `make_job`
+    args: list of further command line arguments to `batch.py`
+    
+    Returns
+    -------
+    dictionary describing the job
+    '''
+    output_root = Path(output_root).resolve()
+    command = [sys.executable, 'batch.py',
+               '--model_names'] + list(model_names) + [
+               '--ref_dates', ref_date,
+               '--output_root', output_root,
+               '--num_threads', threads] + args
+    return make_job('+'.join(model_names), ref_date, command, GBQ_DIR, output_root,
+                    threads, threads_arg='--num_threads',
+                    output_model_names=list(model_names))
+
+
+def sarix_job(model_name, ref_date, output_root, threads=1, num_chains=None,
+              args=[]):
+    '''
+    Job that runs a SARIX model with `sarix_model.py`, with JAX limited to
+    `threads` cores. The model's MCMC runs `num_chains` chains in parallel,
+    which split the samples between them.
+    
+    Parameters
+    ----------
+    model_name, ref_date, output_root, threads: as for `make_job`
+    num_chains: optional number of MCMC chains; by default, `threads`. The
+        chains determine the samples, so the number is fixed in the command:
+        a job run on fewer cores, as by a `work_queue` worker with fewer
+        cores, runs the same chains on those cores
+    args: list of further command line arguments to `sarix_model.py`
+    
+    Returns
+    -------
+    dictionary describing the job
+    '''
+    if num_chains is None:
+        num_chains = threads
+    
+    output_root = Path(output_root).resolve()
+    command = [sys.executable, 'sarix_model.py',
+               '--model_name', model_name,
+               '--ref_date', ref_date,
+               '--output_root', output_root,
+               '--num_chains', num_chains] + args
+    return make_job(model_name, ref_date, command, SARIX_DIR, output_root, threads)
+
+
+def run_jobs(jobs, log_dir, num_cores=None, max_attempts=3, poll_interval=1.0):
+    '''
+    Run jobs in separate processes, as many at a time as fit in the available
+    cores, given the number of cores each job uses. On Linux, each running job
+    is pinned to its own cores, and in all cases the thread pools of OpenMP,
+    BLAS and XLA in the job are limited to the job's number of cores.
+    
+    Jobs whose model outputs already exist in their `output_root`, or that
+    succeeded in an earlier call with the same `log_dir`, are skipped, so an
+    interrupted run can be resumed by repeating the call. Failed jobs are
+    retried, up to `max_attempts` attempts in each call.
+    
+    Progress is appended to `<log_dir>/progress.jsonl`, with one json record
+    when each attempt at a job starts and one when it ends. The output of each
+    job is appended to `<log_dir>/<model_name>/<ref_date>.log`.
+    
+    Parameters
+    ----------
+    jobs: list of jobs from `make_job`, `gbq_job`, `gbq_batch_job` or
+        `sarix_job`, which are started in order as cores become available
+    log_dir: `pathlib.Path` with the directory for the progress log and the
+        job outputs
+    num_cores: optional number of cores to use; by default, all cores
+        available to this process
+    max_attempts: maximum number of attempts at each job
+    poll_interval: number of seconds between checks for finished jobs
+    
+    Returns
+    -------
+    Pandas data frame with one row per job, giving the `model_name`,
+    `ref_date`, `status` ('success', 'skipped' or 'failed'), number of
+    `attempts` and elapsed time in `seconds` of the last attempt
+    '''
+    cores = available_cores()
+    if num_cores is not None:
+        cores = cores[:num_cores]
+    for job in jobs:
+        if job['threads'] > len(cores):
+            raise ValueError(f'job {_job_key(job)} uses {job["threads"]} cores, '
+                             f'but only {len(cores)} are available')
+    
+    log_dir.mkdir(parents=True, exist_ok=True)
+    succeeded = read_progress(log_dir)
+    
+    results = {_job_key(job): {'model_name': job['model_name'],
+                               'ref_date': job['ref_date'],
+                               'status': 'skipped', 'attempts': 0,
+                               'seconds': None} \
+               for job in jobs}
+    pending = deque(job for job in jobs \
+                    if _job_key(job) not in succeeded and not _output_exists(job))
+    free_cores = list(cores)
+    running = list()
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            # start the earliest pending jobs that fit in the free cores
+            for job in list(pending):
+                if job['threads'] <= len(free_cores):
+                    pending.remove(job)
+                    job_cores = free_cores[:job['threads']]
+                    del free_cores[:job['threads']]
+                    result = results[_job_key(job)]
+                    result['attempts'] += 1
+                    running.append((job, job_cores, _start_job(job, job_cores, log_dir),
+                                    time.time()))
+                    _log_progress(log_dir, job, 'started', attempt=result['attempts'])
+            
+            time.sleep(poll_interval)
+            
+            for job, job_cores, process, start_time in list(running):
+                returncode = process.poll()
+                if returncode is None:
+                    continue
+                
+                running.remove((job, job_cores, process, start_time))
+                free_cores.extend(job_cores)
+                free_cores.sort()
+                
+                result = results[_job_key(job)]
+                result['seconds'] = time.time() - start_time
+                if returncode == 0 and _output_exists(job):
+                    result['status'] = 'success'
+                else:
+                    result['status'] = 'failed'
+                    if result['attempts'] < max_attempts:
+                        pending.append(job)
+                _log_progress(log_dir, job, result['status'],
+                              attempt=result['attempts'], returncode=returncode,
+                              seconds=result['seconds'])
+    finally:
+        # on an interruption, stop the running jobs; they are rerun when the
+        # call is repeated
+        for _, _, process, _ in running:
+            process.terminate()
+        for _, _, process, _ in running:
+            process.wait()
+    
+    return pd.DataFrame(list(results.values()))
+
+
+def read_progress(log_dir):
+    '''
+    Jobs that have succeeded according to the progress log in `log_dir`.
+    
+    Parameters
+    ----------
+    log_dir: `pathlib.Path` with the log directory of `run_jobs`
+    
+    Returns
+    -------
+    set of (model_name, ref_date) tuples, with `ref_date` as a string
+    '''
+    progress_path = log_dir / PROGRESS_FILE
+    if not progress_path.exists():
+        return set()
+    
+    succeeded = set()
+    with open(progress_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a line that was being written when a run was interrupted
+                continue
+            if record['status'] == 'success':
+                succeeded.add((record['model_name'], record['ref_date']))
+    
+    return succeeded
+
+
+def available_cores():
+    '''
+    Cores available to this process.
+    
+    Returns
+    -------
+    sorted list of integer core ids
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    
+    return list(range(os.cpu_count()))
+
+
+def _start_job(job, job_cores, log_dir):
+    # the job's threads are limited to the cores it is run on, which are
+    # fewer than `job['threads']` on a worker with fewer cores
+    log_path = log_dir / job['model_name'] / f'{job["ref_date"]}.log'
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(log_path, 'ab') as log_file:
+        return subprocess.Popen(_job_command(job, len(job_cores)), cwd=job['cwd'],
+                                env=_thread_env(len(job_cores)),
+                                stdout=log_file, stderr=subprocess.STDOUT,
+                                preexec_fn=_pin_to_cores(job_cores))
+
+
+def _job_command(job, threads):
+    command = list(job['command'])
+    threads_arg = job.get('threads_arg')
+    if threads_arg is not None and threads != job['threads']:
+        # the value follows the argument; a later occurrence, as in the
+        # job's extra arguments, takes precedence with argparse
+        i = len(command) - 1 - command[::-1].index(threads_arg)
+        command[i + 1] = str(threads)
+    
+    return command
+
+
+def _thread_env(threads):
+    env = dict(os.environ)
+    for var in THREAD_ENV_VARS:
+        env[var] = str(threads)
+    
+    if threads == 1:
+        # XLA's CPU backend otherwise runs Eigen with a thread per core; with
+        # more threads, it is limited by pinning the job to its cores
+        xla_flags = env.get('XLA_FLAGS', '')
+        env['XLA_FLAGS'] = f'{xla_flags} --xla_cpu_multi_thread_eigen=false'.strip()
+    
+    return env
+
+
+def _pin_to_cores(job_cores):
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+    
+    return lambda: os.sched_setaffinity(0, job_cores)
+
+
+def _output_exists(job):
+    # jobs enqueued before jobs could run several models name a single model
+    return all(
+        any((Path(job['output_root']) / f'UMass-{model_name}' /
+             f'{job["ref_date"]}-UMass-{model_name}{suffix}').exists() \
+            for suffix in FILE_SUFFIXES.values()) \
+        for model_name in job.get('output_model_names', [job['model_name']]))
+
+
+def _log_progress(log_dir, job, status, **kwargs):
+    record = {'time': datetime.datetime.now().isoformat(timespec='seconds'),
+              'model_name': job['model_name'], 'ref_date': job['ref_date'],
+              'status': status, **kwargs}
+    with open(log_dir / PROGRESS_FILE, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def _job_key(job):
+    return (job['model_name'], job['ref_date'])
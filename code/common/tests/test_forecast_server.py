@@ -0,0 +1,41 @@
+import threading
+import time
+from pathlib import Path
+
+from forecast_server import DataCache, serve, stop, submit
+
+
+def test_forecast_server_runs_jobs(tmp_path, monkeypatch):
+    socket_path = tmp_path / 'server.sock'
+    loads = list()
+    cache = DataCache(max_entries=1)
+    
+    def run_job(argv):
+        ref_date, = argv
+        if ref_date == 'bad':
+            raise ValueError('bad reference date')
+        
+        cache.get(ref_date, lambda: loads.append(ref_date))
+        # relative paths are relative to the client's working directory
+        save_path = Path('model-output') / f'{ref_date}.csv'
+        save_path.parent.mkdir(exist_ok=True)
+        save_path.write_text('')
+        return save_path
+    
+    server = threading.Thread(target=serve, args=(socket_path, run_job))
+    server.start()
+    while not socket_path.exists():
+        time.sleep(0.01)
+    
+    monkeypatch.chdir(tmp_path)
+    responses = [submit(socket_path, [ref_date]) \
+                 for ref_date in ['2024-01-06', '2024-01-06', 'bad', '2024-01-13']]
+    stop(socket_path)
+    server.join()
+    
+    assert [r['status'] for r in responses] == ['success', 'success', 'failed', 'success']
+    assert responses[0]['save_path'] == str(tmp_path.resolve() / 'model-output' / '2024-01-06.csv')
+    assert 'bad reference date' in responses[2]['error']
+    # data are loaded once per reference date
+    assert loads == ['2024-01-06', '2024-01-13']
+    assert not socket_path.exists()
@@ -0,0 +1,35 @@
+import datetime
+
+import pandas as pd
+
+from hub_output import FILE_SUFFIXES, FLUSIGHT_SCHEMA, OUTPUT_FORMATS, \
+    read_model_output, write_model_output
+
+
+def test_write_model_output_formats_round_trip(tmp_path):
+    preds_df = pd.DataFrame({
+        'location': ['01', 'US'],
+        'reference_date': datetime.date(2024, 3, 30),
+        'horizon': [0, 1],
+        'target_end_date': pd.to_datetime(['2024-03-30', '2024-04-06']),
+        'target': 'wk inc flu hosp',
+        'output_type': 'quantile',
+        'output_type_id': ['0.1', '0.5'],
+        'value': [1.5, 2.5]
+    })
+    
+    dfs = dict()
+    for output_format in OUTPUT_FORMATS:
+        save_path = tmp_path / f'2024-03-30-UMass-gbq_qr{FILE_SUFFIXES[output_format]}'
+        write_model_output(preds_df, save_path, output_format)
+        dfs[output_format] = read_model_output(save_path)
+    
+    # no temporary files are left behind
+    assert len(list(tmp_path.iterdir())) == len(OUTPUT_FORMATS)
+    
+    expected = dfs['csv'][FLUSIGHT_SCHEMA.names]
+    for output_format in ['parquet', 'arrow']:
+        actual = dfs[output_format]
+        assert list(actual.columns) == FLUSIGHT_SCHEMA.names
+        assert actual['horizon'].dtype == 'int32'
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
@@ -0,0 +1,81 @@
+import json
+import sys
+
+import pytest
+
+from scheduler import PROGRESS_FILE, _job_command, _output_exists, gbq_batch_job, \
+    make_job, run_jobs, sarix_job
+
+
+# writes a model output file, failing on the first attempt if asked to
+SCRIPT = '''
+import os, sys
+from pathlib import Path
+output_root, model_name, ref_date, fail_first = sys.argv[1:]
+attempts_path = Path(output_root) / f'{model_name}-{ref_date}.attempts'
+attempts = int(attempts_path.read_text()) + 1 if attempts_path.exists() else 1
+attempts_path.write_text(str(attempts))
+if fail_first == 'True' and attempts == 1:
+    sys.exit(1)
+output_dir = Path(output_root) / f'UMass-{model_name}'
+output_dir.mkdir(exist_ok=True)
+(output_dir / f'{ref_date}-UMass-{model_name}.csv').write_text(os.environ['OMP_NUM_THREADS'])
+'''
+
+
+def _job(tmp_path, model_name, ref_date, fail_first=False):
+    output_root = tmp_path / 'model-output'
+    command = [sys.executable, '-c', SCRIPT, output_root, model_name, ref_date, fail_first]
+    return make_job(model_name, ref_date, command, tmp_path, output_root)
+
+
+def test_run_jobs_retries_and_resumes(tmp_path):
+    (tmp_path / 'model-output' / 'UMass-a').mkdir(parents=True)
+    (tmp_path / 'model-output' / 'UMass-a' / '2024-01-06-UMass-a.csv').write_text('')
+    jobs = [_job(tmp_path, 'a', '2024-01-06'),
+            _job(tmp_path, 'a', '2024-01-13', fail_first=True),
+            _job(tmp_path, 'b', '2024-01-06')]
+    
+    manifest = run_jobs(jobs, tmp_path / 'logs', num_cores=1, poll_interval=0.01)
+    assert manifest['status'].tolist() == ['skipped', 'success', 'success']
+    assert manifest['attempts'].tolist() == [0, 2, 1]
+    assert (tmp_path / 'model-output' / 'UMass-b' / '2024-01-06-UMass-b.csv').read_text() == '1'
+    
+    with open(tmp_path / 'logs' / PROGRESS_FILE) as f:
+        statuses = [(r['model_name'], r['ref_date'], r['status']) for r in map(json.loads, f)]
+    assert statuses == [('a', '2024-01-13', 'started'), ('a', '2024-01-13', 'failed'),
+                        ('b', '2024-01-06', 'started'), ('b', '2024-01-06', 'success'),
+                        ('a', '2024-01-13', 'started'), ('a', '2024-01-13', 'success')]
+    
+    # a repeated run skips the jobs that succeeded, even if the output is gone
+    (tmp_path / 'model-output' / 'UMass-b' / '2024-01-06-UMass-b.csv').unlink()
+    manifest = run_jobs(jobs, tmp_path / 'logs', num_cores=1, poll_interval=0.01)
+    assert manifest['status'].tolist() == ['skipped'] * 3
+
+
+def test_sarix_job_chains_do_not_depend_on_cores(tmp_path):
+    # the job keeps its chains when run on fewer cores than it was made for
+    job = sarix_job('sarix', '2024-01-06', tmp_path, threads=4)
+    command = _job_command(job, 1)
+    assert command[command.index('--num_chains') + 1] == '4'
+    
+    job = sarix_job('sarix', '2024-01-06', tmp_path, threads=4, num_chains=1)
+    command = _job_command(job, 1)
+    assert command[command.index('--num_chains') + 1] == '1'
+
+
+def test_make_job_rejects_threads_args_that_change_results(tmp_path):
+    with pytest.raises(ValueError):
+        make_job('sarix', '2024-01-06', ['sarix_model.py', '--num_chains', 4],
+                 tmp_path, tmp_path, threads=4, threads_arg='--num_chains')
+
+
+def test_gbq_batch_job_is_complete_with_all_model_outputs(tmp_path):
+    job = gbq_batch_job(['a', 'b'], '2024-01-06', tmp_path, threads=2)
+    assert job['model_name'] == 'a+b'
+    
+    for model_name in ['a', 'b']:
+        assert not _output_exists(job)
+        (tmp_path / f'UMass-{model_name}').mkdir()
+        (tmp_path / f'UMass-{model_name}' / f'2024-01-06-UMass-{model_name}.csv').write_text('')
+    assert _output_exists(job)
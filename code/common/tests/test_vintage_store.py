@@ -0,0 +1,54 @@
+import datetime
+
+import pandas as pd
+
+from vintage_store import VintageStore, read_all_rows
+
+
+class FakeLoader():
+    def __init__(self):
+        self.calls = list()
+    
+    
+    def load_data(self, nhsn_kwargs=None, sources=None, power_transform='4rt'):
+        as_of = nhsn_kwargs['as_of']
+        self.calls.append(as_of)
+        num_weeks = 3 if as_of == datetime.date(2024, 1, 6) else 4
+        df = pd.DataFrame({
+            'source': 'nhsn',
+            'location': ['US'] * num_weeks + ['01'] * num_weeks,
+            'wk_end_date': list(pd.date_range('2023-12-16', periods=num_weeks, freq='7D')) * 2,
+            'inc': [float(w) for w in range(num_weeks)] + [100.0 + w for w in range(num_weeks)],
+            'season_week': list(range(num_weeks)) * 2
+        })
+        if as_of == datetime.date(2024, 1, 13):
+            # a revision to an earlier week
+            df.loc[1, 'inc'] = 10.0
+        
+        return df
+
+
+def test_vintage_store_round_trip_and_dedup(tmp_path):
+    fdl = VintageStore(tmp_path)
+    loader = FakeLoader()
+    fdl._loader = loader
+    
+    as_of_dates = [datetime.date(2024, 1, 6), datetime.date(2024, 1, 13)]
+    expected = [fdl.load_data(nhsn_kwargs={'as_of': as_of}, sources=['nhsn']) \
+                for as_of in as_of_dates]
+    assert loader.calls == as_of_dates
+    
+    # stored vintages are read from the store, with the same data
+    fdl = VintageStore(tmp_path)
+    fdl._loader = FakeLoader()
+    for as_of, df in zip(as_of_dates, expected):
+        actual = fdl.load_data(nhsn_kwargs={'as_of': as_of}, sources=['nhsn'])
+        pd.testing.assert_frame_equal(actual, df)
+    assert fdl._loader.calls == []
+    
+    # rows that were not revised are stored once; the second vintage added
+    # one revised row and two new weeks
+    entry_dir = next(tmp_path.iterdir())
+    rows = read_all_rows(entry_dir)
+    assert rows.shape[0] == 6 + 3
+    assert (rows['_report_date'] == pd.Timestamp(as_of_dates[1])).sum() == 3
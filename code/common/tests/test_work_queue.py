@@ -0,0 +1,91 @@
+import sys
+from multiprocessing import Pool
+
+from scheduler import make_job
+from work_queue import enqueue, queue_status, run_worker
+
+
+# records the run in a file and writes a model output file
+SCRIPT = '''
+import sys, time
+from pathlib import Path
+output_root, model_name, ref_date = sys.argv[1:]
+with open(Path(output_root) / 'runs.txt', 'a') as f:
+    f.write(f'{model_name} {ref_date}\\n')
+time.sleep(0.1)
+output_dir = Path(output_root) / f'UMass-{model_name}'
+output_dir.mkdir(exist_ok=True)
+(output_dir / f'{ref_date}-UMass-{model_name}.csv').write_text('')
+'''
+
+
+def _jobs(tmp_path):
+    output_root = tmp_path / 'model-output'
+    output_root.mkdir(exist_ok=True)
+    return [
+        make_job(model_name, ref_date,
+                 [sys.executable, '-c', SCRIPT, output_root, model_name, ref_date],
+                 tmp_path, output_root) \
+        for model_name in ['a', 'b'] for ref_date in ['2024-01-06', '2024-01-13', '2024-01-20']
+    ]
+
+
+def _run_worker(queue_dir):
+    return run_worker(queue_dir, num_cores=1, poll_interval=0.01)
+
+
+def test_workers_run_each_job_once(tmp_path):
+    queue_dir = tmp_path / 'queue'
+    enqueue(queue_dir, _jobs(tmp_path))
+    # enqueueing the same jobs again, as every worker's script does, does
+    # not add them twice
+    enqueue(queue_dir, _jobs(tmp_path))
+    
+    with Pool(processes=3) as pool:
+        pool.map(_run_worker, [queue_dir] * 3)
+    
+    runs = (tmp_path / 'model-output' / 'runs.txt').read_text().splitlines()
+    assert sorted(runs) == sorted(f'{job["model_name"]} {job["ref_date"]}' for job in _jobs(tmp_path))
+    status = queue_status(queue_dir)
+    assert len(status) == 6
+    assert (status['status'] == 'success').all()
+
+
+def test_stale_claim_is_taken_over(tmp_path):
+    queue_dir = tmp_path / 'queue'
+    jobs = _jobs(tmp_path)[:1]
+    enqueue(queue_dir, jobs)
+    # a claim by a worker that stopped without releasing it
+    (queue_dir / 'claims' / '2024-01-06-UMass-a').write_text('stopped-worker')
+    assert queue_status(queue_dir)['status'].tolist() == ['running']
+    
+    status = run_worker(queue_dir, num_cores=1, stale_after=0.2, poll_interval=0.01)
+    assert status['status'].tolist() == ['success']
+
+
+# writes the number of threads it was given to its model output file
+THREADS_SCRIPT = '''
+import os, sys
+from pathlib import Path
+output_root, model_name, ref_date, _, threads = sys.argv[1:]
+output_dir = Path(output_root) / f'UMass-{model_name}'
+output_dir.mkdir(exist_ok=True)
+(output_dir / f'{ref_date}-UMass-{model_name}.csv').write_text(f'{threads} {os.environ["OMP_NUM_THREADS"]}')
+'''
+
+
+def test_job_threads_are_limited_to_worker_cores(tmp_path):
+    queue_dir = tmp_path / 'queue'
+    output_root = tmp_path / 'model-output'
+    output_root.mkdir()
+    # a job enqueued by a host with 16 cores
+    job = make_job('a', '2024-01-06',
+                   [sys.executable, '-c', THREADS_SCRIPT, output_root, 'a', '2024-01-06',
+                    '--num_threads', 16],
+                   tmp_path, output_root, threads=16, threads_arg='--num_threads')
+    enqueue(queue_dir, [job])
+    
+    status = run_worker(queue_dir, num_cores=1, poll_interval=0.01)
+    
+    assert status['status'].tolist() == ['success']
+    assert (output_root / 'UMass-a' / '2024-01-06-UMass-a.csv').read_text() == '1 1'
@@ -0,0 +1,272 @@
+import fcntl
+import hashlib
+import importlib
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather
+
+
+# increment when the layout of stored files changes
+STORE_VERSION = 1
+
+# name of the file listing the vintages in a store entry; it is written last
+# when a vintage is added
+INDEX_FILE = 'index.json'
+
+# column added to the stored rows, with the first vintage that contained
+# the row
+REPORT_DATE_COL = '_report_date'
+
+
+class VintageStore():
+    '''
+    Local bitemporal store of the data returned by `FluDataLoader.load_data`,
+    usable in its place.
+    
+    For each combination of loader settings other than the nhsn `as_of` date,
+    the store holds every distinct row returned for any `as_of` date (data
+    vintage) once, in an uncompressed Arrow IPC file that is memory-mapped
+    when read, together with the report date on which each row was first
+    seen. Each vintage is stored as the array of the positions of its rows.
+    A vintage that has been stored is served from the local files, without
+    any network access; other vintages are loaded with `FluDataLoader` and
+    added to the store.
+    '''
+    def __init__(self, store_dir):
+        '''
+        Parameters
+        ----------
+        store_dir: `pathlib.Path` with the directory of the store
+        '''
+        self.store_dir = store_dir
+        self._loader = None
+    
+    
+    def load_data(self, nhsn_kwargs=None, **kwargs):
+        '''
+        Load flu data, as for `FluDataLoader.load_data` with the same
+        arguments. Data for an nhsn `as_of` date that was loaded before are
+        read from the store.
+        
+        Returns
+        -------
+        Pandas data frame with the same rows, in the same order, and columns
+        as returned by `FluDataLoader.load_data`, with a default index
+        '''
+        as_of = None if nhsn_kwargs is None else nhsn_kwargs.get('as_of')
+        if as_of is None:
+            # the latest data are not a fixed vintage, so they are not stored
+            return self._load(nhsn_kwargs, kwargs)
+        
+        entry_dir = self.store_dir / get_settings_key(nhsn_kwargs, kwargs)
+        df = read_vintage(entry_dir, as_of)
+        if df is None:
+            df = self._load(nhsn_kwargs, kwargs).reset_index(drop=True)
+            add_vintage(entry_dir, as_of, df,
+                        settings=_settings(nhsn_kwargs, kwargs))
+        
+        return df
+    
+    
+    def _load(self, nhsn_kwargs, kwargs):
+        # the loader is only imported and created if data have to be loaded
+        if self._loader is None:
+            self._loader = importlib.import_module('iddata.loader').FluDataLoader()
+        
+        return self._loader.load_data(nhsn_kwargs=nhsn_kwargs, **kwargs)
+
+
+def get_settings_key(nhsn_kwargs, kwargs):
+    '''
+    Key identifying a combination of loader settings other than the nhsn
+    `as_of` date. Arguments that are None are the same as arguments that are
+    not given.
+    
+    Parameters
+    ----------
+    nhsn_kwargs: dictionary of nhsn arguments to `FluDataLoader.load_data`
+    kwargs: dictionary of other arguments to `FluDataLoader.load_data`
+    
+    Returns
+    -------
+    hex string
+    '''
+    settings = _settings(nhsn_kwargs, kwargs)
+    h = hashlib.sha256()
+    h.update(json.dumps([STORE_VERSION, settings], sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def read_vintage(entry_dir, as_of):
+    '''
+    Read one data vintage from a store entry.
+    
+    Parameters
+    ----------
+    entry_dir: `pathlib.Path` with the directory of the store entry
+    as_of: `datetime.date` with the nhsn `as_of` date of the vintage
+    
+    Returns
+    -------
+    Pandas data frame, or None if the vintage is not in the store
+    '''
+    if not (entry_dir / INDEX_FILE).exists():
+        return None
+    
+    with _locked(entry_dir, shared=True):
+        index = _read_index(entry_dir)
+        if str(as_of) not in index['vintages']:
+            return None
+        
+        rows = np.load(_vintage_path(entry_dir, as_of), mmap_mode='r')
+        with pa.memory_map(str(entry_dir / index['rows_file'])) as source:
+            table = pa.ipc.open_file(source).read_all()
+            df = table.take(pa.array(rows)).drop([REPORT_DATE_COL]).to_pandas()
+    
+    return df
+
+
+def read_all_rows(entry_dir):
+    '''
+    Read all distinct rows in a store entry, with the report date on which
+    each was first seen.
+    
+    Parameters
+    ----------
+    entry_dir: `pathlib.Path` with the directory of the store entry
+    
+    Returns
+    -------
+    Pandas data frame with the columns of the stored data and a
+    `_report_date` column
+    '''
+    if not (entry_dir / INDEX_FILE).exists():
+        return None
+    
+    with _locked(entry_dir, shared=True):
+        return _read_rows(entry_dir, _read_index(entry_dir))
+
+
+def add_vintage(entry_dir, as_of, df, settings=None):
+    '''
+    Add a data vintage to a store entry. Rows that are identical to rows of
+    an earlier vintage are not stored again.
+    
+    Parameters
+    ----------
+    entry_dir: `pathlib.Path` with the directory of the store entry
+    as_of: `datetime.date` with the nhsn `as_of` date of the vintage
+    df: Pandas data frame with the data for the vintage, with a default index
+    settings: optional json-serializable loader settings, recorded in the
+        store entry for reference
+    '''
+    entry_dir.mkdir(parents=True, exist_ok=True)
+    with _locked(entry_dir):
+        index = _read_index(entry_dir)
+        if str(as_of) in index['vintages']:
+            return
+        
+        # positions of the rows of df among the stored rows, adding rows that
+        # are not stored yet at the end
+        row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        stored = None
+        if index['rows_file'] is not None:
+            stored = _read_rows(entry_dir, index)
+            if list(stored.columns[:-1]) != list(df.columns) or \
+                    not stored.dtypes[:-1].equals(df.dtypes):
+                raise ValueError(f'the columns of the data for {as_of} do not '
+                                 f'match those stored in {entry_dir}; use a '
+                                 'new vintage store directory')
+            stored_hashes = pd.util.hash_pandas_object(
+                stored.drop(columns=REPORT_DATE_COL), index=False).to_numpy()
+        else:
+            stored_hashes = np.empty(0, dtype=np.uint64)
+        
+        position_by_hash = dict(zip(stored_hashes, range(len(stored_hashes))))
+        rows = np.empty(len(df), dtype=np.int64)
+        new_rows = list()
+        for i, h in enumerate(row_hashes):
+            if h not in position_by_hash:
+                position_by_hash[h] = len(stored_hashes) + len(new_rows)
+                new_rows.append(i)
+            rows[i] = position_by_hash[h]
+        
+        # stored rows are only ever appended, so the positions of earlier
+        # vintages remain valid
+        if len(new_rows) > 0:
+            new_df = df.iloc[new_rows].assign(**{REPORT_DATE_COL: pd.Timestamp(as_of)})
+            if stored is not None:
+                new_df = pd.concat([stored, new_df], axis=0, ignore_index=True)
+            rows_file = f'rows_{len(index["vintages"]):04d}.arrow'
+            _write_atomic(entry_dir / rows_file,
+                          lambda path: pyarrow.feather.write_feather(
+                              new_df.reset_index(drop=True), path,
+                              compression='uncompressed'))
+            old_rows_file = index['rows_file']
+            index['rows_file'] = rows_file
+        else:
+            old_rows_file = None
+        
+        _write_atomic(_vintage_path(entry_dir, as_of),
+                      lambda path: np.save(path, rows, allow_pickle=False))
+        
+        index['vintages'].append(str(as_of))
+        index['vintages'].sort()
+        index['settings'] = settings
+        _write_atomic(entry_dir / INDEX_FILE,
+                      lambda path: path.write_text(json.dumps(index, indent=2)))
+        
+        # readers hold the lock while reading, so none has the earlier rows
+        # file open
+        if old_rows_file is not None:
+            (entry_dir / old_rows_file).unlink(missing_ok=True)
+
+
+def _read_rows(entry_dir, index):
+    with pa.memory_map(str(entry_dir / index['rows_file'])) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+def _settings(nhsn_kwargs, kwargs):
+    nhsn_kwargs = {k: v for k, v in (nhsn_kwargs or {}).items() \
+                   if k != 'as_of' and v is not None}
+    settings = {k: v for k, v in kwargs.items() if v is not None}
+    settings['nhsn_kwargs'] = nhsn_kwargs
+    return settings
+
+
+def _read_index(entry_dir):
+    try:
+        with open(entry_dir / INDEX_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'rows_file': None, 'vintages': [], 'settings': None}
+
+
+def _vintage_path(entry_dir, as_of):
+    return entry_dir / f'vintage_{as_of}.npy'
+
+
+def _write_atomic(path, write):
+    # write to a temporary file and rename, so that readers never see a
+    # partially written file
+    tmp_path = path.with_name(f'.tmp{os.getpid()}_{path.name}')
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _locked(entry_dir, shared=False):
+    # vintages are added by one process at a time, while no other process is
+    # reading from the store entry
+    with open(entry_dir / '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,355 @@
+import argparse
+import json
+import os
+import socket
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+from scheduler import _job_key, _output_exists, _start_job, available_cores
+
+
+# subdirectories of a queue directory:
+# - `jobs`: one json file per job, written by `enqueue`
+# - `claims`: one file per running job, created by the worker running it and
+#   touched periodically while the job runs
+# - `done`: one json file per successful job
+# - `failures`: one json file per failed attempt at a job
+# - `logs`: the output of each job, as for `scheduler.run_jobs`
+QUEUE_SUBDIRS = ['jobs', 'claims', 'done', 'failures', 'logs']
+
+
+def enqueue(queue_dir, jobs):
+    '''
+    Add jobs to a work queue in a directory shared by the workers, for
+    example on an NFS share. Jobs that are already in the queue are not
+    added again, so all workers can enqueue the same grid of jobs.
+    
+    Parameters
+    ----------
+    queue_dir: `pathlib.Path` with the queue directory
+    jobs: list of jobs from `scheduler.make_job`, `scheduler.gbq_job`,
+        `scheduler.gbq_batch_job` or `scheduler.sarix_job`. Paths in the jobs must be valid on all hosts
+        that run workers.
+    '''
+    for subdir in QUEUE_SUBDIRS:
+        (queue_dir / subdir).mkdir(parents=True, exist_ok=True)
+    
+    for i, job in enumerate(jobs):
+        job_path = _job_path(queue_dir, 'jobs', job, '.json')
+        if not job_path.exists():
+            # jobs are run in the order they were enqueued
+            _write_atomic(job_path, dict(job, order=i))
+
+
+def run_worker(queue_dir, num_cores=None, max_attempts=3, heartbeat_interval=30.0,
+               stale_after=300.0, poll_interval=1.0):
+    '''
+    Run jobs from a work queue until every job has succeeded or failed
+    `max_attempts` times. Any number of workers, on any hosts that share the
+    queue directory, can run at the same time; each runs as many jobs at a
+    time as fit in its cores, as for `scheduler.run_jobs`. A job that uses
+    more cores than the worker has is run on all of the worker's cores, with
+    its thread pools and its `threads_arg` (see `scheduler.make_job`) set to
+    the worker's number of cores; a `threads_arg` does not affect the results
+    of a job, so they do not depend on the worker running it.
+    
+    A worker claims a job by creating its claim file, which fails if another
+    worker has claimed the job, and touches the claim file every
+    `heartbeat_interval` seconds while the job runs. A claim file that has not
+    been touched for `stale_after` seconds, as timed by the worker looking at
+    it, belongs to a worker that has stopped; its job is claimed again. A
+    worker stops a job if it finds that its claim was taken over. Jobs whose
+    outputs already exist are recorded as done without running them.
+    
+    Parameters
+    ----------
+    queue_dir: `pathlib.Path` with the queue directory
+    num_cores: optional number of cores to use; by default, all cores
+        available to this process
+    max_attempts: maximum number of attempts at each job, across all workers
+    heartbeat_interval: number of seconds between touches of claim files
+    stale_after: number of seconds after which a claim file that has not
+        been touched is considered stale; should be several times
+        `heartbeat_interval`
+    poll_interval: number of seconds between checks of the queue
+    
+    Returns
+    -------
+    Pandas data frame from `queue_status` when the worker stops
+    '''
+    _check_queue(queue_dir)
+    cores = available_cores()
+    if num_cores is not None:
+        cores = cores[:num_cores]
+    
+    worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    free_cores = list(cores)
+    running = dict()
+    # modification times of other workers' claim files, and the time they
+    # were first seen with that modification time
+    claims_seen = dict()
+    last_heartbeat = time.time()
+    try:
+        while True:
+            jobs = _read_jobs(queue_dir)
+            done, num_failures = _read_finished(queue_dir)
+            num_open = 0
+            for job in jobs:
+                key = _job_key(job)
+                if key in running or _job_name(job) in done or \
+                        num_failures.get(_job_name(job), 0) >= max_attempts:
+                    continue
+                
+                num_open += 1
+                # jobs enqueued by a host with more cores use all of the
+                # cores of this worker, with their threads limited to them;
+                # `scheduler.make_job` only accepts a threads_arg that does
+                # not change the results
+                num_job_cores = min(job['threads'], len(cores))
+                if num_job_cores > len(free_cores):
+                    continue
+                
+                claim_path = _job_path(queue_dir, 'claims', job, '')
+                if not _claim(claim_path, worker_id):
+                    if _is_stale(claim_path, claims_seen, stale_after):
+                        _break_claim(claim_path)
+                    continue
+                
+                # the job may have finished since the queue was read, or
+                # its outputs may have been made outside of the queue
+                done_path = _job_path(queue_dir, 'done', job, '.json')
+                if done_path.exists() or _output_exists(job):
+                    if not done_path.exists():
+                        _write_atomic(done_path, {'worker': worker_id, 'skipped': True})
+                    claim_path.unlink(missing_ok=True)
+                    continue
+                
+                job_cores = free_cores[:num_job_cores]
+                del free_cores[:num_job_cores]
+                process = _start_job(job, job_cores, queue_dir / 'logs')
+                running[key] = (job, job_cores, process, time.time())
+            
+            if len(running) == 0 and num_open == 0:
+                break
+            
+            time.sleep(poll_interval)
+            
+            heartbeat = time.time() - last_heartbeat >= heartbeat_interval
+            if heartbeat:
+                last_heartbeat = time.time()
+            for key, (job, job_cores, process, start_time) in list(running.items()):
+                claim_path = _job_path(queue_dir, 'claims', job, '')
+                returncode = process.poll()
+                if returncode is None:
+                    if heartbeat and not _heartbeat(claim_path, worker_id):
+                        # another worker took over the job
+                        process.terminate()
+                        process.wait()
+                        del running[key]
+                        free_cores = sorted(free_cores + job_cores)
+                    continue
+                
+                del running[key]
+                free_cores = sorted(free_cores + job_cores)
+                record = {'worker': worker_id, 'returncode': returncode,
+                          'seconds': time.time() - start_time}
+                if not _owns_claim(claim_path, worker_id):
+                    continue
+                
+                if returncode == 0 and _output_exists(job):
+                    _write_atomic(_job_path(queue_dir, 'done', job, '.json'), record)
+                else:
+                    _write_atomic(_job_path(queue_dir, 'failures', job, f'.{uuid.uuid4().hex}.json'),
+                                  record)
+                claim_path.unlink(missing_ok=True)
+    finally:
+        # on an interruption, stop the running jobs and release their claims,
+        # so that other workers can run them
+        for job, _, process, _ in running.values():
+            process.terminate()
+            process.wait()
+            _job_path(queue_dir, 'claims', job, '').unlink(missing_ok=True)
+    
+    return queue_status(queue_dir, max_attempts)
+
+
+def queue_status(queue_dir, max_attempts=3):
+    '''
+    Status of the jobs in a work queue.
+    
+    Parameters
+    ----------
+    queue_dir: `pathlib.Path` with the queue directory
+    max_attempts: maximum number of attempts at each job, as for `run_worker`
+    
+    Returns
+    -------
+    Pandas data frame with one row per job, giving the `model_name`,
+    `ref_date`, `status` ('pending', 'running', 'success' or 'failed'), number
+    of failed `attempts`, and the `worker` that ran or is running the job
+    '''
+    _check_queue(queue_dir)
+    done, num_failures = _read_finished(queue_dir)
+    records = list()
+    for job in _read_jobs(queue_dir):
+        record = {'model_name': job['model_name'], 'ref_date': job['ref_date'],
+                  'attempts': num_failures.get(_job_name(job), 0), 'worker': None}
+        claim_path = _job_path(queue_dir, 'claims', job, '')
+        if _job_name(job) in done:
+            record.update(status='success',
+                          worker=_read_json(_job_path(queue_dir, 'done', job, '.json'))['worker'])
+        elif record['attempts'] >= max_attempts:
+            record['status'] = 'failed'
+        elif claim_path.exists():
+            record.update(status='running', worker=claim_path.read_text())
+        else:
+            record['status'] = 'pending'
+        records.append(record)
+    
+    return pd.DataFrame(records, columns=['model_name', 'ref_date', 'status',
+                                          'attempts', 'worker'])
+
+
+def _check_queue(queue_dir):
+    if not all((queue_dir / subdir).is_dir() for subdir in QUEUE_SUBDIRS):
+        raise FileNotFoundError(f'{queue_dir} is not a work queue directory; '
+                                'jobs are added with `enqueue`')
+
+
+def _read_jobs(queue_dir):
+    jobs = list()
+    for path in (queue_dir / 'jobs').glob('*.json'):
+        try:
+            jobs.append(_read_json(path))
+        except FileNotFoundError:
+            continue
+    
+    return sorted(jobs, key=lambda job: job['order'])
+
+
+def _read_finished(queue_dir):
+    # names of the jobs that are done, and the number of failed attempts at
+    # each job, from one listing of each directory
+    done = {name[:-len('.json')] for name in os.listdir(queue_dir / 'done') \
+            if name.endswith('.json') and not name.startswith('.tmp')}
+    num_failures = dict()
+    for name in os.listdir(queue_dir / 'failures'):
+        if name.endswith('.json') and not name.startswith('.tmp'):
+            # failure files are named <job name>.<attempt id>.json
+            job_name = name.rsplit('.', 2)[0]
+            num_failures[job_name] = num_failures.get(job_name, 0) + 1
+    
+    return done, num_failures
+
+
+def _claim(claim_path, worker_id):
+    # creating a file that must not exist is atomic, including on NFS
+    # version 3 and later
+    try:
+        fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    
+    with os.fdopen(fd, 'w') as f:
+        f.write(worker_id)
+    
+    return True
+
+
+def _heartbeat(claim_path, worker_id):
+    if not _owns_claim(claim_path, worker_id):
+        return False
+    
+    os.utime(claim_path)
+    return True
+
+
+def _owns_claim(claim_path, worker_id):
+    try:
+        return claim_path.read_text() == worker_id
+    except FileNotFoundError:
+        return False
+
+
+def _is_stale(claim_path, claims_seen, stale_after):
+    # a claim is stale if its modification time has not changed for
+    # `stale_after` seconds of this worker's clock, which does not depend on
+    # the clocks of other hosts agreeing
+    try:
+        mtime = claim_path.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    
+    if claims_seen.get(claim_path, (None,))[0] != mtime:
+        claims_seen[claim_path] = (mtime, time.time())
+        return False
+    
+    return time.time() - claims_seen[claim_path][1] >= stale_after
+
+
+def _break_claim(claim_path):
+    # renaming is atomic, so only one worker breaks a stale claim
+    try:
+        os.rename(claim_path, claim_path.with_name(f'{claim_path.name}.stale.{uuid.uuid4().hex}'))
+    except FileNotFoundError:
+        pass
+
+
+def _job_name(job):
+    return f'{job["ref_date"]}-UMass-{job["model_name"]}'
+
+
+def _job_path(queue_dir, subdir, job, suffix):
+    return queue_dir / subdir / f'{_job_name(job)}{suffix}'
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_atomic(path, record):
+    # write to a temporary file and rename, so that readers never see a
+    # partially written file
+    tmp_path = path.with_name(f'.tmp{uuid.uuid4().hex}_{path.name}')
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f)
+    os.replace(tmp_path, path)
+
+
+def _make_parser():
+    parser = argparse.ArgumentParser(description='Run jobs from a work queue shared by several workers')
+    parser.add_argument('--queue_dir',
+                        help='Path to the queue directory, on a file system shared by all workers',
+                        type=lambda s: Path(s),
+                        required=True)
+    parser.add_argument('--num_cores',
+                        help='Number of cores to use; by default, all cores available to the worker',
+                        type=int,
+                        default=None)
+    parser.add_argument('--status',
+                        help='Flag to print the status of the jobs in the queue instead of running a worker',
+                        action='store_true')
+    
+    return parser
+
+
+def main():
+    args = _make_parser().parse_args()
+    
+    if args.status:
+        status = queue_status(args.queue_dir)
+    else:
+        status = run_worker(args.queue_dir, num_cores=args.num_cores)
+    
+    print(status['status'].value_counts())
+    
+    if (status['status'] == 'failed').any():
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
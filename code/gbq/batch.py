@@ -0,0 +1,362 @@
+import argparse
+import datetime
+import sys
+import time
+import traceback
+from collections import deque
+from multiprocessing import Pool, resource_tracker
+from pathlib import Path
+
+import pandas as pd
+from joblib import cpu_count
+
+# modules shared by the gbq and sarix models
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+
+from hub_output import OUTPUT_FORMATS
+from preprocess import create_features_and_targets, _drop_level_feats
+from run import load_flu_data, train_and_save
+from shared_frame import AttachedFrame, SharedFrame
+from utils import MODEL_NAMES, build_configs
+
+
+def run_gbq_batch(model_names, ref_dates, output_root, artifact_store_root,
+                  output_format='csv', short_run=False, num_workers=1,
+                  location_workers=1, num_threads=None, processes=1,
+                  vintage_store_dir=None, feature_cache_dir=None,
+                  incremental_features=False):
+    '''
+    Generate predictions from several gbq models for several reference dates
+    within one process, or within a pool of processes. For each reference
+    date, the flu data are loaded once for each distinct set of data settings
+    (`reporting_adj`, `sources`, `power_transform` and `categorical_encoding`)
+    and featurized once; models that differ only in other settings reuse
+    those features.
+    
+    With a pool of processes, the calling process loads and featurizes the
+    data and places the features in shared memory (see
+    `shared_frame.SharedFrame`), and each model run is a task in the pool
+    that uses the shared features in place. The features for at most
+    `processes` reference dates are held at a time. Unless `num_threads` is
+    given, the physical cores are split among the processes.
+    
+    Parameters
+    ----------
+    model_names: list of model names, each the name of a module in `configs`
+    ref_dates: list of reference dates, as `datetime.date` objects or strings
+        in format YYYY-MM-DD
+    output_root: `pathlib.Path` with the root directory for saving model outputs
+    output_format: file format for model outputs, one of
+        `hub_output.OUTPUT_FORMATS`
+    artifact_store_root: `pathlib.Path` with the root directory for saving
+        artifacts related to model runs
+    short_run: boolean; if True, do short runs as for `gbq.py --short_run`
+    num_workers: number of bags to fit in parallel within each model run
+    location_workers: number of locations to fit in parallel within each run
+        of a model that is fit to each location separately
+    num_threads: optional number of cores available to each model run; by
+        default, all physical cores, divided by `processes`
+    processes: number of model runs to run in parallel
+    vintage_store_dir: optional `pathlib.Path` with the directory of a
+        `vintage_store.VintageStore` to load flu data from
+    feature_cache_dir: optional `pathlib.Path` with a directory for caching
+        featurized data across batches
+    incremental_features: boolean; if True, featurize by updating the latest
+        cached features for the same data series
+    
+    Returns
+    -------
+    Pandas data frame with one row per combination of model name and reference
+    date, giving the `model_name`, `ref_date`, `status` ('success' or
+    'failed'), `save_path`, `error` and elapsed time in `seconds`
+    '''
+    ref_dates = [_as_date(ref_date) for ref_date in ref_dates]
+    config_kwargs = dict(
+        output_root=output_root,
+        artifact_store_root=artifact_store_root,
+        output_format=output_format,
+        short_run=short_run,
+        num_workers=num_workers,
+        location_workers=location_workers,
+        num_threads=num_threads,
+        vintage_store_dir=vintage_store_dir,
+        feature_cache_dir=feature_cache_dir,
+        incremental_features=incremental_features)
+    
+    if processes == 1:
+        manifest = [_run_ref_date(model_names, ref_date, config_kwargs) \
+                    for ref_date in ref_dates]
+    else:
+        manifest = _run_pool(model_names, ref_dates, config_kwargs, processes)
+    
+    return pd.DataFrame([record for records in manifest for record in records])
+
+
+def _run_ref_date(model_names, ref_date, config_kwargs):
+    '''
+    Run all models for one reference date, sharing loaded data and features
+    across models with the same data settings.
+    
+    Returns
+    -------
+    list of manifest records, one per model
+    '''
+    features_cache = dict()
+    records = list()
+    for model_name in model_names:
+        start_time = time.time()
+        record = {'model_name': model_name, 'ref_date': ref_date}
+        try:
+            model_config, run_config = build_configs(
+                model_name=model_name, ref_date=ref_date, **config_kwargs)
+            
+            data_key = _get_data_key(model_config, run_config)
+            if data_key not in features_cache:
+                features_cache[data_key] = _load_features(model_config, run_config)
+            
+            df, feat_names = features_cache[data_key]
+            save_path = _train_and_save(model_config, run_config, df, feat_names)
+            record.update(status='success', save_path=str(save_path), error=None)
+        except Exception:
+            record.update(status='failed', save_path=None,
+                          error=traceback.format_exc())
+        
+        record['seconds'] = time.time() - start_time
+        records.append(record)
+    
+    return records
+
+
+def _run_pool(model_names, ref_dates, config_kwargs, processes):
+    '''
+    Run all models for all reference dates in a pool of processes. The data
+    for each reference date are loaded and featurized in this process, once
+    for each distinct set of data settings, and shared with the model runs in
+    the pool through shared memory, so that memory use for the features does
+    not grow with the number of processes.
+    
+    Returns
+    -------
+    list of lists of manifest records, one list per reference date
+    '''
+    if config_kwargs['num_threads'] is None:
+        # split the cores among the processes, rather than having each
+        # process use all of them
+        config_kwargs = dict(
+            config_kwargs,
+            num_threads=max(cpu_count(only_physical_cores=True) // processes, 1))
+    
+    manifest = list()
+    # for each reference date in progress, the shared features and the
+    # manifest records or pending results of the model runs
+    in_progress = deque()
+    # the pool processes share the resource tracker of this process if it is
+    # started first; otherwise each starts its own, which removes any shared
+    # memory blocks it has attached to when the process exits
+    resource_tracker.ensure_running()
+    with Pool(processes=processes) as pool:
+        for ref_date in ref_dates:
+            if len(in_progress) == processes:
+                manifest.append(_finish_ref_date(*in_progress.popleft()))
+            
+            shared_features = dict()
+            results = list()
+            for model_name in model_names:
+                start_time = time.time()
+                record = {'model_name': model_name, 'ref_date': ref_date}
+                try:
+                    model_config, run_config = build_configs(
+                        model_name=model_name, ref_date=ref_date, **config_kwargs)
+                    
+                    data_key = _get_data_key(model_config, run_config)
+                    if data_key not in shared_features:
+                        df, feat_names = _load_features(model_config, run_config)
+                        shared_features[data_key] = (SharedFrame(df), feat_names)
+                        del df
+                except Exception:
+                    record.update(status='failed', save_path=None,
+                                  error=traceback.format_exc(),
+                                  seconds=time.time() - start_time)
+                    results.append(record)
+                    continue
+                
+                shared_df, feat_names = shared_features[data_key]
+                results.append(pool.apply_async(
+                    _run_shared_model,
+                    (model_name, ref_date, config_kwargs, shared_df.spec, feat_names)))
+            
+            in_progress.append((shared_features, results))
+        
+        while len(in_progress) > 0:
+            manifest.append(_finish_ref_date(*in_progress.popleft()))
+    
+    return manifest
+
+
+def _run_shared_model(model_name, ref_date, config_kwargs, frame_spec, feat_names):
+    '''
+    Run one model for one reference date in a pool process, on features in
+    shared memory.
+    
+    Returns
+    -------
+    manifest record
+    '''
+    start_time = time.time()
+    record = {'model_name': model_name, 'ref_date': ref_date}
+    frame = AttachedFrame(frame_spec)
+    try:
+        model_config, run_config = build_configs(
+            model_name=model_name, ref_date=ref_date, **config_kwargs)
+        save_path = _train_and_save(model_config, run_config, frame.df, feat_names)
+        record.update(status='success', save_path=str(save_path), error=None)
+    except Exception:
+        record.update(status='failed', save_path=None,
+                      error=traceback.format_exc())
+    
+    # the traceback of an exception, which can refer to the shared features,
+    # has been released once the except block is left
+    frame.close()
+    record['seconds'] = time.time() - start_time
+    
+    return record
+
+
+def _finish_ref_date(shared_features, results):
+    # wait for the model runs for a reference date, then free the shared
+    # features
+    records = [result if isinstance(result, dict) else result.get() \
+               for result in results]
+    for shared_df, _ in shared_features.values():
+        shared_df.close()
+    
+    return records
+
+
+def _get_data_key(model_config, run_config):
+    return (model_config.reporting_adj,
+            tuple(model_config.sources),
+            model_config.power_transform,
+            model_config.categorical_encoding,
+            run_config.max_horizon)
+
+
+def _load_features(model_config, run_config):
+    df = load_flu_data(model_config, run_config)
+    # features are computed including level features, which are dropped in
+    # `_train_and_save` for models that don't use them
+    return create_features_and_targets(
+        df = df,
+        incl_level_feats=True,
+        max_horizon=run_config.max_horizon,
+        curr_feat_names=['inc_trans_cs', 'season_week', 'log_pop'],
+        categorical_encoding=model_config.categorical_encoding,
+        cache_dir=run_config.feature_cache_dir,
+        incremental=run_config.incremental_features)
+
+
+def _train_and_save(model_config, run_config, df, feat_names):
+    if not model_config.incl_level_feats:
+        feat_names = _drop_level_feats(feat_names)
+    
+    return train_and_save(model_config, run_config, df, feat_names)
+
+
+def _as_date(ref_date):
+    if isinstance(ref_date, str):
+        return datetime.date.fromisoformat(ref_date)
+    
+    return ref_date
+
+
+def _make_parser():
+    parser = argparse.ArgumentParser(description='Run gradient boosting models for flu prediction for several reference dates')
+    parser.add_argument('--ref_dates',
+                        help='reference dates for predictions in format YYYY-MM-DD; Saturdays',
+                        nargs='+',
+                        type=lambda s: datetime.date.fromisoformat(s),
+                        required=True)
+    parser.add_argument('--model_names',
+                        help='Model names',
+                        nargs='+',
+                        choices=MODEL_NAMES,
+                        default=['gbq_qr'])
+    parser.add_argument('--short_run',
+                        help='Flag to do short runs; overrides model-default num_bags to 10 and uses 3 quantile levels',
+                        action='store_true')
+    parser.add_argument('--output_root',
+                        help='Path to a directory in which model outputs are saved',
+                        type=lambda s: Path(s),
+                        default=Path('../../submissions-hub/model-output'))
+    parser.add_argument('--output_format',
+                        help='File format for model outputs',
+                        choices=OUTPUT_FORMATS,
+                        default='csv')
+    parser.add_argument('--artifact_store_root',
+                        help='Path to a directory in which artifacts related to model runs are saved',
+                        type=lambda s: Path(s),
+                        default=Path('../../submissions-hub/model-artifacts'))
+    parser.add_argument('--num_workers',
+                        help='Number of bags to fit in parallel within each model run',
+                        type=int,
+                        default=1)
+    parser.add_argument('--location_workers',
+                        help='Number of locations to fit in parallel within each run of a model that is fit to each location separately',
+                        type=int,
+                        default=1)
+    parser.add_argument('--num_threads',
+                        help='Number of cores available to each model run; by default, all physical cores, divided by --processes',
+                        type=int,
+                        default=None)
+    parser.add_argument('--processes',
+                        help='Number of model runs to run in parallel, in a pool of processes that share the featurized data for each reference date through shared memory',
+                        type=int,
+                        default=1)
+    parser.add_argument('--vintage_store_dir',
+                        help='Optional path to a local store of flu data vintages; vintages loaded by earlier runs are read from the store without network access',
+                        type=lambda s: Path(s),
+                        default=None)
+    parser.add_argument('--feature_cache_dir',
+                        help='Optional path to a directory in which featurized data are cached and reused by later runs on the same data',
+                        type=lambda s: Path(s),
+                        default=None)
+    parser.add_argument('--incremental_features',
+                        help='Flag to featurize by updating the most recent features in the feature cache for the same data series; requires --feature_cache_dir',
+                        action='store_true')
+    parser.add_argument('--manifest_path',
+                        help='Optional path to a csv file in which to save the results manifest',
+                        type=lambda s: Path(s),
+                        default=None)
+    
+    return parser
+
+
+def main():
+    args = _make_parser().parse_args()
+    
+    manifest = run_gbq_batch(model_names=args.model_names,
+                             ref_dates=args.ref_dates,
+                             output_root=args.output_root,
+                             artifact_store_root=args.artifact_store_root,
+                             output_format=args.output_format,
+                             short_run=args.short_run,
+                             num_workers=args.num_workers,
+                             location_workers=args.location_workers,
+                             num_threads=args.num_threads,
+                             processes=args.processes,
+                             vintage_store_dir=args.vintage_store_dir,
+                             feature_cache_dir=args.feature_cache_dir,
+                             incremental_features=args.incremental_features)
+    
+    if args.manifest_path is not None:
+        args.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest.to_csv(args.manifest_path, index=False)
+    
+    print(manifest[['model_name', 'ref_date', 'status', 'seconds']])
+    
+    if (manifest['status'] == 'failed').any():
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
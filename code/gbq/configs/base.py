@@ -7,6 +7,15 @@ base_config = SimpleNamespace(
   num_bags = 100,
   bag_frac_samples = 0.7,
 
+  # adaptive bagging: bags are added until the median of the test set
+  # predictions across bags changes by less than adaptive_bags_tol for
+  # adaptive_bags_patience bags in a row, using at least adaptive_bags_min and
+  # at most num_bags bags. Short runs scale adaptive_bags_min with num_bags.
+  adaptive_bags = False,
+  adaptive_bags_min = 30,
+  adaptive_bags_tol = 0.01,
+  adaptive_bags_patience = 5,
+
   # adjustments to reporting
   reporting_adj = True,
 
@@ -17,5 +26,37 @@ base_config = SimpleNamespace(
   fit_locations_separately = False,
 
   # power transform applied to surveillance signals
-  power_transform = '4rt'
+  power_transform = '4rt',
+
+  # encoding of source, agg_level, and location features: 'one_hot' for
+  # indicator columns, or 'native' for LightGBM categorical features
+  categorical_encoding = 'one_hot',
+
+  # 'separate' to fit one model per quantile level in each bag, or 'joint'
+  # to fit one model per bag with the quantile level as a feature. Joint fits
+  # repeat each training instance for joint_q_levels_per_row randomly drawn
+  # quantile levels, and use joint_num_boost_round boosting rounds.
+  quantile_fit = 'separate',
+  joint_q_levels_per_row = 3,
+  joint_num_boost_round = 200,
+
+  # quantile levels at which models are fit, or None to fit models at all
+  # levels in the run config; predictions at other levels are interpolated
+  # from those at the anchor levels. Runs with no more levels than the anchors
+  # bracketing them, such as short runs, fit those levels directly.
+  anchor_q_levels = None,
+
+  # bin the training data of bags with more rows than LightGBM's
+  # subsample_for_bin once for all quantile levels, rather than once per fit
+  # with the seed of the fit; faster, but the models differ from those of
+  # separate fits. Smaller bags are always binned once.
+  shared_bins = False,
+
+  # number of boosting rounds added to each of the previous week's models
+  # in runs with --warm_start
+  warm_start_num_boost_round = 10,
+
+  # number of warm started runs in a row after which models are refit from
+  # scratch, limiting the number of rounds they accumulate
+  warm_start_max_weeks = 4
 )
@@ -0,0 +1,6 @@
+import copy
+from configs.base import base_config
+
+config = copy.deepcopy(base_config)
+config.model_name = 'gbq_qr_adaptive_bags'
+config.adaptive_bags = True
@@ -0,0 +1,6 @@
+import copy
+from configs.base import base_config
+
+config = copy.deepcopy(base_config)
+config.model_name = 'gbq_qr_joint_quantiles'
+config.quantile_fit = 'joint'
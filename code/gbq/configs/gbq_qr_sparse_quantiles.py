@@ -0,0 +1,6 @@
+import copy
+from configs.base import base_config
+
+config = copy.deepcopy(base_config)
+config.model_name = 'gbq_qr_sparse_quantiles'
+config.anchor_q_levels = [0.025, 0.1, 0.25, 0.5, 0.75, 0.9, 0.975]
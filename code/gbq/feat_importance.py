@@ -0,0 +1,167 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+
+# types of LightGBM feature importance scores that are collected, in the
+# order in which they are stored
+IMPORTANCE_TYPES = ['split', 'gain']
+
+FORMATS = ['csv', 'parquet']
+
+
+class FeatImportanceCollector():
+    '''
+    Feature importance scores for all fits in a model run, collected into an
+    array with dimensions (bag, quantile level, importance type, feature) that
+    is allocated once, before fitting.
+    '''
+    def __init__(self, feat_names, num_bags, q_levels):
+        '''
+        Parameters
+        ----------
+        feat_names: list of feature names
+        num_bags: integer number of bags
+        q_levels: list of quantile levels, one per model in each bag; a model
+            fit for all quantile levels is given the level `np.nan`
+        '''
+        self.feat_names = list(feat_names)
+        self.q_levels = list(q_levels)
+        self.scores = np.zeros((num_bags, len(self.q_levels),
+                                len(IMPORTANCE_TYPES), len(self.feat_names)))
+    
+    
+    def add(self, b, scores):
+        '''
+        Record the feature importance scores for the models in one bag.
+        
+        Parameters
+        ----------
+        b: integer bag index
+        scores: numpy array of shape (quantile level, importance type, feature)
+            returned by `train.fit_bag` or `train.fit_joint_bag`
+        '''
+        self.scores[b] = scores
+    
+    
+    def to_frame(self, num_bags=None):
+        '''
+        Feature importance scores as a data frame.
+        
+        Parameters
+        ----------
+        num_bags: optional number of bags to include, the first `num_bags`;
+            by default all bags are included
+        
+        Returns
+        -------
+        Pandas data frame with one row per combination of bag, quantile level
+        and feature, and columns `b`, `q_level`, `feat`, `split` and `gain`
+        '''
+        scores = self.scores if num_bags is None else self.scores[:num_bags]
+        num_bags, num_q_levels, _, num_feats = scores.shape
+        
+        # move the importance type to the last dimension, so that each type
+        # is one column of the flattened array
+        scores = scores.transpose(0, 1, 3, 2).reshape(-1, len(IMPORTANCE_TYPES))
+        df = pd.DataFrame({
+            'b': np.repeat(np.arange(num_bags), num_q_levels * num_feats),
+            'q_level': np.tile(np.repeat(self.q_levels, num_feats), num_bags),
+            'feat': pd.Categorical(np.tile(self.feat_names, num_bags * num_q_levels),
+                                   categories=self.feat_names)
+        })
+        for i, importance_type in enumerate(IMPORTANCE_TYPES):
+            df[importance_type] = scores[:, i]
+        df['split'] = df['split'].astype(np.int64)
+        
+        return df
+
+
+def save_feat_importance(df, path):
+    '''
+    Save feature importance scores, as a parquet file if the path ends in
+    '.parquet' and as a csv file otherwise.
+    
+    Parameters
+    ----------
+    df: data frame from `FeatImportanceCollector.to_frame`
+    path: `pathlib.Path` of the file to save
+    '''
+    if path.suffix == '.parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def load_feat_importance(artifact_store_root, model_name, ref_dates=None):
+    '''
+    Load feature importance scores saved by runs of a model with
+    `--save_feat_importance`, in either format.
+    
+    Parameters
+    ----------
+    artifact_store_root: `pathlib.Path` with the root directory for artifacts
+        related to model runs
+    model_name: string name of the model
+    ref_dates: optional list of reference dates, as `datetime.date` objects,
+        to load; by default scores for all reference dates are loaded
+    
+    Returns
+    -------
+    Pandas data frame with the columns of `FeatImportanceCollector.to_frame`,
+    a `location` column for models fit to each location separately, and a
+    `ref_date` column
+    '''
+    feat_importance_dir = artifact_store_root / f'UMass-{model_name}' / 'feat_importance'
+    dfs = list()
+    for path in sorted(feat_importance_dir.glob(f'*-UMass-{model_name}.*')):
+        if path.suffix[1:] not in FORMATS:
+            continue
+        
+        ref_date = datetime.date.fromisoformat(path.name[:10])
+        if ref_dates is not None and ref_date not in ref_dates:
+            continue
+        
+        if path.suffix == '.parquet':
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, dtype={'location': str})
+        dfs.append(df.assign(ref_date=ref_date))
+    
+    if len(dfs) == 0:
+        raise FileNotFoundError(f'no feature importance scores found in {feat_importance_dir}')
+    
+    df = pd.concat(dfs, axis=0, ignore_index=True)
+    df['feat'] = df['feat'].astype('category')
+    
+    return df
+
+
+def summarize_feat_importance(df, by=['feat']):
+    '''
+    Summarize feature importance scores across fits. The gain of each feature
+    is also expressed as its share of the total gain of the fit it comes from,
+    which makes scores comparable across reference dates and quantile levels.
+    
+    Parameters
+    ----------
+    df: data frame from `load_feat_importance` or `FeatImportanceCollector.to_frame`
+    by: list of columns to summarize by; for example, ['feat', 'ref_date']
+        summarizes each feature across bags and quantile levels separately
+        for each reference date
+    
+    Returns
+    -------
+    Pandas data frame with one row per combination of the `by` columns and
+    the mean `split`, `gain` and `gain_share` across fits, sorted by
+    decreasing `gain_share`
+    '''
+    fit_cols = [c for c in ['ref_date', 'location', 'b', 'q_level'] if c in df.columns]
+    gain_total = df.groupby(fit_cols, dropna=False, observed=True)['gain'].transform('sum')
+    df = df.assign(gain_share=df['gain'] / gain_total)
+    
+    return df.groupby(by, dropna=False, observed=True)[['split', 'gain', 'gain_share']] \
+        .mean() \
+        .sort_values('gain_share', ascending=False) \
+        .reset_index()
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+
+# increment when the layout of cached files changes
+CACHE_VERSION = 2
+
+
+def get_cache_key(df, settings):
+    '''
+    Content-based key for a featurized data frame.
+    
+    Parameters
+    ----------
+    df: pandas dataframe with the input data to featurization
+    settings: json-serializable object with all settings that affect the
+      output of featurization
+    
+    Returns
+    -------
+    hex string
+    '''
+    h = hashlib.sha256()
+    h.update(json.dumps([CACHE_VERSION, settings], sort_keys=True, default=str).encode())
+    h.update(json.dumps([[str(c), str(t)] for c, t in df.dtypes.items()]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+
+def get_lineage_key(df, settings, group_columns):
+    '''
+    Key identifying the data series in a data frame, but not their values:
+    frames for the same series and settings at different data vintages share
+    a lineage key, so one can be updated from the other.
+    
+    Parameters
+    ----------
+    df: pandas dataframe with the input data to featurization
+    settings: json-serializable object with all settings that affect the
+      output of featurization
+    group_columns: list of names of columns identifying a data series
+    
+    Returns
+    -------
+    hex string
+    '''
+    groups = df[group_columns].drop_duplicates().astype(str).values.tolist()
+    h = hashlib.sha256()
+    h.update(json.dumps([CACHE_VERSION, settings], sort_keys=True, default=str).encode())
+    h.update(json.dumps([[str(c), str(t)] for c, t in df.dtypes.items()]).encode())
+    h.update(json.dumps(sorted(groups)).encode())
+    return h.hexdigest()
+
+
+def load(cache_dir, key):
+    '''
+    Load a featurized data frame from the cache.
+    
+    Parameters
+    ----------
+    cache_dir: `pathlib.Path` with the cache directory
+    key: cache key from `get_cache_key`
+    
+    Returns
+    -------
+    tuple of the featurized data frame and the list of feature names, or None
+    if there is no cache entry for `key`
+    '''
+    data_path, names_path = _entry_paths(cache_dir, key)
+    if not (data_path.exists() and names_path.exists()):
+        return None
+    
+    df = pd.read_parquet(data_path)
+    with open(names_path) as f:
+        feat_names = json.load(f)['feat_names']
+    
+    # record the access for least-recently-used eviction
+    os.utime(data_path)
+    os.utime(names_path)
+    
+    return df, feat_names
+
+
+def load_latest(cache_dir, lineage_key):
+    '''
+    Load the most recently used cache entry with the given lineage key.
+    
+    Parameters
+    ----------
+    cache_dir: `pathlib.Path` with the cache directory
+    lineage_key: lineage key from `get_lineage_key`
+    
+    Returns
+    -------
+    tuple of the featurized data frame and the list of feature names, or None
+    if there is no cache entry for `lineage_key`
+    '''
+    latest_key = None
+    latest_mtime = None
+    for names_path in cache_dir.glob('*.json'):
+        try:
+            with open(names_path) as f:
+                entry_lineage_key = json.load(f).get('lineage_key')
+            mtime = names_path.stat().st_mtime
+        except (FileNotFoundError, ValueError):
+            # removed or being written by a concurrent run
+            continue
+        if entry_lineage_key == lineage_key and \
+                (latest_mtime is None or mtime > latest_mtime):
+            latest_key = names_path.stem
+            latest_mtime = mtime
+    
+    if latest_key is None:
+        return None
+    
+    return load(cache_dir, latest_key)
+
+
+def save(cache_dir, key, df, feat_names, max_bytes, lineage_key=None):
+    '''
+    Save a featurized data frame to the cache as a parquet file, then evict
+    the least recently used entries until the cache takes no more than
+    `max_bytes` on disk.
+    
+    Parameters
+    ----------
+    cache_dir: `pathlib.Path` with the cache directory
+    key: cache key from `get_cache_key`
+    df: featurized data frame
+    feat_names: list of feature names
+    max_bytes: maximum total size of the cache in bytes
+    lineage_key: optional lineage key from `get_lineage_key`, used by
+      `load_latest`
+    '''
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    data_path, names_path = _entry_paths(cache_dir, key)
+    
+    # write to temporary files and rename, so that concurrent runs never see
+    # a partially written entry
+    tmp_suffix = f'.tmp{os.getpid()}'
+    df.to_parquet(data_path.with_name(data_path.name + tmp_suffix))
+    with open(names_path.with_name(names_path.name + tmp_suffix), 'w') as f:
+        json.dump({'feat_names': feat_names, 'lineage_key': lineage_key}, f)
+    os.replace(data_path.with_name(data_path.name + tmp_suffix), data_path)
+    os.replace(names_path.with_name(names_path.name + tmp_suffix), names_path)
+    
+    _evict(cache_dir, max_bytes)
+
+
+def _entry_paths(cache_dir, key):
+    return cache_dir / f'{key}.parquet', cache_dir / f'{key}.json'
+
+
+def _evict(cache_dir, max_bytes):
+    entries = list()
+    for data_path in cache_dir.glob('*.parquet'):
+        names_path = data_path.with_suffix('.json')
+        try:
+            stat = data_path.stat()
+            size = stat.st_size + (names_path.stat().st_size if names_path.exists() else 0)
+        except FileNotFoundError:
+            # removed by a concurrent run
+            continue
+        entries.append((stat.st_mtime, size, data_path, names_path))
+    
+    total_bytes = sum(e[1] for e in entries)
+    for _, size, data_path, names_path in sorted(entries, key=lambda e: e[0]):
+        if total_bytes <= max_bytes:
+            break
+        data_path.unlink(missing_ok=True)
+        names_path.unlink(missing_ok=True)
+        total_bytes -= size
@@ -1,13 +1,52 @@
-from utils import parse_args
-from run import run_gbq_flu_model
+import sys
+from pathlib import Path
+
+# modules shared by the gbq and sarix models
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+
+from forecast_server import DataCache, parse_server_args, run_client, serve
 
 def main():
+    server_socket, start_server, argv = parse_server_args(sys.argv[1:])
+    if start_server:
+        serve(server_socket, _make_job_runner())
+        return
+    
+    if server_socket is not None:
+        # the run is done by a forecast server; this process does not import
+        # the modules for model fitting
+        run_client(server_socket, argv)
+        return
+    
+    from utils import parse_args
+    from run import run_gbq_flu_model
+    
     # parse arguments
-    model_config, run_config = parse_args()
+    model_config, run_config = parse_args(argv)
     
     # fit model and generate predictions
     run_gbq_flu_model(model_config, run_config)
 
 
+def _make_job_runner():
+    from batch import _get_data_key, _load_features, _train_and_save
+    from utils import parse_args
+    
+    # featurized data are kept in memory for the most recent data settings
+    # and reference dates, and shared across models as in `batch.py`
+    features_cache = DataCache()
+    
+    def run_job(argv):
+        model_config, run_config = parse_args(argv)
+        key = (run_config.ref_date, run_config.vintage_store_dir,
+               run_config.feature_cache_dir, run_config.incremental_features) + \
+            _get_data_key(model_config, run_config)
+        df, feat_names = features_cache.get(
+            key, lambda: _load_features(model_config, run_config))
+        return _train_and_save(model_config, run_config, df, feat_names)
+    
+    return run_job
+
+
 if __name__ == '__main__':
     main()
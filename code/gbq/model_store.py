@@ -0,0 +1,116 @@
+import gzip
+import json
+import os
+
+import lightgbm as lgb
+
+
+# name of the file describing a stored run; it is written last, so a model
+# directory without it holds an incomplete run
+LAYOUT_FILE = 'layout.json'
+
+
+def booster_path(model_dir, b, q_ind, location=None):
+    '''
+    Path at which the booster for one bag and quantile level is stored.
+    
+    Parameters
+    ----------
+    model_dir: `pathlib.Path` with the directory for the run's models
+    b: integer bag index
+    q_ind: integer index of the quantile level
+    location: optional string location, for models fit to each location
+        separately
+    
+    Returns
+    -------
+    `pathlib.Path`
+    '''
+    if location is not None:
+        model_dir = model_dir / f'location_{location}'
+    return model_dir / f'bag_{b:03d}_q_{q_ind:02d}.txt.gz'
+
+
+def save_booster(path, booster):
+    '''
+    Save a fitted booster as gzipped LightGBM model text.
+    
+    Parameters
+    ----------
+    path: `pathlib.Path` from `booster_path`
+    booster: fitted lgb.Booster
+    '''
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + f'.tmp{os.getpid()}')
+    with gzip.open(tmp_path, 'wt') as f:
+        f.write(booster.model_to_string())
+    os.replace(tmp_path, path)
+
+
+def load_booster(path):
+    '''
+    Load a booster saved by `save_booster`.
+    
+    Parameters
+    ----------
+    path: `pathlib.Path` from `booster_path`
+    
+    Returns
+    -------
+    lgb.Booster
+    '''
+    with gzip.open(path, 'rt') as f:
+        return lgb.Booster(model_str=f.read())
+
+
+def save_layout(model_dir, layout):
+    '''
+    Save the description of a stored run. This should be called after all
+    boosters for the run have been saved.
+    
+    Parameters
+    ----------
+    model_dir: `pathlib.Path` with the directory for the run's models
+    layout: json-serializable dictionary; see `run._build_model_layout`
+    '''
+    model_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = model_dir / f'{LAYOUT_FILE}.tmp{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(layout, f, indent=2)
+    os.replace(tmp_path, model_dir / LAYOUT_FILE)
+
+
+def load_layout(model_dir):
+    '''
+    Load the description of a stored run.
+    
+    Parameters
+    ----------
+    model_dir: `pathlib.Path` with the directory for the run's models
+    
+    Returns
+    -------
+    dictionary saved by `save_layout`
+    '''
+    layout_path = model_dir / LAYOUT_FILE
+    if not layout_path.exists():
+        raise FileNotFoundError(f'no stored models found in {model_dir}; '
+                                'run the model with --save_models first')
+    
+    with open(layout_path) as f:
+        return json.load(f)
+
+
+def invalidate(model_dir):
+    '''
+    Remove the run stored in a model directory, before a new run saves its
+    boosters there. The layout is removed first, marking the run as
+    incomplete.
+    
+    Parameters
+    ----------
+    model_dir: `pathlib.Path` with the directory for the run's models
+    '''
+    (model_dir / LAYOUT_FILE).unlink(missing_ok=True)
+    for path in model_dir.glob('**/*.txt.gz'):
+        path.unlink(missing_ok=True)
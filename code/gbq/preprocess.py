@@ -1,12 +1,59 @@
+import copy
 import fnmatch
 
+import numpy as np
 import pandas as pd
 
 from timeseriesutils import featurize
 from data_pipeline.utils import get_holidays
 
+import feature_cache
 
-def create_features_and_targets(df, incl_level_feats, max_horizon, curr_feat_names = []):
+
+# features summarizing data within each combination of source and location
+TAYLOR_ROLLMEAN_FEATURES = [
+    {
+        'fun': 'windowed_taylor_coefs',
+        'args': {
+            'columns': 'inc_trans_cs',
+            'taylor_degree': 2,
+            'window_align': 'trailing',
+            'window_size': [4, 6],
+            'fill_edges': False
+        }
+    },
+    {
+        'fun': 'windowed_taylor_coefs',
+        'args': {
+            'columns': 'inc_trans_cs',
+            'taylor_degree': 1,
+            'window_align': 'trailing',
+            'window_size': [3, 5],
+            'fill_edges': False
+        }
+    },
+    {
+        'fun': 'rollmean',
+        'args': {
+            'columns': 'inc_trans_cs',
+            'group_columns': ['location'],
+            'window_size': [2, 4]
+        }
+    }
+]
+
+# lags of inc_trans_cs and of the features above
+LAGS = [1, 2]
+
+# factors of the centering and scaling of inc_trans_cs in each source and
+# location: inc_trans = (inc_trans_cs + center factor) * (scale factor + 0.01)
+TRANSFORM_FACTOR_COLS = ['inc_trans_center_factor', 'inc_trans_scale_factor']
+
+
+def create_features_and_targets(df, incl_level_feats, max_horizon, curr_feat_names = [],
+                                categorical_encoding = 'one_hot',
+                                cache_dir = None, cache_max_bytes = 10 * 2**30,
+                                incremental = False):
     '''
     Create features and targets for prediction
     
@@ -20,6 +67,100 @@ def create_features_and_targets(df, incl_level_feats, max_horizon, curr_feat_nam
       maximum forecast horizon
     curr_feat_names: list of strings
       list of names of columns in `df` containing existing features
+    categorical_encoding: string
+      encoding of `source`, `agg_level` and `location`: 'one_hot' for one
+      indicator column per category, or 'native' for one pandas categorical
+      column per variable, named with a `_cat` suffix, which LightGBM treats
+      as a categorical feature
+    cache_dir: `pathlib.Path` or None
+      optional directory for an on-disk cache of featurized data. Entries are
+      keyed by the contents of `df` and the featurization settings.
+    cache_max_bytes: int
+      maximum size of the cache on disk; least recently used entries are
+      evicted beyond this size
+    incremental: boolean
+      if True and `df` is not in the cache, update the most recently used
+      cache entry for the same settings and data series with
+      `update_features_and_targets` rather than featurizing all of `df`
+    
+    Returns
+    -------
+    tuple with:
+    - the input data frame, augmented with additional columns with feature and
+      target values
+    - a list of all feature names, columns in the data frame
+    '''
+    if cache_dir is None:
+        df, feat_names = _create_all_features_and_targets(df, max_horizon, curr_feat_names,
+                                                          categorical_encoding)
+    else:
+        # level features are always computed and cached, and dropped below if
+        # requested, so that one cache entry serves models with and without
+        # level features
+        settings = {
+            'max_horizon': max_horizon,
+            'curr_feat_names': curr_feat_names,
+            'categorical_encoding': categorical_encoding,
+            'features': TAYLOR_ROLLMEAN_FEATURES,
+            'lags': LAGS
+        }
+        key = feature_cache.get_cache_key(df, settings)
+        # entries for the same settings and the same data series, e.g. from
+        # earlier reference dates, can be updated incrementally
+        lineage_key = feature_cache.get_lineage_key(df, settings, ['source', 'location'])
+        cached = feature_cache.load(cache_dir, key)
+        if cached is not None:
+            df, feat_names = cached
+        else:
+            prev = feature_cache.load_latest(cache_dir, lineage_key) if incremental else None
+            if prev is None:
+                df, feat_names = _create_all_features_and_targets(df, max_horizon, curr_feat_names,
+                                                                  categorical_encoding)
+            else:
+                df, feat_names = _update_all_features_and_targets(df, prev[0], max_horizon, curr_feat_names,
+                                                                  categorical_encoding)
+            feature_cache.save(cache_dir, key, df, feat_names, cache_max_bytes,
+                               lineage_key=lineage_key)
+    
+    # if requested, drop features that involve absolute level
+    if not incl_level_feats:
+        feat_names = _drop_level_feats(feat_names)
+    
+    return df, feat_names
+
+
+def update_features_and_targets(df, df_prev, incl_level_feats, max_horizon, curr_feat_names = [],
+                                categorical_encoding = 'one_hot'):
+    '''
+    Create features and targets for prediction by updating the output of an
+    earlier call to `create_features_and_targets`, typically for the previous
+    week's data. Windowed features (Taylor coefficients, rolling means and lags)
+    are recomputed only for the trailing rows of each source and location that
+    are new or revised relative to `df_prev`, along with the preceding rows
+    those windows need; the remaining windowed features are copied from
+    `df_prev`. New data usually change the centering and scaling of
+    inc_trans_cs in a source and location, and with them inc_trans_cs at all
+    earlier dates; rows whose values changed only in this way are not
+    recomputed, and their copied features are scaled and shifted to match.
+    The result is the same as from `create_features_and_targets(df, ...)`, up
+    to rounding.
+    
+    Parameters
+    ----------
+    df: pandas dataframe
+      data frame with data to "featurize", including both the data that were
+      used to create `df_prev` and any new or revised rows
+    df_prev: pandas dataframe
+      data frame returned by `create_features_and_targets` with the same
+      `max_horizon`, `curr_feat_names` and `categorical_encoding`
+    incl_level_feats: boolean
+      include features that are a measure of local level of the signal?
+    max_horizon: int
+      maximum forecast horizon
+    curr_feat_names: list of strings
+      list of names of columns in `df` containing existing features
+    categorical_encoding: string
+      'one_hot' or 'native'; see `create_features_and_targets`
     
     Returns
     -------
@@ -28,15 +169,181 @@ def create_features_and_targets(df, incl_level_feats, max_horizon, curr_feat_nam
       target values
     - a list of all feature names, columns in the data frame
     '''
+    df, feat_names = _update_all_features_and_targets(df, df_prev, max_horizon, curr_feat_names,
+                                                      categorical_encoding)
+    
+    if not incl_level_feats:
+        feat_names = _drop_level_feats(feat_names)
+    
+    return df, feat_names
+
+
+def _create_all_features_and_targets(df, max_horizon, curr_feat_names, categorical_encoding):
+    '''
+    Create all features, including level features, and targets for prediction.
+    Arguments and return value are as for `create_features_and_targets`.
+    '''
+    df, feat_names = _add_categorical_features(df, curr_feat_names, categorical_encoding)
+    df, new_feat_names = _add_window_features(df)
+    feat_names = feat_names + new_feat_names
+    df, new_feat_names = _add_targets(df, max_horizon)
+    feat_names = feat_names + new_feat_names
+    
+    return df, feat_names
+
+
+def _update_all_features_and_targets(df, df_prev, max_horizon, curr_feat_names, categorical_encoding):
+    '''
+    Update all features, including level features, and targets for prediction.
+    Arguments and return value are as for `update_features_and_targets`.
+    '''
+    group_cols = ['source', 'location']
+    key_cols = group_cols + ['wk_end_date']
+    raw_cols = list(df.columns)
+    
+    # the steps other than windowed features are cheap, and are redone in full
+    # so that the row order and layout match a full recompute exactly
+    df_raw = df
+    df, feat_names = _add_categorical_features(df, curr_feat_names, categorical_encoding)
+    
+    # one row per source, location and date with the raw data and windowed
+    # features used to create df_prev
+    df_prev = df_prev.loc[df_prev['horizon'] == 1]
+    
+    # fall back on a full recompute if the one-hot encoded categories changed
+    # or the rows can't be matched up by key
+    if list(df_prev.columns[:len(df.columns)]) != list(df.columns) or \
+            df_prev.duplicated(subset=key_cols).any() or \
+            df.duplicated(subset=key_cols).any():
+        return _create_all_features_and_targets(df_raw, max_horizon, curr_feat_names,
+                                                categorical_encoding)
     
-    # current features; will be updated
-    feat_names = curr_feat_names
+    # rows of df that are new or revised. The centering and scaling of
+    # inc_trans_cs are computed from the whole series of a source and
+    # location, so new data change inc_trans_cs at every earlier date by the
+    # same affine map; rows that changed only by that map are not revised,
+    # and their windowed features are mapped in the same way below
+    matched = df[key_cols].merge(df_prev[raw_cols], how='left', on=key_cols,
+                                 indicator=True)
+    scale, shift = _transform_change(df, matched)
+    changed = (matched['_merge'] == 'left_only').values
+    for c in raw_cols:
+        if c in key_cols or c in TRANSFORM_FACTOR_COLS:
+            continue
+        new_values = df[c].values
+        prev_values = matched[c].values
+        if c == 'inc_trans_cs':
+            same = np.isclose(new_values, scale * prev_values + shift,
+                              rtol=1e-9, atol=1e-9)
+        else:
+            same = new_values == prev_values
+        changed = changed | ~(same | (pd.isna(new_values) & pd.isna(prev_values)))
     
-    # one-hot encodings of data source, agg_level, and location
-    for c in ['source', 'agg_level', 'location']:
-        ohe = pd.get_dummies(df[c], prefix=c)
-        df = pd.concat([df, ohe], axis=1)
-        feat_names = feat_names + list(ohe.columns)
+    # position of each row within its source and location, and the first
+    # position from which windowed features must be recomputed. This is the
+    # first new or revised row, or the start of the series if rows were
+    # removed; the last row is always recomputed, which also gives the feature
+    # names when nothing has changed.
+    grouped = df.groupby(group_cols, sort=False)
+    pos = grouped.cumcount().values
+    group_ids = grouped.ngroup().values
+    group_sizes = grouped.size().values
+    first_changed = group_sizes - 1
+    np.minimum.at(first_changed, group_ids[changed], pos[changed])
+    
+    removed_groups = df_prev[key_cols] \
+        .merge(df[key_cols], how='left', on=key_cols, indicator=True) \
+        .query("_merge == 'left_only'")[group_cols] \
+        .drop_duplicates()
+    if not removed_groups.empty:
+        removed = df[group_cols].merge(removed_groups, how='left', on=group_cols, indicator=True)['_merge'].values == 'both'
+        first_changed[np.unique(group_ids[removed])] = 0
+    
+    # windowed features at a row depend on the preceding window_size - 1 rows
+    # for the window and on up to max(LAGS) more rows for the lags
+    max_window_size = max(max(f['args']['window_size']) for f in TAYLOR_ROLLMEAN_FEATURES)
+    lookback = max_window_size - 1 + max(LAGS)
+    start = np.maximum(first_changed - lookback, 0)
+    
+    df_tail, window_feat_names = _add_window_features(df.loc[pos >= start[group_ids]].copy())
+    recompute = pos >= first_changed[group_ids]
+    window_cols = [c for c in df_tail.columns if c not in df.columns]
+    
+    # windowed features: copied from df_prev, then overwritten where recomputed.
+    # The windowed features are linear in inc_trans_cs, so copied features
+    # change with it: features that measure the level of the signal (Taylor
+    # intercepts, rolling means and lags of those and of inc_trans_cs) are
+    # scaled and shifted, and the others (Taylor slopes and curvatures) are
+    # scaled
+    window_feats = df[key_cols].merge(
+        df_prev[key_cols + window_cols], how='left', on=key_cols)
+    window_feats.index = df.index
+    level_cols = set(window_cols) - set(_drop_level_feats(window_cols))
+    for c in window_cols:
+        window_feats[c] = scale * window_feats[c].values + \
+            (shift if c in level_cols else 0.0)
+    window_feats.loc[recompute, window_cols] = \
+        df_tail.loc[df.index[recompute], window_cols]
+    df = pd.concat([df, window_feats[window_cols]], axis=1)
+    feat_names = feat_names + window_feat_names
+    
+    df, new_feat_names = _add_targets(df, max_horizon)
+    feat_names = feat_names + new_feat_names
+    
+    return df, feat_names
+
+
+def _transform_change(df, matched):
+    '''
+    Scale and shift mapping the previous value of inc_trans_cs in each row of
+    `df` to its value under the current transform factors, so that
+    current inc_trans_cs = scale * previous inc_trans_cs + shift if the
+    underlying inc_trans is unchanged.
+    
+    Parameters
+    ----------
+    df: data frame with current data
+    matched: data frame with the previous data for each row of `df`, with
+        missing values for new rows
+    
+    Returns
+    -------
+    tuple of numpy arrays with the scale and shift for each row of `df`; 1
+    and 0 for new rows, or if the data do not have the transform factors
+    '''
+    scale = np.ones(len(df))
+    shift = np.zeros(len(df))
+    if not all(c in df.columns for c in TRANSFORM_FACTOR_COLS):
+        return scale, shift
+    
+    center, scale_factor = [df[c].to_numpy(dtype=float) for c in TRANSFORM_FACTOR_COLS]
+    prev_center, prev_scale_factor = [matched[c].to_numpy(dtype=float) \
+                                      for c in TRANSFORM_FACTOR_COLS]
+    matched_rows = ~np.isnan(prev_center) & ~np.isnan(prev_scale_factor)
+    scale[matched_rows] = (prev_scale_factor[matched_rows] + 0.01) / \
+        (scale_factor[matched_rows] + 0.01)
+    shift[matched_rows] = scale[matched_rows] * prev_center[matched_rows] - \
+        center[matched_rows]
+    
+    return scale, shift
+
+
+def _add_categorical_features(df, feat_names, categorical_encoding):
+    if categorical_encoding == 'one_hot':
+        # one-hot encodings of data source, agg_level, and location
+        for c in ['source', 'agg_level', 'location']:
+            ohe = pd.get_dummies(df[c], prefix=c)
+            df = pd.concat([df, ohe], axis=1)
+            feat_names = feat_names + list(ohe.columns)
+    elif categorical_encoding == 'native':
+        # categorical copies of data source, agg_level, and location; the
+        # original columns are kept as strings for use in filtering and output
+        df = df.copy()
+        for c in ['source', 'agg_level', 'location']:
+            df[f'{c}_cat'] = df[c].astype('category')
+            feat_names = feat_names + [f'{c}_cat']
+    else:
+        raise ValueError('unsupported categorical_encoding: must be "one_hot" or "native"')
     
     # season week relative to christmas
     df = df.merge(
@@ -50,40 +357,14 @@ def create_features_and_targets(df, incl_level_feats, max_horizon, curr_feat_nam
     
     feat_names = feat_names + ['delta_xmas']
     
+    return df, feat_names
+
+
+def _add_window_features(df):
     # features summarizing data within each combination of source and location
-    df, new_feat_names = featurize.featurize_data(
+    df, feat_names = featurize.featurize_data(
         df, group_columns=['source', 'location'],
-        features = [
-            {
-                'fun': 'windowed_taylor_coefs',
-                'args': {
-                    'columns': 'inc_trans_cs',
-                    'taylor_degree': 2,
-                    'window_align': 'trailing',
-                    'window_size': [4, 6],
-                    'fill_edges': False
-                }
-            },
-            {
-                'fun': 'windowed_taylor_coefs',
-                'args': {
-                    'columns': 'inc_trans_cs',
-                    'taylor_degree': 1,
-                    'window_align': 'trailing',
-                    'window_size': [3, 5],
-                    'fill_edges': False
-                }
-            },
-            {
-                'fun': 'rollmean',
-                'args': {
-                    'columns': 'inc_trans_cs',
-                    'group_columns': ['location'],
-                    'window_size': [2, 4]
-                }
-            }
-        ])
-    feat_names = feat_names + new_feat_names
+        features = copy.deepcopy(TAYLOR_ROLLMEAN_FEATURES))
     
     df, new_feat_names = featurize.featurize_data(
         df, group_columns=['source', 'location'],
@@ -91,15 +372,19 @@ def create_features_and_targets(df, incl_level_feats, max_horizon, curr_feat_nam
             {
                 'fun': 'lag',
                 'args': {
-                    'columns': ['inc_trans_cs'] + new_feat_names,
-                    'lags': [1, 2]
+                    'columns': ['inc_trans_cs'] + feat_names,
+                    'lags': LAGS
                 }
             }
         ])
     feat_names = feat_names + new_feat_names
     
+    return df, feat_names
+
+
+def _add_targets(df, max_horizon):
     # add forecast targets
-    df, new_feat_names = featurize.featurize_data(
+    df, feat_names = featurize.featurize_data(
         df, group_columns=['source', 'location'],
         features = [
             {
@@ -110,16 +395,11 @@ def create_features_and_targets(df, incl_level_feats, max_horizon, curr_feat_nam
                 }
             }
         ])
-    feat_names = feat_names + new_feat_names
     
     # we will model the differences between the prediction target and the most
     # recent observed value
     df['delta_target'] = df['inc_trans_cs_target'] - df['inc_trans_cs']
     
-    # if requested, drop features that involve absolute level
-    if not incl_level_feats:
-        feat_names = _drop_level_feats(feat_names)
-    
     return df, feat_names
 
 
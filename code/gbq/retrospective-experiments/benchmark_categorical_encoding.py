@@ -0,0 +1,82 @@
+# This script compares the time and memory used to train the gbq_qr model with
+# one-hot encoded and native LightGBM categorical features for source,
+# agg_level, and location. Each encoding is run in a fresh process so that
+# peak memory use can be measured separately.
+
+# This script should be run with code/gbq as the working directory:
+# python retrospective-experiments/benchmark_categorical_encoding.py
+
+import os
+import sys
+import time
+import resource
+import multiprocessing
+
+# modules in code/gbq
+sys.path.insert(0, os.getcwd())
+
+ref_date = '2024-01-06'
+num_bags = 10
+
+
+def run_benchmark(categorical_encoding):
+    '''Fit gbq_qr with the given categorical encoding; return timing and memory use'''
+    import datetime
+    from preprocess import create_features_and_targets
+    from run import load_flu_data, _split_train_test, _get_test_quantile_predictions
+    from train import StackedMatrix, to_float_array
+    from utils import build_configs
+    
+    model_config, run_config = build_configs(
+        model_name='gbq_qr',
+        ref_date=datetime.date.fromisoformat(ref_date),
+        output_root=None,
+        artifact_store_root=None)
+    model_config.categorical_encoding = categorical_encoding
+    model_config.num_bags = num_bags
+    
+    df = load_flu_data(model_config, run_config)
+    start_time = time.perf_counter()
+    df, feat_names = create_features_and_targets(
+        df = df,
+        incl_level_feats=model_config.incl_level_feats,
+        max_horizon=run_config.max_horizon,
+        curr_feat_names=['inc_trans_cs', 'season_week', 'log_pop'],
+        categorical_encoding=categorical_encoding)
+    featurize_seconds = time.perf_counter() - start_time
+    
+    train_rows, df_test = _split_train_test(df)
+    
+    start_time = time.perf_counter()
+    _get_test_quantile_predictions(model_config, run_config,
+                                   df['season'].iloc[train_rows],
+                                   StackedMatrix(df, feat_names, row_inds=train_rows),
+                                   df['delta_target'].to_numpy()[train_rows],
+                                   to_float_array(df_test, feat_names))
+    fit_seconds = time.perf_counter() - start_time
+    
+    return {
+        'categorical_encoding': categorical_encoding,
+        'num_features': len(feat_names),
+        'x_train_mb': df[feat_names].iloc[train_rows].memory_usage(deep=True).sum() / 2**20,
+        'featurize_seconds': featurize_seconds,
+        'fit_seconds_per_bag': fit_seconds / num_bags,
+        # ru_maxrss is reported in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+    }
+
+
+def main():
+    ctx = multiprocessing.get_context('spawn')
+    results = list()
+    for categorical_encoding in ['one_hot', 'native']:
+        with ctx.Pool(processes=1) as pool:
+            results.append(pool.apply(run_benchmark, (categorical_encoding, )))
+    
+    for result in results:
+        print(', '.join(f'{k}: {v:.2f}' if isinstance(v, float) else f'{k}: {v}' \
+                        for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# This script compares the gbq_qr_sparse_quantiles model, which fits models
+# at 7 anchor quantile levels and interpolates to the others, with gbq_qr,
+# which fits models at all 23 quantile levels, for the reference dates in the
+# 2023/24 season. For each reference date, the data are loaded and featurized
+# once and both models are fit to them.
+#
+# Outputs of gbq_qr_sparse_quantiles are stored in flusion/retrospective-hub,
+# as they were not generated in real time; outputs of gbq_qr are saved in
+# retrospective-experiments/sparse-quantiles. The training time and mean WIS
+# of both models for each reference date, scored against the FluSight target
+# data, are saved in retrospective-experiments/sparse-quantiles/results.csv.
+
+# This script should be run with code/gbq as the working directory:
+# python retrospective-experiments/compare_sparse_quantiles.py
+
+import os
+import sys
+import time
+import datetime
+from pathlib import Path
+
+import pandas as pd
+
+# modules in code/gbq
+sys.path.insert(0, os.getcwd())
+
+from preprocess import create_features_and_targets
+from run import load_flu_data, train_and_save
+from utils import build_configs
+
+# helpers in retrospective-experiments
+from scoring import load_target_data, mean_wis
+
+
+ref_dates = [datetime.date(2023, 10, 14) + datetime.timedelta(i * 7) \
+    for i in range(29)]
+
+experiment_root = Path('retrospective-experiments/sparse-quantiles')
+
+output_roots = {
+    'gbq_qr': experiment_root / 'model-output',
+    'gbq_qr_sparse_quantiles': Path('../../retrospective-hub/model-output')
+}
+
+
+def main():
+    target_df = load_target_data()
+    
+    results = list()
+    for ref_date in ref_dates:
+        model_config, run_config = build_configs(
+            model_name='gbq_qr',
+            ref_date=ref_date,
+            output_root=None,
+            artifact_store_root=None)
+        df = load_flu_data(model_config, run_config)
+        df, feat_names = create_features_and_targets(
+            df = df,
+            incl_level_feats=model_config.incl_level_feats,
+            max_horizon=run_config.max_horizon,
+            curr_feat_names=['inc_trans_cs', 'season_week', 'log_pop'],
+            categorical_encoding=model_config.categorical_encoding)
+        
+        for model_name, output_root in output_roots.items():
+            model_config, run_config = build_configs(
+                model_name=model_name,
+                ref_date=ref_date,
+                output_root=output_root,
+                artifact_store_root=experiment_root / 'model-artifacts')
+            
+            start_time = time.perf_counter()
+            save_path = train_and_save(model_config, run_config, df, feat_names)
+            seconds = time.perf_counter() - start_time
+            
+            preds_df = pd.read_csv(save_path, dtype={'location': str})
+            results.append({
+                'ref_date': ref_date,
+                'model_name': model_name,
+                'seconds': seconds,
+                'wis': mean_wis(preds_df, target_df)
+            })
+            print(results[-1])
+    
+    results = pd.DataFrame(results)
+    results.to_csv(experiment_root / 'results.csv', index=False)
+    print(results.groupby('model_name')[['seconds', 'wis']].mean())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# This script compares gbq_qr models fit from scratch ("cold" fits) with
+# models warm started from the previous week's boosters, for the reference
+# dates in the 2023/24 season. For each reference date, the data are loaded
+# and featurized once and both kinds of fits are run on them. The warm started
+# models for each week continue from the warm started models of the week
+# before; the first week has no earlier models and is fit from scratch.
+#
+# Model outputs are saved in retrospective-experiments/warm-start, together
+# with a csv file with the training time and the mean WIS for each reference
+# date, scored against the FluSight target data.
+
+# This script should be run with code/gbq as the working directory:
+# python retrospective-experiments/compare_warm_start.py
+
+import os
+import sys
+import time
+import datetime
+from pathlib import Path
+
+import pandas as pd
+
+# modules in code/gbq
+sys.path.insert(0, os.getcwd())
+
+from preprocess import create_features_and_targets
+from run import load_flu_data, train_and_save
+from utils import build_configs
+
+# helpers in retrospective-experiments
+from scoring import load_target_data, mean_wis
+
+
+ref_dates = [datetime.date(2023, 10, 14) + datetime.timedelta(i * 7) \
+    for i in range(29)]
+
+experiment_root = Path('retrospective-experiments/warm-start')
+
+
+def main():
+    target_df = load_target_data()
+    
+    results = list()
+    for ref_date in ref_dates:
+        model_config, run_config = build_configs(
+            model_name='gbq_qr',
+            ref_date=ref_date,
+            output_root=None,
+            artifact_store_root=None)
+        df = load_flu_data(model_config, run_config)
+        df, feat_names = create_features_and_targets(
+            df = df,
+            incl_level_feats=model_config.incl_level_feats,
+            max_horizon=run_config.max_horizon,
+            curr_feat_names=['inc_trans_cs', 'season_week', 'log_pop'],
+            categorical_encoding=model_config.categorical_encoding)
+        
+        for fit_type in ['cold', 'warm']:
+            model_config, run_config = build_configs(
+                model_name='gbq_qr',
+                ref_date=ref_date,
+                output_root=experiment_root / fit_type / 'model-output',
+                artifact_store_root=experiment_root / fit_type / 'model-artifacts',
+                save_models=(fit_type == 'warm'),
+                warm_start=(fit_type == 'warm'))
+            
+            start_time = time.perf_counter()
+            save_path = train_and_save(model_config, run_config, df, feat_names)
+            seconds = time.perf_counter() - start_time
+            
+            preds_df = pd.read_csv(save_path, dtype={'location': str})
+            results.append({
+                'ref_date': ref_date,
+                'fit_type': fit_type,
+                'seconds': seconds,
+                'wis': mean_wis(preds_df, target_df)
+            })
+            print(results[-1])
+    
+    results = pd.DataFrame(results)
+    results.to_csv(experiment_root / 'results.csv', index=False)
+    print(results.groupby('fit_type')[['seconds', 'wis']].mean())
+
+
+if __name__ == '__main__':
+    main()
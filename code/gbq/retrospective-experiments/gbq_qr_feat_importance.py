@@ -1,15 +1,26 @@
 # This script executes one retrospective run of the main gbq_qr model
-# and saves information about feature importances.
+# and saves information about feature importances, then prints a summary of
+# the feature importances saved for all reference dates so far.
 
 # This script should be run with code/gbq as the working directory:
 # python retrospective-experiments/gbq_qr_feat_importance.py
 
 import os
+import sys
+from pathlib import Path
+
+# modules in code/gbq
+sys.path.insert(0, os.getcwd())
+
+from feat_importance import load_feat_importance, summarize_feat_importance
 
 ref_date = '2024-01-06'
 output_root = '../../retrospective-hub/model-output'
 artifact_store_root = '../../retrospective-hub/model-artifacts'
 
-command = f'python gbq.py --ref_date {ref_date} --output_root {output_root} --artifact_store_root {artifact_store_root} --save_feat_importance'
+command = f'python gbq.py --ref_date {ref_date} --output_root {output_root} --artifact_store_root {artifact_store_root} --save_feat_importance --feat_importance_format parquet'
 
 os.system(command)
+
+feat_importance = load_feat_importance(Path(artifact_store_root), 'gbq_qr')
+print(summarize_feat_importance(feat_importance).head(20))
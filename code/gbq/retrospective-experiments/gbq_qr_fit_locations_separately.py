@@ -8,14 +8,18 @@
 # This script should be run with code/gbq as the working directory:
 # python retrospective-experiments/gbq_qr_fit_locations_separately.py
 
+import argparse
 import os
+import sys
 import datetime
-from multiprocessing import freeze_support, Pool
+from pathlib import Path
 
+# modules in code/gbq, and modules shared with code/sarix_model in code/common
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.join(os.getcwd(), '..', 'common'))
 
-def run_command(command):
-    """Run system command"""
-    os.system(command)
+from scheduler import available_cores, gbq_batch_job, run_jobs
+from work_queue import enqueue, run_worker
 
 
 missing_ref_dates = [
@@ -24,13 +28,33 @@ missing_ref_dates = [
 
 output_root = '../../retrospective-hub/model-output'
 
-commands = [f'python gbq.py --ref_date {ref_date} --output_root {output_root} --model_name gbq_qr_fit_locations_separately' \
-                for ref_date in missing_ref_dates]
-
-def main():
-    with Pool(processes=2) as pool:
-        pool.map(run_command, commands)
-
-if __name__ == '__main__':
-    freeze_support()
-    main()
+# each reference date is a batch.py run submitted as a job to
+# scheduler.run_jobs, as for gbq_qr_no_level.py; two reference dates are run
+# at a time, with the cores split between them, each fitting four locations
+# at a time. Reference dates whose outputs are already in the hub are skipped
+# and failed runs are retried; if the script is interrupted, rerunning it
+# resumes from where it stopped. With --queue_dir, the reference dates are
+# instead added to a work queue in a shared directory, and run by every
+# process running this script with the same --queue_dir, on any host (see
+# work_queue.py).
+num_threads = max(len(available_cores()) // 2, 1)
+jobs = [gbq_batch_job(['gbq_qr_fit_locations_separately'], ref_date, output_root,
+                      threads=num_threads, args=['--location_workers', 4]) \
+        for ref_date in missing_ref_dates]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--queue_dir',
+                    help='Optional path to a work queue directory shared by several workers; each worker, on any host, runs this script with the same --queue_dir',
+                    type=lambda s: Path(s),
+                    default=None)
+args = parser.parse_args()
+
+if args.queue_dir is None:
+    manifest = run_jobs(jobs, log_dir=Path('retrospective-experiments/logs/gbq_qr_fit_locations_separately'))
+else:
+    enqueue(args.queue_dir, jobs)
+    manifest = run_worker(args.queue_dir)
+print(manifest['status'].value_counts())
+
+if (manifest['status'] == 'failed').any():
+    raise SystemExit(1)
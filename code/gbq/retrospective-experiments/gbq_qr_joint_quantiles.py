@@ -0,0 +1,26 @@
+# This script generates predictions for the gbq_qr_joint_quantiles model for all reference dates,
+# to compare its accuracy with that of gbq_qr. Retrospective model fits are generated using
+# the data that would have been available in real time.
+#
+# To maintain transparency about which model outputs were and were not generated in
+# real time, these model outputs are stored in flusion/retrospective-hub.
+
+# This script should be run with code/gbq as the working directory:
+# python retrospective-experiments/gbq_qr_joint_quantiles.py
+
+import os
+import datetime
+
+
+missing_ref_dates = [
+    (datetime.date(2023, 10, 14) + datetime.timedelta(i * 7)).isoformat() \
+        for i in range(29)]
+
+output_root = '../../retrospective-hub/model-output'
+
+# all reference dates are run by a single batch process, which avoids paying
+# startup and import costs once per reference date; two reference dates
+# are run at a time
+command = f'python batch.py --ref_dates {" ".join(missing_ref_dates)} --output_root {output_root} --model_names gbq_qr_joint_quantiles --processes 2'
+
+os.system(command)
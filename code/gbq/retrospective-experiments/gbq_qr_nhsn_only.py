@@ -10,12 +10,6 @@
 
 import os
 import datetime
-from multiprocessing import Pool
-
-
-def run_command(command):
-    """Run system command"""
-    os.system(command)
 
 
 missing_ref_dates = [
@@ -24,8 +18,9 @@ missing_ref_dates = [
 
 output_root = '../../retrospective-hub/model-output'
 
-commands = [f'python gbq.py --ref_date {ref_date} --output_root {output_root} --model_name gbq_qr_nhsn_only' \
-                for ref_date in missing_ref_dates]
+# all reference dates are run by a single batch process, which avoids paying
+# startup and import costs once per reference date; two reference dates
+# are run at a time
+command = f'python batch.py --ref_dates {" ".join(missing_ref_dates)} --output_root {output_root} --model_names gbq_qr_nhsn_only --processes 2'
 
-with Pool(processes=2) as pool:
-    pool.map(run_command, commands)
+os.system(command)
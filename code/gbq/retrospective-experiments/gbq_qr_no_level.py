@@ -13,14 +13,18 @@
 # This script should be run with code/gbq as the working directory:
 # python retrospective-experiments/fill_gbq_no_level.py
 
+import argparse
 import os
+import sys
 import datetime
-from multiprocessing import Pool
+from pathlib import Path
 
+# modules in code/gbq, and modules shared with code/sarix_model in code/common
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.join(os.getcwd(), '..', 'common'))
 
-def run_command(command):
-    """Run system command"""
-    os.system(command)
+from scheduler import available_cores, gbq_batch_job, run_jobs
+from work_queue import enqueue, run_worker
 
 
 missing_ref_dates_group1 = [
@@ -33,8 +37,32 @@ missing_ref_dates = missing_ref_dates_group1 + missing_ref_dates_group2
 
 output_root = '../../retrospective-hub/model-output'
 
-commands = [f'python gbq.py --ref_date {ref_date} --output_root {output_root} --model_name gbq_qr_no_level' \
-                for ref_date in missing_ref_dates]
+# each reference date is a batch.py run, as in the other retrospective
+# experiments, submitted as a job to scheduler.run_jobs; two reference dates
+# are run at a time, with the cores split between them so that the two
+# LightGBM processes don't each use every core. Reference dates whose outputs are already in the hub are skipped and
+# failed runs are retried; if the script is interrupted, rerunning it resumes
+# from where it stopped. With --queue_dir, the reference dates are instead
+# added to a work queue in a shared directory, and run by every process
+# running this script with the same --queue_dir, on any host (see
+# work_queue.py).
+num_threads = max(len(available_cores()) // 2, 1)
+jobs = [gbq_batch_job(['gbq_qr_no_level'], ref_date, output_root, threads=num_threads) \
+        for ref_date in missing_ref_dates]
 
-with Pool(processes=2) as pool:
-    pool.map(run_command, commands)
+parser = argparse.ArgumentParser()
+parser.add_argument('--queue_dir',
+                    help='Optional path to a work queue directory shared by several workers; each worker, on any host, runs this script with the same --queue_dir',
+                    type=lambda s: Path(s),
+                    default=None)
+args = parser.parse_args()
+
+if args.queue_dir is None:
+    manifest = run_jobs(jobs, log_dir=Path('retrospective-experiments/logs/gbq_qr_no_level'))
+else:
+    enqueue(args.queue_dir, jobs)
+    manifest = run_worker(args.queue_dir)
+print(manifest['status'].value_counts())
+
+if (manifest['status'] == 'failed').any():
+    raise SystemExit(1)
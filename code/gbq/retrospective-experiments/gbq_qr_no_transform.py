@@ -10,12 +10,6 @@
 
 import os
 import datetime
-from multiprocessing import freeze_support, Pool
-
-
-def run_command(command):
-    """Run system command"""
-    os.system(command)
 
 
 missing_ref_dates = [
@@ -24,14 +18,9 @@ missing_ref_dates = [
 
 output_root = '../../retrospective-hub/model-output'
 
-commands = [f'python gbq.py --ref_date {ref_date} --output_root {output_root} --model_name gbq_qr_no_transform' \
-                for ref_date in missing_ref_dates]
-
-def main():
-    with Pool(processes=2) as pool:
-        freeze_support()
-        pool.map(run_command, commands)
+# all reference dates are run by a single batch process, which avoids paying
+# startup and import costs once per reference date; two reference dates
+# are run at a time
+command = f'python batch.py --ref_dates {" ".join(missing_ref_dates)} --output_root {output_root} --model_names gbq_qr_no_transform --processes 2'
 
-if __name__ == '__main__':
-    freeze_support()
-    main()
+os.system(command)
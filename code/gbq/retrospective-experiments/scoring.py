@@ -0,0 +1,47 @@
+# Helpers for scoring model outputs in the comparisons in this directory.
+
+import numpy as np
+import pandas as pd
+
+
+target_data_url = 'https://raw.githubusercontent.com/cdcepi/FluSight-forecast-hub/refs/heads/main/target-data/target-hospital-admissions.csv'
+
+
+def load_target_data():
+    '''
+    Load the FluSight target data.
+    
+    Returns
+    -------
+    data frame with columns `location`, `target_end_date` and `observation`
+    '''
+    return pd.read_csv(target_data_url, dtype={'location': str}) \
+        .rename(columns={'date': 'target_end_date', 'value': 'observation'}) \
+        [['location', 'target_end_date', 'observation']]
+
+
+def mean_wis(preds_df, target_df):
+    '''
+    Mean weighted interval score of quantile predictions, computed as the
+    mean across quantile levels of twice the pinball loss. Scores exclude the
+    US and location 78, as in code/eval.
+    
+    Parameters
+    ----------
+    preds_df: data frame of predictions in FluSight hub format
+    target_df: data frame from `load_target_data`
+    
+    Returns
+    -------
+    float, or nan if there are no observations for the predictions yet
+    '''
+    df = preds_df.merge(target_df, on=['location', 'target_end_date']) \
+        .query("location != 'US' and location != '78'")
+    if df.empty:
+        return np.nan
+    
+    tau = df['output_type_id'].astype(float)
+    resid = df['observation'] - df['value']
+    df['wis'] = 2 * np.maximum(tau * resid, (tau - 1) * resid)
+    
+    return df.groupby(['location', 'target_end_date'])['wis'].mean().mean()
@@ -1,25 +1,71 @@
 from tqdm.autonotebook import tqdm
+import bisect
+import datetime
+import sys
 import time
+import warnings
+from statistics import NormalDist
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
-import lightgbm as lgb
+# modules shared by the gbq and sarix models
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
 
 from iddata.loader import FluDataLoader
+import model_store
+from feat_importance import FeatImportanceCollector, save_feat_importance
+from hub_output import FILE_SUFFIXES, get_hub_schema, write_model_output
 from preprocess import create_features_and_targets
+from train import StackedMatrix, fit_bag, fit_joint_bag, get_n_jobs, predict_bag, to_float_array
+from vintage_store import VintageStore
 
 
 def run_gbq_flu_model(model_config, run_config):
     '''
-    Load flu data, generate predictions from a gbq model, and save them as a csv file.
+    Load flu data, generate predictions from a gbq model, and save them as a model output file.
     
     Parameters
     ----------
     model_config: configuration object with settings for the model
     run_config: configuration object with settings for the run
+    
+    Returns
+    -------
+    `pathlib.Path` to the saved model outputs
     '''
     # load flu data
+    df = load_flu_data(model_config, run_config)
+    
+    # augment data with features and target values
+    df, feat_names = create_features_and_targets(
+        df = df,
+        incl_level_feats=model_config.incl_level_feats,
+        max_horizon=run_config.max_horizon,
+        curr_feat_names=['inc_trans_cs', 'season_week', 'log_pop'],
+        categorical_encoding=model_config.categorical_encoding,
+        cache_dir=run_config.feature_cache_dir,
+        incremental=run_config.incremental_features)
+    
+    return train_and_save(model_config, run_config, df, feat_names)
+
+
+def load_flu_data(model_config, run_config):
+    '''
+    Load the flu data that were available as of the reference date, from the
+    vintage store in `run_config.vintage_store_dir` if it is set.
+    
+    Parameters
+    ----------
+    model_config: configuration object with settings for the model
+    run_config: configuration object with settings for the run
+    
+    Returns
+    -------
+    Pandas data frame with flu data
+    '''
     if model_config.reporting_adj:
         ilinet_kwargs = None
         flusurvnet_kwargs = None
@@ -27,54 +73,314 @@ def run_gbq_flu_model(model_config, run_config):
         ilinet_kwargs = {'scale_to_positive': False}
         flusurvnet_kwargs = {'burden_adj': False}
     
-    fdl = FluDataLoader()
+    if run_config.vintage_store_dir is None:
+        fdl = FluDataLoader()
+    else:
+        fdl = VintageStore(run_config.vintage_store_dir)
     df = fdl.load_data(nhsn_kwargs={'as_of': run_config.ref_date},
                        ilinet_kwargs=ilinet_kwargs,
                        flusurvnet_kwargs=flusurvnet_kwargs,
                        sources=model_config.sources,
                        power_transform=model_config.power_transform)
     
-    # augment data with features and target values
-    df, feat_names = create_features_and_targets(
-        df = df,
-        incl_level_feats=model_config.incl_level_feats,
-        max_horizon=run_config.max_horizon,
-        curr_feat_names=['inc_trans_cs', 'season_week', 'log_pop'])
+    return df
+
+
+def train_and_save(model_config, run_config, df, feat_names):
+    '''
+    Train a gbq model on featurized flu data and save test set predictions
+    in the file format given by `run_config.output_format`. With `run_config.save_models`, the fitted boosters are
+    also saved in the artifact store; with `run_config.predict_only`, the
+    boosters saved by an earlier run for the same model and reference date
+    are used instead of training. With `run_config.warm_start`, training
+    continues from the boosters saved for the previous week's reference date.
     
-    # keep only rows that are in-season
-    df = df.query("season_week >= 5 and season_week <= 45")
+    Parameters
+    ----------
+    model_config: configuration object with settings for the model
+    run_config: configuration object with settings for the run
+    df: data frame with features and targets, from `create_features_and_targets`.
+        It is not modified, so it can be shared across runs.
+    feat_names: list of names of columns with features
     
-    # "test set" df used to generate look-ahead predictions
-    df_test = df.loc[df.wk_end_date == df.wk_end_date.max()] \
-        .copy()
+    Returns
+    -------
+    `pathlib.Path` to the saved model outputs
+    '''
+    train_rows, df_test = _split_train_test(df)
     
-    # "train set" df for model fitting; target value non-missing
-    df_train = df.loc[~df['delta_target'].isna().values]
+    if model_config.fit_locations_separately:
+        locations = list(df_test['location'].unique())
+    else:
+        locations = None
     
-    # train model and obtain test set predictinos
+    # directory for stored models
+    model_dir = None
+    if run_config.predict_only or run_config.save_models:
+        model_dir = _build_model_dir(
+            root=run_config.artifact_store_root,
+            model_config=model_config,
+            ref_date=run_config.ref_date)
+    
+    # directory for stored models to warm start from
+    init_model_dir = None
+    init_layout = None
+    if run_config.warm_start:
+        init_model_dir, init_layout = _get_init_model_dir(
+            model_config, run_config, df_test, feat_names, locations)
+    init_seasons = None if init_layout is None else init_layout['seasons']
+    
+    stored_num_bags = None
+    if run_config.predict_only:
+        layout = model_store.load_layout(model_dir)
+        df_test = _apply_model_layout(model_config, run_config, df_test,
+                                      feat_names, locations, layout)
+        stored_num_bags = layout['num_bags_used']
+    elif run_config.save_models:
+        model_store.invalidate(model_dir)
+    
+    # train model and obtain test set predictinos, and the number of bags used
+    # for each location, or for all locations together
     if model_config.fit_locations_separately:
-        locations = df_test['location'].unique()
-        preds_df = [
-            _train_gbq_and_predict(model_config, run_config,
-                                   df_train, df_test, feat_names, location) \
-            for location in locations
-        ]
-        preds_df = pd.concat(preds_df, axis=0)
+        # partition the data by location once; with `run_config.location_workers`
+        # greater than 1, locations are fit in parallel threads, which share
+        # the partitioned data rather than receiving copies of it
+        train_rows_by_location = {
+            location: rows.to_numpy() for location, rows in \
+            pd.Series(train_rows).groupby(df['location'].iloc[train_rows].to_numpy(), sort=False)
+        }
+        df_test_by_location = dict(tuple(df_test.groupby('location', sort=False, observed=True)))
+        with ThreadPoolExecutor(max_workers=run_config.location_workers) as executor:
+            futures = [
+                executor.submit(_train_gbq_and_predict, model_config, run_config,
+                                df, train_rows_by_location.get(location, train_rows[:0]),
+                                df_test_by_location[location], feat_names,
+                                location, model_dir, init_model_dir,
+                                init_seasons, stored_num_bags) \
+                for location in locations
+            ]
+            results = [future.result() for future in futures]
+        preds_df = pd.concat([r[0] for r in results], axis=0)
+        num_bags_used = {location: r[1] for location, r in zip(locations, results)}
+        feat_importance = [r[2].assign(location=location) \
+                           for location, r in zip(locations, results) if r[2] is not None]
+        seasons = {location: r[3] for location, r in zip(locations, results)}
     else:
-        preds_df = _train_gbq_and_predict(model_config, run_config,
-                                          df_train, df_test, feat_names)
+        preds_df, num_bags_used, feat_importance, seasons = _train_gbq_and_predict(
+            model_config, run_config, df, train_rows, df_test, feat_names,
+            model_dir=model_dir, init_model_dir=init_model_dir,
+            init_seasons=init_seasons, stored_num_bags=stored_num_bags)
+        num_bags_used = {'all': num_bags_used}
+        feat_importance = [feat_importance] if feat_importance is not None else []
+        seasons = {'all': seasons}
+    
+    # save feature importance scores for all locations in one file
+    if len(feat_importance) > 0:
+        feat_importance_path = _build_save_path(
+            root=run_config.artifact_store_root,
+            run_config=run_config,
+            model_config=model_config,
+            subdir='feat_importance',
+            suffix=f'.{run_config.feat_importance_format}')
+        feat_importance = pd.concat(feat_importance, axis=0, ignore_index=True)
+        save_feat_importance(feat_importance, feat_importance_path)
+    
+    # with adaptive bagging, save the number of bags used
+    if model_config.adaptive_bags:
+        num_bags_path = _build_save_path(
+            root=run_config.artifact_store_root,
+            run_config=run_config,
+            model_config=model_config,
+            subdir='num_bags')
+        pd.DataFrame({'location': list(num_bags_used.keys()),
+                      'num_bags': list(num_bags_used.values()),
+                      'max_num_bags': model_config.num_bags}) \
+            .to_csv(num_bags_path, index=False)
+    
+    # the layout is saved last, marking the stored models as complete
+    if run_config.save_models:
+        layout = _build_model_layout(model_config, run_config, df_test,
+                                     feat_names, locations)
+        layout['warm_started'] = init_model_dir is not None
+        layout['warm_start_weeks'] = 0 if init_layout is None \
+            else init_layout['warm_start_weeks'] + 1
+        layout['num_bags_used'] = num_bags_used
+        layout['seasons'] = seasons
+        model_store.save_layout(model_dir, layout)
     
     # save
     save_path = _build_save_path(
         root=run_config.output_root,
         run_config=run_config,
-        model_config=model_config
+        model_config=model_config,
+        suffix=FILE_SUFFIXES[run_config.output_format]
     )
-    preds_df.to_csv(save_path, index=False)
+    write_model_output(preds_df, save_path, run_config.output_format,
+                       get_hub_schema(run_config.output_root))
+    
+    return save_path
+
+
+def _split_train_test(df):
+    '''
+    Split featurized data into a training set and a test set.
+    
+    Parameters
+    ----------
+    df: data frame with features and targets
+    
+    Returns
+    -------
+    tuple with the integer positions in `df` of the training rows, those with
+    non-missing target values, and a data frame with test data, the rows for
+    the last observed date. The training rows are not copied, since the
+    training features are read from `df` by `train.StackedMatrix`.
+    '''
+    # keep only rows that are in-season; rows are selected from df once for
+    # each set, without an intermediate copy of the in-season rows
+    in_season = df['season_week'].between(5, 45).values
+    wk_end_date = df['wk_end_date'].values
+    
+    # "test set" df used to generate look-ahead predictions. Its rows are
+    # selected column by column: selecting rows of the whole frame would first
+    # consolidate the columns of df, copying all of it if its columns are
+    # separate arrays, as for a `shared_frame.AttachedFrame`
+    test_rows = np.flatnonzero(in_season & (wk_end_date == wk_end_date[in_season].max()))
+    df_test = pd.DataFrame({c: df[c].iloc[test_rows] for c in df.columns})
+    
+    # "train set" rows for model fitting; target value non-missing
+    train_rows = np.flatnonzero(in_season & ~df['delta_target'].isna().values)
+    
+    return train_rows, df_test
+
+
+def _build_model_layout(model_config, run_config, df_test, feat_names, locations):
+    '''
+    Description of the stored models for a run: the settings needed to use
+    them, the feature column layout including the categories of categorical
+    features, and the transform factors of the data they were fit to.
+    
+    Returns
+    -------
+    json-serializable dictionary
+    '''
+    categories = {
+        f: list(df_test[f].cat.categories) \
+        for f in feat_names if isinstance(df_test[f].dtype, pd.CategoricalDtype)
+    }
+    transform_factors = df_test[['source', 'location', 'inc_trans_center_factor',
+                                 'inc_trans_scale_factor']] \
+        .drop_duplicates(subset=['source', 'location'])
+    
+    return {
+        'model_name': model_config.model_name,
+        'ref_date': str(run_config.ref_date),
+        'num_bags': model_config.num_bags,
+        'q_levels': _get_fit_q_levels(model_config, run_config),
+        'locations': locations,
+        'feat_names': feat_names,
+        'categories': categories,
+        'transform_factors': transform_factors.to_dict(orient='records')
+    }
+
+
+def _apply_model_layout(model_config, run_config, df_test, feat_names, locations, layout):
+    '''
+    Check that test data can be scored by stored models, and encode their
+    categorical features as in the data the models were fit to.
+    
+    Parameters
+    ----------
+    model_config: configuration object with settings for the model
+    run_config: configuration object with settings for the run
+    df_test: data frame with test data
+    feat_names: list of names of columns with features
+    locations: list of locations fit separately, or None
+    layout: dictionary from `model_store.load_layout`
+    
+    Returns
+    -------
+    df_test, with categorical features using the stored categories
+    '''
+    _check_model_layout(model_config, run_config, feat_names, locations, layout)
+    
+    df_test = df_test.assign(**{
+        f: df_test[f].cat.set_categories(categories) \
+        for f, categories in layout['categories'].items()
+    })
+    
+    # the models were fit to data centered and scaled with the stored
+    # factors; revised data may have been transformed differently
+    factor_cols = ['inc_trans_center_factor', 'inc_trans_scale_factor']
+    stored_factors = pd.DataFrame(layout['transform_factors'])
+    factors = df_test[['source', 'location'] + factor_cols] \
+        .drop_duplicates(subset=['source', 'location']) \
+        .merge(stored_factors, how='left', on=['source', 'location'],
+               suffixes=('', '_stored'))
+    if not np.allclose(factors[factor_cols].values,
+                       factors[[f'{c}_stored' for c in factor_cols]].values):
+        warnings.warn('transform factors differ from those of the data the '
+                      'stored models were fit to')
+    
+    return df_test
+
+
+def _check_model_layout(model_config, run_config, feat_names, locations, layout):
+    # raise a ValueError if stored models can't be used for this run
+    if feat_names != layout['feat_names']:
+        raise ValueError('features differ from those of the stored models')
+    if model_config.num_bags != layout['num_bags'] or \
+            _get_fit_q_levels(model_config, run_config) != layout['q_levels']:
+        raise ValueError('num_bags or q_levels differ from those of the stored models')
+    if locations is not None and not set(locations) <= set(layout['locations'] or []):
+        raise ValueError('no stored models for some locations in the test data')
+
+
+def _get_init_model_dir(model_config, run_config, df_test, feat_names, locations):
+    '''
+    Find the stored models for the previous week's reference date, to warm
+    start from. Models are fit from scratch if there are no stored models,
+    if their features or settings differ from those of this run, or if they
+    end a chain of `model_config.warm_start_max_weeks` warm started runs.
+    
+    Returns
+    -------
+    tuple with the `pathlib.Path` of the directory of the stored models and
+    their layout from `model_store.load_layout`, or (None, None)
+    '''
+    init_model_dir = _build_model_dir(
+        root=run_config.artifact_store_root,
+        model_config=model_config,
+        ref_date=run_config.ref_date - datetime.timedelta(days=7))
+    
+    try:
+        layout = model_store.load_layout(init_model_dir)
+        _check_model_layout(model_config, run_config, feat_names, locations, layout)
+        
+        # categorical features must be coded as in the stored models' data
+        for f, categories in layout['categories'].items():
+            if list(df_test[f].cat.categories) != categories:
+                raise ValueError(f'categories of {f} differ from those of the stored models')
+        
+        # bags are refit to the seasons they were fit to before
+        if 'seasons' not in layout:
+            raise ValueError('stored models do not record the seasons of their bags')
+    except (FileNotFoundError, ValueError) as e:
+        warnings.warn(f'fitting models without warm start: {e}')
+        return None, None
+    
+    # warm started models grow by warm_start_num_boost_round rounds each
+    # week; chains of warm started runs are ended by a refit from scratch
+    if layout['warm_start_weeks'] >= model_config.warm_start_max_weeks:
+        return None, None
+    
+    return init_model_dir, layout
 
 
 def _train_gbq_and_predict(model_config, run_config,
-                           df_train, df_test, feat_names, location = None):
+                           df, train_rows, df_test, feat_names, location = None,
+                           model_dir = None, init_model_dir = None,
+                           init_seasons = None, stored_num_bags = None):
     '''
     Train gbq model and get predictions on the original target scale,
     formatted in the FluSight hub format.
@@ -83,76 +389,69 @@ def _train_gbq_and_predict(model_config, run_config,
     ----------
     model_config: configuration object with settings for the model
     run_config: configuration object with settings for the run
-    df_train: data frame with training data
+    df: data frame with features and targets
+    train_rows: array of integer positions in `df` of the training rows
     df_test: data frame with test data
     feat_names: list of names of columns with features
-    location: optional string of location to fit to. Default, None, fits to all locations
+    location: optional string of location to fit to. Default, None, fits to
+        all locations. If provided, `train_rows` and `df_test` should contain
+        only the rows for that location
+    model_dir: optional `pathlib.Path` with the directory for stored models;
+        required if `run_config.save_models` or `run_config.predict_only`
+    init_model_dir: optional `pathlib.Path` with the directory of stored
+        models to warm start from
+    init_seasons: dictionary with the training seasons of the stored models
+        to warm start from, for each location or for 'all' locations, as
+        returned by `_get_test_quantile_predictions`; required with
+        `init_model_dir`
+    stored_num_bags: dictionary with the number of bags of stored models for
+        each location, or for 'all' locations; required if
+        `run_config.predict_only`
     
     Returns
     -------
-    Pandas data frame with test set predictions in FluSight hub format
+    tuple with a Pandas data frame with test set predictions in FluSight hub
+    format, the number of bags used, and feature importance scores and
+    training seasons as for `_get_test_quantile_predictions`; the seasons are
+    None with `run_config.predict_only`
     '''
-    # filter to location if necessary
-    if location is not None:
-        df_test = df_test.query(f'location == "{location}"')
-        df_train = df_train.query(f'location == "{location}"')
-    
-    # get x and y
-    x_test = df_test[feat_names]
-    x_train = df_train[feat_names]
-    y_train = df_train['delta_target']
-    
     # test set predictions:
     # same number of rows as df_test, one column per quantile level
-    test_pred_qs_df = _get_test_quantile_predictions(
-        model_config, run_config,
-        df_train, x_train, y_train, x_test
-    )
-    
-    # add predictions to original test df
-    df_test.reset_index(drop=True, inplace=True)
-    df_test_w_preds = pd.concat([df_test, test_pred_qs_df], axis=1)
-    
-    # melt to get columns into rows, keeping only the things we need to invert data
-    # transforms later on
-    cols_to_keep = ['source', 'location', 'wk_end_date', 'pop',
-                    'inc_trans_cs', 'horizon',
-                    'inc_trans_center_factor', 'inc_trans_scale_factor']
-    preds_df = df_test_w_preds[cols_to_keep + run_config.q_labels]
-    preds_df = preds_df.loc[(preds_df['source'] == 'nhsn')]
-    preds_df = pd.melt(preds_df,
-                       id_vars=cols_to_keep,
-                       var_name='quantile',
-                       value_name = 'delta_hat')
-    
-    # build data frame with predictions on the original scale
-    preds_df['inc_trans_cs_target_hat'] = preds_df['inc_trans_cs'] + preds_df['delta_hat']
-    preds_df['inc_trans_target_hat'] = (preds_df['inc_trans_cs_target_hat'] + preds_df['inc_trans_center_factor']) * (preds_df['inc_trans_scale_factor'] + 0.01)
-    if model_config.power_transform == '4rt':
-        inv_power = 4
-    elif model_config.power_transform is None:
-        inv_power = 1
+    x_test = to_float_array(df_test, feat_names)
+    if run_config.predict_only:
+        test_pred_qs, num_bags_used, feat_importance = _get_stored_test_quantile_predictions(
+            model_config, run_config, x_test, model_dir, location,
+            stored_num_bags['all' if location is None else location]
+        )
+        seasons = None
     else:
-        raise ValueError('unsupported power_transform: must be "4rt" or None')
-    
-    preds_df['value'] = (np.maximum(preds_df['inc_trans_target_hat'], 0.0) ** inv_power - 0.01 - 0.75**4) * preds_df['pop'] / 100000
-    preds_df['value'] = np.maximum(preds_df['value'], 0.0)
-    
-    # get predictions into the format needed for FluSight hub submission
-    preds_df = _format_as_flusight_output(preds_df, run_config.ref_date)
-    
-    # sort quantiles to avoid quantile crossing
-    preds_df = _quantile_noncrossing(
-        preds_df,
-        gcols = ['location', 'reference_date', 'horizon', 'target_end_date',
-                 'target', 'output_type']
-    )
-    
-    return preds_df
+        # get x and y; training features are stored without repeating them
+        # for each horizon
+        x_train = StackedMatrix(df, feat_names, row_inds=train_rows)
+        y_train = df['delta_target'].to_numpy()[train_rows]
+        train_season = df['season'].iloc[train_rows]
+        
+        if init_seasons is not None:
+            init_seasons = init_seasons['all' if location is None else location]
+        
+        test_pred_qs, num_bags_used, feat_importance, seasons = _get_test_quantile_predictions(
+            model_config, run_config,
+            train_season, x_train, y_train, x_test, model_dir, location,
+            init_model_dir, init_seasons
+        )
+    
+    # predictions on the original scale, in the format needed for FluSight
+    # hub submission
+    preds_df = _build_hub_output(model_config, run_config, df_test,
+                                 test_pred_qs)
+    
+    return preds_df, num_bags_used, feat_importance, seasons
 
 
 def _get_test_quantile_predictions(model_config, run_config,
-                                   df_train, x_train, y_train, x_test):
+                                   train_season, x_train, y_train, x_test,
+                                   model_dir=None, location=None,
+                                   init_model_dir=None, init_seasons=None):
     '''
     Train the model on bagged subsets of the training data and obtain
     quantile predictions. This is the heart of the method.
@@ -161,121 +460,441 @@ def _get_test_quantile_predictions(model_config, run_config,
     ----------
     model_config: configuration object with settings for the model
     run_config: configuration object with settings for the run
-    df_train: Pandas data frame with training data
-    x_train: numpy array with training instances in rows, features in columns
+    train_season: Pandas series with the season of each training instance,
+        used to draw the bags
+    x_train: `train.StackedMatrix` with training instances in rows, features
+        in columns
     y_train: numpy array with target values
     x_test: numpy array with test instances in rows, features in columns
+    model_dir: optional `pathlib.Path` with the directory in which to save
+        the fitted models, if `run_config.save_models`
+    location: optional string location the models are fit to
+    init_model_dir: optional `pathlib.Path` with the directory of stored
+        models to continue training from, adding
+        `model_config.warm_start_num_boost_round` rounds to each
+    init_seasons: dictionary with the training seasons of the stored models
+        in `init_model_dir`, as returned by this function; required with
+        `init_model_dir`. Warm started bags are fit to the seasons of the
+        models they continue from, and to any seasons that are new since.
+    
+    With `model_config.quantile_fit` set to 'joint', a single model is fit
+    for all quantile levels in each bag, taking the quantile level as a
+    feature; see `train.fit_joint_bag`.
+    
+    With `model_config.adaptive_bags`, bags are added until the median of
+    the predictions across bags changes by less than
+    `model_config.adaptive_bags_tol` for every test instance and quantile
+    level for `model_config.adaptive_bags_patience` bags in a row, using at
+    least `model_config.adaptive_bags_min` and at most `model_config.num_bags`
+    bags.
     
     Returns
     -------
-    Pandas data frame with test set predictions. The number of rows matches
-    the number of rows of `x_test`. The number of columns matches the number
-    of quantile levels for predictions as specified in the `run_config`.
-    Column names are given by `run_config.q_labels`.
+    tuple with:
+    - numpy array with test set predictions. The number of rows matches
+      the number of rows of `x_test`. The columns correspond to the quantile
+      levels for predictions given by `run_config.q_levels`.
+    - the number of bags used
+    - with `run_config.save_feat_importance`, a Pandas data frame with
+      feature importance scores for the bags used, from
+      `feat_importance.FeatImportanceCollector.to_frame`; otherwise None
+    - a json-serializable dictionary with the seasons in the training data,
+      under 'train', and the list of seasons of each bag, under 'bags'
     '''
     # seed for random number generation, based on reference date
     rng_seed = int(time.mktime(run_config.ref_date.timetuple()))
     rng = np.random.default_rng(seed=rng_seed)
     # seeds for lgb model fits, one per combination of bag and quantile level
-    lgb_seeds = rng.integers(1e8, size=(model_config.num_bags, len(run_config.q_levels)))
+    fit_q_levels = _get_fit_q_levels(model_config, run_config)
+    lgb_seeds = rng.integers(1e8, size=(model_config.num_bags, len(fit_q_levels)))
     
     # training loop over bags
-    test_preds_by_bag = np.empty((x_test.shape[0], model_config.num_bags, len(run_config.q_levels)))
-    
-    train_seasons = df_train['season'].unique()
+    test_preds_by_bag = np.empty((x_test.shape[0], model_config.num_bags, len(fit_q_levels)))
     
-    feat_importance = list()
+    train_seasons = train_season.unique()
     
-    for b in tqdm(range(model_config.num_bags), 'Bag number'):
-        # get indices of observations that are in bag
-        bag_seasons = rng.choice(
+    # feature importance scores, only collected if they are saved
+    feat_importance = None
+    if run_config.save_feat_importance:
+        if model_config.quantile_fit == 'joint':
+            # one model for all quantile levels, with the level as a feature
+            feat_importance = FeatImportanceCollector(
+                x_train.feat_names + ['q_level'], model_config.num_bags, [np.nan])
+        else:
+            feat_importance = FeatImportanceCollector(
+                x_train.feat_names, model_config.num_bags, fit_q_levels)
+    
+    # bag membership is drawn up front, in the same order as in a serial run,
+    # so that results do not depend on the number of workers
+    bag_seasons = [
+        rng.choice(
             train_seasons,
             size = int(len(train_seasons) * model_config.bag_frac_samples),
-            replace=False)
-        bag_obs_inds = df_train['season'].isin(bag_seasons)
+            replace=False).tolist() \
+        for b in range(model_config.num_bags)
+    ]
+    
+    # stored models to warm start from; bags without a stored model are fit
+    # from scratch
+    init_model_paths = [
+        _get_init_model_paths(model_config, run_config, init_model_dir, b, location) \
+        for b in range(model_config.num_bags)
+    ]
+    
+    # warm started bags keep the seasons of the models they continue from, so
+    # that the stored trees are not refit to seasons they held out, and add
+    # the seasons that are new since
+    if init_seasons is not None:
+        new_seasons = [s for s in train_seasons.tolist() if s not in init_seasons['train']]
+        for b in range(model_config.num_bags):
+            if init_model_paths[b] is not None:
+                bag_seasons[b] = init_seasons['bags'][b] + new_seasons
+    
+    bag_obs_inds = [train_season.isin(seasons).values for seasons in bag_seasons]
+    
+    # fit bags in parallel, splitting the cores among the workers;
+    # LightGBM releases the GIL, so threads are sufficient
+    n_jobs = get_n_jobs(_num_concurrent_fits(model_config, run_config),
+                        run_config.num_threads)
+    num_bags_used = model_config.num_bags
+    with ThreadPoolExecutor(max_workers=run_config.num_workers) as executor:
+        futures = {
+            executor.submit(_fit_bag, model_config, run_config,
+                            x_train, y_train, bag_obs_inds[b],
+                            lgb_seeds[b, :], x_test, n_jobs,
+                            _get_model_paths(model_config, run_config, model_dir, b, location),
+                            init_model_paths[b],
+                            _get_num_boost_round(model_config, init_model_paths[b])): b \
+            for b in range(model_config.num_bags)
+        }
         
-        for q_ind, q_level in enumerate(run_config.q_levels):
-            # fit to bag
-            model = lgb.LGBMRegressor(
-                verbosity=-1,
-                objective='quantile',
-                alpha=q_level,
-                random_state=lgb_seeds[b, q_ind])
-            model.fit(X=x_train.loc[bag_obs_inds, :], y=y_train.loc[bag_obs_inds])
-
-            feat_importance.append(
-                pd.DataFrame({
-                    'feat': x_train.columns,
-                    'importance': model.feature_importances_,
-                    'b': b,
-                    'q_level': q_level
-                })
-            )
+        # with adaptive bagging, the median across bags is tracked as bags
+        # complete, in bag order so that the number of bags used does not
+        # depend on the number of workers
+        bag_done = np.zeros(model_config.num_bags, dtype=bool)
+        num_bags_checked = 0
+        num_stable = 0
+        prev_median = None
+        for future in tqdm(as_completed(futures), 'Bag number',
+                           total=model_config.num_bags):
+            b = futures[future]
+            test_preds_by_bag[:, b, :], bag_feat_importance = future.result()
+            if feat_importance is not None:
+                feat_importance.add(b, bag_feat_importance)
+            if not model_config.adaptive_bags:
+                continue
+            
+            bag_done[b] = True
+            while num_bags_checked < model_config.num_bags and bag_done[num_bags_checked]:
+                num_bags_checked += 1
+                curr_median = np.median(test_preds_by_bag[:, :num_bags_checked, :], axis=1)
+                if prev_median is not None and \
+                        np.max(np.abs(curr_median - prev_median)) < model_config.adaptive_bags_tol:
+                    num_stable += 1
+                else:
+                    num_stable = 0
+                prev_median = curr_median
+                
+                if num_bags_checked >= model_config.adaptive_bags_min and \
+                        num_stable >= model_config.adaptive_bags_patience:
+                    num_bags_used = num_bags_checked
+                    break
             
-            # test set predictions
-            test_preds_by_bag[:, b, q_ind] = model.predict(X=x_test)
+            if num_bags_used < model_config.num_bags:
+                # stop: bags that have not started are cancelled, and results
+                # of bags still running are not used
+                for f in futures:
+                    f.cancel()
+                break
     
-    # combine and save feature importance scores
-    if run_config.save_feat_importance:
-        feat_importance = pd.concat(feat_importance, axis=0)
-        save_path = _build_save_path(
-            root=run_config.artifact_store_root,
-            run_config=run_config,
-            model_config=model_config,
-            subdir='feat_importance')
-        feat_importance.to_csv(save_path, index=False)
+    test_preds_by_bag = test_preds_by_bag[:, :num_bags_used, :]
+    
+    if feat_importance is not None:
+        feat_importance = feat_importance.to_frame(num_bags_used)
+    
+    seasons = {'train': train_seasons.tolist(), 'bags': bag_seasons}
+    
+    return _combine_bag_predictions(model_config, run_config, test_preds_by_bag), \
+        num_bags_used, feat_importance, seasons
+
+
+def _get_stored_test_quantile_predictions(model_config, run_config, x_test,
+                                          model_dir, location, num_bags):
+    '''
+    Obtain quantile predictions from the `num_bags` bags of models stored by
+    an earlier run. Other arguments are as for `_get_test_quantile_predictions`,
+    and return values are the first three of its return values.
+    '''
+    fit_q_levels = _get_fit_q_levels(model_config, run_config)
+    test_preds_by_bag = np.empty((x_test.shape[0], num_bags, len(fit_q_levels)))
+    
+    joint_q_levels = None
+    if model_config.quantile_fit == 'joint':
+        joint_q_levels = fit_q_levels
+    
+    n_jobs = get_n_jobs(_num_concurrent_fits(model_config, run_config),
+                        run_config.num_threads)
+    with ThreadPoolExecutor(max_workers=run_config.num_workers) as executor:
+        futures = {
+            executor.submit(predict_bag,
+                            _get_model_paths(model_config, run_config, model_dir, b, location),
+                            x_test, n_jobs, joint_q_levels): b \
+            for b in range(num_bags)
+        }
+        for future in tqdm(as_completed(futures), 'Bag number',
+                           total=num_bags):
+            test_preds_by_bag[:, futures[future], :] = future.result()
+    
+    return _combine_bag_predictions(model_config, run_config, test_preds_by_bag), \
+        num_bags, None
+
+
+def _num_concurrent_fits(model_config, run_config):
+    # bags are fit in parallel within each location fit in parallel
+    if model_config.fit_locations_separately:
+        return run_config.num_workers * run_config.location_workers
+    
+    return run_config.num_workers
+
+
+def _fit_bag(model_config, run_config, x_train, y_train, bag_obs_inds, seeds,
+             x_test, n_jobs, model_paths, init_model_paths, num_boost_round):
+    '''
+    Fit the models for one bag: one model per quantile level, or a single
+    model for all quantile levels if `model_config.quantile_fit` is 'joint'.
+    Return values are as for `train.fit_bag`.
+    '''
+    fit_q_levels = _get_fit_q_levels(model_config, run_config)
+    if model_config.quantile_fit == 'separate':
+        return fit_bag(x_train, y_train, bag_obs_inds, fit_q_levels,
+                       seeds, x_test, n_jobs, model_paths, init_model_paths,
+                       num_boost_round, shared_bins=model_config.shared_bins)
+    elif model_config.quantile_fit == 'joint':
+        return fit_joint_bag(
+            x_train, y_train, bag_obs_inds, fit_q_levels, seeds[0], x_test,
+            q_levels_per_row=model_config.joint_q_levels_per_row,
+            num_boost_round=num_boost_round,
+            n_jobs=n_jobs,
+            model_path=None if model_paths is None else model_paths[0],
+            init_model_path=None if init_model_paths is None else init_model_paths[0])
+    else:
+        raise ValueError('unsupported quantile_fit: must be "separate" or "joint"')
+
+
+def _get_fit_q_levels(model_config, run_config):
+    # quantile levels at which models are fit: the anchor levels that are
+    # needed to interpolate the levels at which predictions are made, or those
+    # levels themselves if anchors are not set or there are no more of them
+    # than there are anchors, as in short runs
+    if model_config.anchor_q_levels is None:
+        return run_config.q_levels
+    
+    # the anchors bracketing the requested levels; the outermost two are kept
+    # for levels beyond them, which are extrapolated
+    anchor_q_levels = sorted(model_config.anchor_q_levels)
+    num_anchors = len(anchor_q_levels)
+    lower = bisect.bisect_right(anchor_q_levels, min(run_config.q_levels)) - 1
+    lower = min(max(lower, 0), num_anchors - 2)
+    upper = bisect.bisect_left(anchor_q_levels, max(run_config.q_levels))
+    upper = max(min(upper, num_anchors - 1), lower + 1)
+    anchor_q_levels = anchor_q_levels[lower:upper + 1]
+    if len(run_config.q_levels) <= len(anchor_q_levels):
+        return run_config.q_levels
+    
+    return anchor_q_levels
+
+
+def _interpolate_quantiles(preds, anchor_q_levels, q_levels):
+    '''
+    Interpolate quantile predictions at anchor levels to other quantile
+    levels. The predictions for each instance are sorted, then interpolated
+    linearly on the scale of standard normal quantiles, and extrapolated
+    beyond the outermost anchor levels along the outermost segments. The
+    results are nondecreasing in the quantile level.
+    
+    Parameters
+    ----------
+    preds: numpy array with one row per instance and one column per anchor
+        level
+    anchor_q_levels: sorted list of at least two quantile levels
+    q_levels: list of quantile levels at which to predict
+    
+    Returns
+    -------
+    numpy array with one row per instance and one column per entry of `q_levels`
+    '''
+    z_anchor = np.array([NormalDist().inv_cdf(q) for q in anchor_q_levels])
+    z = np.array([NormalDist().inv_cdf(q) for q in q_levels])
+    preds = np.sort(preds, axis=1)
+    
+    # segment of the anchor levels for each level, and position within it
+    j = np.clip(np.searchsorted(z_anchor, z) - 1, 0, len(z_anchor) - 2)
+    w = (z - z_anchor[j]) / (z_anchor[j + 1] - z_anchor[j])
     
+    return preds[:, j] + w * (preds[:, j + 1] - preds[:, j])
+
+
+def _get_init_model_paths(model_config, run_config, init_model_dir, b, location):
+    # paths of the stored boosters to warm start one bag from, or None if
+    # there are none
+    init_model_paths = _get_model_paths(model_config, run_config, init_model_dir, b, location)
+    if init_model_paths is None or not init_model_paths[0].exists():
+        return None
+    
+    return init_model_paths
+
+
+def _get_num_boost_round(model_config, init_model_paths):
+    # number of boosting rounds for the fits in a bag, or None for the
+    # LightGBM default; warm started fits add a few rounds to the stored models
+    if init_model_paths is not None:
+        return model_config.warm_start_num_boost_round
+    elif model_config.quantile_fit == 'joint':
+        return model_config.joint_num_boost_round
+    
+    return None
+
+
+def _get_model_paths(model_config, run_config, model_dir, b, location):
+    # paths of the stored boosters for one bag, or None if models are not
+    # stored; joint fits have a single booster per bag
+    if model_dir is None:
+        return None
+    
+    if model_config.quantile_fit == 'joint':
+        num_models = 1
+    else:
+        num_models = len(_get_fit_q_levels(model_config, run_config))
+    return [model_store.booster_path(model_dir, b, q_ind, location) \
+            for q_ind in range(num_models)]
+
+
+def _combine_bag_predictions(model_config, run_config, test_preds_by_bag):
     # combined predictions across bags: median
     test_pred_qs = np.median(test_preds_by_bag, axis=1)
     
-    # test predictions as a data frame, one column per quantile level
-    test_pred_qs_df = pd.DataFrame(test_pred_qs)
-    test_pred_qs_df.columns = run_config.q_labels
+    # predictions at the levels in run_config from those at anchor levels
+    fit_q_levels = _get_fit_q_levels(model_config, run_config)
+    if fit_q_levels != run_config.q_levels:
+        test_pred_qs = _interpolate_quantiles(test_pred_qs, fit_q_levels,
+                                              run_config.q_levels)
     
-    return test_pred_qs_df
+    return test_pred_qs
 
 
-def _format_as_flusight_output(preds_df, ref_date):
-    # keep just required columns and rename to match hub format
-    preds_df = preds_df[['location', 'wk_end_date', 'horizon', 'quantile', 'value']] \
-        .rename(columns={'quantile': 'output_type_id'})
+def _build_hub_output(model_config, run_config, df_test, test_pred_qs):
+    '''
+    Convert test set predictions of changes in transformed incidence into
+    predictions of incidence in FluSight hub format. All steps before the
+    construction of the returned data frame operate on numpy arrays with one
+    row per test instance, i.e. per combination of location and horizon, and
+    one column per quantile level.
     
-    preds_df['target_end_date'] = preds_df['wk_end_date'] + pd.to_timedelta(7*preds_df['horizon'], unit='days')
-    preds_df['reference_date'] = ref_date
-    preds_df['horizon'] = preds_df['horizon'] - 2
-    preds_df['target'] = 'wk inc flu hosp'
+    Parameters
+    ----------
+    model_config: configuration object with settings for the model
+    run_config: configuration object with settings for the run
+    df_test: data frame with test data
+    test_pred_qs: numpy array with test set predictions, with one row per row
+        of `df_test` and one column per quantile level in `run_config.q_levels`
+    
+    Returns
+    -------
+    Pandas data frame with predictions for the nhsn data source in FluSight
+    hub format, guaranteed not to have quantile crossing
+    '''
+    # keep only the rows for the nhsn data source
+    is_nhsn = (df_test['source'] == 'nhsn').to_numpy()
+    df_test = df_test.loc[is_nhsn]
+    test_pred_qs = test_pred_qs[is_nhsn]
     
-    preds_df['output_type'] = 'quantile'
-    preds_df.drop(columns='wk_end_date', inplace=True)
+    value = _invert_transforms(model_config, df_test, test_pred_qs)
+    
+    # sort quantiles to avoid quantile crossing
+    value = _quantile_noncrossing(value)
+    
+    # hub format, with all rows for the first quantile level followed by all
+    # rows for the next one
+    num_q_levels = len(run_config.q_levels)
+    horizon = df_test['horizon'].to_numpy()
+    target_end_date = df_test['wk_end_date'].to_numpy() + \
+        (7 * horizon).astype('timedelta64[D]')
+    preds_df = pd.DataFrame({
+        'location': np.tile(df_test['location'].to_numpy(), num_q_levels),
+        'reference_date': run_config.ref_date,
+        'horizon': np.tile(horizon - 2, num_q_levels),
+        'target_end_date': np.tile(target_end_date, num_q_levels),
+        'target': 'wk inc flu hosp',
+        'output_type': 'quantile',
+        'output_type_id': np.repeat(run_config.q_labels, len(df_test)),
+        'value': value.T.reshape(-1)
+    })
     
     return preds_df
 
 
-def _quantile_noncrossing(preds_df, gcols):
+def _invert_transforms(model_config, df_test, test_pred_qs):
+    '''
+    Invert the centering, scaling and power transforms of the target variable
+    to get predictions of incidence.
+    
+    Parameters
+    ----------
+    model_config: configuration object with settings for the model
+    df_test: data frame with test data
+    test_pred_qs: numpy array with predicted changes in transformed incidence,
+        with one row per row of `df_test`
+    
+    Returns
+    -------
+    numpy array of the same shape as `test_pred_qs` with predicted incidence
+    '''
+    if model_config.power_transform == '4rt':
+        inv_power = 4
+    elif model_config.power_transform is None:
+        inv_power = 1
+    else:
+        raise ValueError('unsupported power_transform: must be "4rt" or None')
+    
+    # column vectors, broadcast across quantile levels
+    inc_trans_cs, center_factor, scale_factor, pop = [
+        df_test[c].to_numpy(dtype=float)[:, np.newaxis] \
+        for c in ['inc_trans_cs', 'inc_trans_center_factor',
+                  'inc_trans_scale_factor', 'pop']
+    ]
+    
+    inc_trans_cs_target_hat = inc_trans_cs + test_pred_qs
+    inc_trans_target_hat = (inc_trans_cs_target_hat + center_factor) * (scale_factor + 0.01)
+    value = (np.maximum(inc_trans_target_hat, 0.0) ** inv_power - 0.01 - 0.75**4) * pop / 100000
+    
+    return np.maximum(value, 0.0)
+
+
+def _quantile_noncrossing(preds):
     '''
     Sort predictions to be in alignment with quantile levels, to prevent
     quantile crossing.
     
     Parameters
     ----------
-    preds_df: data frame with quantile predictions
-    gcols: columns to group by; predictions will be sorted within those groups
+    preds: numpy array with quantile predictions, with one row per test
+        instance and one column per quantile level, in increasing order
     
     Returns
     -------
-    Sorted version of preds_df, guaranteed not to have quantile crossing
+    Sorted version of preds, guaranteed not to have quantile crossing
     '''
-    g = preds_df.set_index(gcols).groupby(gcols)
-    preds_df = g[['output_type_id', 'value']] \
-        .transform(lambda x: x.sort_values()) \
-        .reset_index()
-    
-    return preds_df
+    return np.sort(preds, axis=1)
 
 
-def _build_save_path(root, run_config, model_config, subdir=None):
+def _build_save_path(root, run_config, model_config, subdir=None, suffix='.csv'):
     save_dir = root / f'UMass-{model_config.model_name}'
     if subdir is not None:
         save_dir = save_dir / subdir
     save_dir.mkdir(parents=True, exist_ok=True)
-    return save_dir / f'{str(run_config.ref_date)}-UMass-{model_config.model_name}.csv'
+    return save_dir / f'{str(run_config.ref_date)}-UMass-{model_config.model_name}{suffix}'
+
+
+def _build_model_dir(root, model_config, ref_date):
+    return root / f'UMass-{model_config.model_name}' / 'models' / \
+        f'{str(ref_date)}-UMass-{model_config.model_name}'
@@ -0,0 +1,180 @@
+import gc
+import uuid
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+# offsets of the columns in a shared memory block are multiples of this many
+# bytes, so that every column is aligned for its dtype
+ALIGNMENT = 64
+
+
+class SharedFrame():
+    '''
+    A data frame copied once into a shared memory block, for use by other
+    processes without copying it to each process.
+    
+    Numeric, boolean and datetime columns and the index are stored as NumPy
+    buffers in the block, and are used in place by processes that attach to
+    it. Categorical columns are stored as their codes, with their categories
+    in the frame's `spec`, and their codes are used in place too. Columns of
+    strings or other Python objects are shared as categorical columns, so
+    that attached processes do not each build an array of Python objects with
+    one entry per row; they compare, select and group as the original columns
+    do, but have a categorical dtype.
+    
+    The process that creates a `SharedFrame` owns the block, which is removed
+    by `close`, or on leaving a `with` block.
+    '''
+    def __init__(self, df):
+        '''
+        Parameters
+        ----------
+        df: Pandas data frame to share. It is not modified, and can be deleted
+            once the `SharedFrame` is created.
+        '''
+        index, columns = _encode(df)
+        entries = [('index', index[1])] + \
+            [(f'column {i}', values) for i, (_, values) in enumerate(columns)]
+        offsets = list()
+        size = 0
+        for _, values in entries:
+            offsets.append(size)
+            size += -(-values.nbytes // ALIGNMENT) * ALIGNMENT
+        
+        self._shm = shared_memory.SharedMemory(
+            name=f'gbq_{uuid.uuid4().hex[:16]}', create=True, size=max(size, 1))
+        for (_, values), offset in zip(entries, offsets):
+            np.ndarray(values.shape, dtype=values.dtype, buffer=self._shm.buf,
+                       offset=offset)[:] = values
+        
+        self.spec = {
+            'shm_name': self._shm.name,
+            'num_rows': len(df),
+            'index': dict(index[0], offset=offsets[0], dtype=index[1].dtype.str),
+            'columns': [
+                dict(col_spec, offset=offset, dtype=values.dtype.str) \
+                for (col_spec, values), offset in zip(columns, offsets[1:])
+            ]
+        }
+    
+    
+    def close(self):
+        '''
+        Remove the shared memory block. Processes that are attached to the
+        block keep their mapping of it until they close it.
+        '''
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, *args):
+        self.close()
+
+
+class AttachedFrame():
+    '''
+    A data frame backed by the shared memory block of a `SharedFrame`, which
+    is created by another process. The arrays of the data frame are read-only.
+    '''
+    def __init__(self, spec):
+        '''
+        Parameters
+        ----------
+        spec: the `spec` of a `SharedFrame`
+        '''
+        self._shm = shared_memory.SharedMemory(name=spec['shm_name'])
+        num_rows = spec['num_rows']
+        
+        index = _from_buffer(self._shm, spec['index'], num_rows)
+        columns = {
+            col_spec['name']: _decode(_from_buffer(self._shm, col_spec, num_rows), col_spec) \
+            for col_spec in spec['columns']
+        }
+        # with copy=False, the columns are not consolidated into 2d blocks, so
+        # that the arrays in shared memory are used in place
+        self.df = pd.DataFrame(columns,
+                               index=pd.Index(index, name=spec['index']['name'], copy=False),
+                               copy=False)
+    
+    
+    def close(self):
+        '''
+        Release the data frame and unmap the shared memory block. The data
+        frame, and any views of it, must not be used afterwards.
+        '''
+        if self._shm is not None:
+            self.df = None
+            # data frames can be kept alive by reference cycles, which hold
+            # views of the shared memory
+            gc.collect()
+            self._shm.close()
+            self._shm = None
+    
+    
+    def __enter__(self):
+        return self
+    
+    
+    def __exit__(self, *args):
+        self.close()
+
+
+def _encode(df):
+    # (spec, array) pairs for the index and each column of df
+    if df.columns.duplicated().any():
+        raise ValueError('column names of a shared frame must be unique')
+    
+    index = df.index
+    if isinstance(index, pd.MultiIndex) or index.dtype == object:
+        raise ValueError('the index of a shared frame must be a numeric index')
+    
+    columns = list()
+    for name in df.columns:
+        col = df[name]
+        col_spec = {'name': name}
+        if col.dtype == object:
+            col = col.astype('category')
+        
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # the codes have the smallest integer dtype that pandas uses for
+            # the number of categories, so they are used in place by
+            # `pd.Categorical.from_codes`
+            col_spec.update(kind='category',
+                            categories=col.cat.categories.tolist(),
+                            ordered=col.cat.ordered)
+            values = col.cat.codes.to_numpy()
+        elif isinstance(col.dtype, np.dtype) and col.dtype.kind in 'biufM':
+            col_spec.update(kind='array')
+            values = col.to_numpy()
+        else:
+            raise ValueError(f'column {name} has dtype {col.dtype}, which '
+                             'cannot be shared')
+        
+        columns.append((col_spec, np.ascontiguousarray(values)))
+    
+    return ({'name': index.name}, np.ascontiguousarray(index.to_numpy())), columns
+
+
+def _from_buffer(shm, spec, num_rows):
+    values = np.ndarray((num_rows,), dtype=np.dtype(spec['dtype']),
+                        buffer=shm.buf, offset=spec['offset'])
+    values.flags.writeable = False
+    return values
+
+
+def _decode(values, col_spec):
+    if col_spec['kind'] == 'category':
+        return pd.Categorical.from_codes(
+            values,
+            dtype=pd.CategoricalDtype(col_spec['categories'], col_spec['ordered']))
+    
+    return values
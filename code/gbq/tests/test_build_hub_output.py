@@ -0,0 +1,41 @@
+import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from run import _build_hub_output
+
+
+def test_build_hub_output_format_and_noncrossing():
+    model_config = SimpleNamespace(power_transform=None)
+    run_config = SimpleNamespace(ref_date=datetime.date(2024, 3, 30),
+                                 q_levels=[0.1, 0.5, 0.9],
+                                 q_labels=['0.1', '0.5', '0.9'])
+    df_test = pd.DataFrame({
+        'source': ['nhsn', 'nhsn', 'ilinet'],
+        'location': ['01', '01', '01'],
+        'wk_end_date': pd.to_datetime(['2024-03-23'] * 3),
+        'horizon': [2, 3, 2],
+        'pop': [1e5, 1e5, 1e5],
+        'inc_trans_cs': [0.0, 0.0, 0.0],
+        'inc_trans_center_factor': [0.0, 0.0, 0.0],
+        'inc_trans_scale_factor': [0.99, 0.99, 0.99]
+    })
+    # the second row has crossing quantiles
+    test_pred_qs = np.array([[1.0, 2.0, 3.0],
+                             [3.0, 2.0, 1.0],
+                             [5.0, 6.0, 7.0]])
+    
+    preds_df = _build_hub_output(model_config, run_config, df_test, test_pred_qs)
+    
+    assert list(preds_df.columns) == ['location', 'reference_date', 'horizon',
+                                      'target_end_date', 'target', 'output_type',
+                                      'output_type_id', 'value']
+    assert preds_df.shape[0] == 6
+    assert preds_df['horizon'].tolist() == [0, 1] * 3
+    assert preds_df['target_end_date'].tolist() == \
+        list(pd.to_datetime(['2024-04-06', '2024-04-13'] * 3))
+    assert preds_df['output_type_id'].tolist() == ['0.1'] * 2 + ['0.5'] * 2 + ['0.9'] * 2
+    expected = np.array([[1.0, 2.0, 3.0], [1.0, 2.0, 3.0]]) - 0.01 - 0.75**4
+    assert np.allclose(preds_df['value'], expected.T.reshape(-1))
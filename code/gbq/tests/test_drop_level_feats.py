@@ -54,3 +54,18 @@ def test_drop_level_feats():
     
     assert len(actual) == len(expected)
     assert not set(actual) - set(expected)
+
+
+def test_drop_level_feats_native_categorical():
+    # with native categorical encoding, source, agg_level, and location are
+    # single features that are not measures of level
+    in_feats = ['inc_trans_cs', 'season_week', 'log_pop', 'source_cat',
+                'agg_level_cat', 'location_cat', 'delta_xmas',
+                'inc_trans_cs_taylor_d2_c0_w4t_sNone', 'inc_trans_cs_taylor_d2_c1_w4t_sNone',
+                'inc_trans_cs_rollmean_w2', 'inc_trans_cs_lag1',
+                'inc_trans_cs_taylor_d2_c1_w4t_sNone_lag1', 'horizon']
+    expected = ['season_week', 'log_pop', 'source_cat', 'agg_level_cat',
+                'location_cat', 'delta_xmas', 'inc_trans_cs_taylor_d2_c1_w4t_sNone',
+                'inc_trans_cs_taylor_d2_c1_w4t_sNone_lag1', 'horizon']
+    
+    assert _drop_level_feats(in_feats) == expected
@@ -0,0 +1,36 @@
+import datetime
+
+import numpy as np
+
+from feat_importance import FeatImportanceCollector, load_feat_importance, \
+    save_feat_importance, summarize_feat_importance
+
+
+def test_collector_to_frame_and_summary(tmp_path):
+    collector = FeatImportanceCollector(['a', 'b'], num_bags=3, q_levels=[0.1, 0.9])
+    for b in range(3):
+        # split counts in the first row, gains in the second
+        collector.add(b, np.array([[[1, 2], [3.0, 1.0]],
+                                   [[4, 5], [1.0, 1.0]]]))
+    
+    # only the first two bags were used
+    df = collector.to_frame(num_bags=2)
+    assert df.shape[0] == 2 * 2 * 2
+    assert df['b'].tolist() == [0, 0, 0, 0, 1, 1, 1, 1]
+    assert df['q_level'].tolist() == [0.1, 0.1, 0.9, 0.9] * 2
+    assert df['feat'].tolist() == ['a', 'b'] * 4
+    assert df['split'].tolist() == [1, 2, 4, 5] * 2
+    assert df['gain'].tolist() == [3.0, 1.0, 1.0, 1.0] * 2
+    
+    save_dir = tmp_path / 'UMass-gbq_qr' / 'feat_importance'
+    save_dir.mkdir(parents=True)
+    save_feat_importance(df, save_dir / '2024-01-06-UMass-gbq_qr.parquet')
+    save_feat_importance(df, save_dir / '2024-01-13-UMass-gbq_qr.csv')
+    
+    loaded = load_feat_importance(tmp_path, 'gbq_qr')
+    assert loaded.shape[0] == 2 * df.shape[0]
+    assert set(loaded['ref_date']) == {datetime.date(2024, 1, 6), datetime.date(2024, 1, 13)}
+    
+    summary = summarize_feat_importance(loaded)
+    assert summary['feat'].tolist() == ['a', 'b']
+    assert np.allclose(summary['gain_share'], [0.625, 0.375])
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+import feature_cache
+
+
+def _make_df(n=100):
+    return pd.DataFrame({
+        'location': np.repeat(['01', 'US'], n // 2),
+        'wk_end_date': pd.date_range('2023-10-07', periods=n, freq='7D'),
+        'inc_trans_cs': np.linspace(-1, 1, n),
+        'location_01': np.repeat([1, 0], n // 2).astype('uint8')
+    })
+
+
+def test_cache_round_trip(tmp_path):
+    df = _make_df()
+    key = feature_cache.get_cache_key(df, settings={'max_horizon': 5})
+    assert feature_cache.load(tmp_path, key) is None
+    
+    feature_cache.save(tmp_path, key, df, ['inc_trans_cs', 'location_01'], max_bytes=2**30)
+    cached_df, cached_feat_names = feature_cache.load(tmp_path, key)
+    
+    assert cached_df.equals(df)
+    assert cached_feat_names == ['inc_trans_cs', 'location_01']
+
+
+def test_cache_key_depends_on_data_and_settings():
+    df = _make_df()
+    key = feature_cache.get_cache_key(df, settings={'max_horizon': 5})
+    
+    assert key == feature_cache.get_cache_key(df.copy(), settings={'max_horizon': 5})
+    assert key != feature_cache.get_cache_key(df, settings={'max_horizon': 4})
+    
+    df_revised = df.copy()
+    df_revised.loc[10, 'inc_trans_cs'] += 0.1
+    assert key != feature_cache.get_cache_key(df_revised, settings={'max_horizon': 5})
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    keys = [feature_cache.get_cache_key(_make_df(), settings=i) for i in range(3)]
+    feature_cache.save(tmp_path, keys[0], _make_df(), [], max_bytes=2**30)
+    entry_bytes = sum(f.stat().st_size for f in tmp_path.iterdir())
+    feature_cache.save(tmp_path, keys[1], _make_df(), [], max_bytes=2**30)
+    
+    # adding a third entry with room for two evicts the oldest one
+    feature_cache.save(tmp_path, keys[2], _make_df(), [], max_bytes=2 * entry_bytes)
+    assert feature_cache.load(tmp_path, keys[0]) is None
+    assert feature_cache.load(tmp_path, keys[1]) is not None
+    assert feature_cache.load(tmp_path, keys[2]) is not None
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from run import _get_fit_q_levels, _interpolate_quantiles
+
+
+def test_interpolate_quantiles_exact_at_anchors_and_monotone():
+    anchor_q_levels = [0.025, 0.1, 0.25, 0.5, 0.75, 0.9, 0.975]
+    q_levels = [0.01, 0.025, 0.05, 0.10, 0.15, 0.20, 0.25, 0.30,
+                0.35, 0.40, 0.45, 0.50, 0.55, 0.60, 0.65, 0.70,
+                0.75, 0.80, 0.85, 0.90, 0.95, 0.975, 0.99]
+    rng = np.random.default_rng(0)
+    preds = np.sort(rng.normal(size=(50, len(anchor_q_levels))), axis=1)
+    
+    result = _interpolate_quantiles(preds, anchor_q_levels, q_levels)
+    
+    assert result.shape == (50, len(q_levels))
+    assert np.allclose(result[:, [q_levels.index(q) for q in anchor_q_levels]], preds)
+    assert np.all(np.diff(result, axis=1) >= 0)
+    
+    # tails are extrapolated beyond the outermost anchors
+    assert np.all(result[:, 0] <= preds[:, 0])
+    assert np.all(result[:, -1] >= preds[:, -1])
+
+
+def test_interpolate_quantiles_sorts_crossing_anchors():
+    preds = np.array([[1.0, 0.0, 2.0]])
+    result = _interpolate_quantiles(preds, [0.1, 0.5, 0.9], [0.1, 0.3, 0.5, 0.7, 0.9])
+    
+    assert np.all(np.diff(result, axis=1) >= 0)
+
+
+def test_get_fit_q_levels_uses_needed_anchors():
+    model_config = SimpleNamespace(anchor_q_levels=[0.025, 0.1, 0.25, 0.5, 0.75, 0.9, 0.975])
+    
+    # short runs request no more levels than there are anchors
+    run_config = SimpleNamespace(q_levels=[0.025, 0.5, 0.975])
+    assert _get_fit_q_levels(model_config, run_config) == [0.025, 0.5, 0.975]
+    
+    # only the anchors bracketing the requested levels are fit
+    run_config = SimpleNamespace(q_levels=[0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7])
+    assert _get_fit_q_levels(model_config, run_config) == [0.25, 0.5, 0.75]
+    
+    # levels beyond the outermost anchors are extrapolated from them
+    run_config = SimpleNamespace(q_levels=[0.01, 0.025, 0.05, 0.10, 0.15, 0.20, 0.25, 0.30,
+                                           0.35, 0.40, 0.45, 0.50, 0.55, 0.60, 0.65, 0.70,
+                                           0.75, 0.80, 0.85, 0.90, 0.95, 0.975, 0.99])
+    assert _get_fit_q_levels(model_config, run_config) == model_config.anchor_q_levels
+    
+    model_config = SimpleNamespace(anchor_q_levels=None)
+    assert _get_fit_q_levels(model_config, run_config) == run_config.q_levels
@@ -0,0 +1,34 @@
+import lightgbm as lgb
+import numpy as np
+import pytest
+
+import model_store
+
+
+def _fit_booster():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(200, 3))
+    y = x[:, 0] + rng.normal(size=200)
+    params = {'objective': 'quantile', 'alpha': 0.9, 'verbosity': -1}
+    return lgb.train(params, lgb.Dataset(x, label=y), num_boost_round=10), x
+
+
+def test_booster_round_trip(tmp_path):
+    booster, x = _fit_booster()
+    path = model_store.booster_path(tmp_path, b=3, q_ind=1, location='US')
+    model_store.save_booster(path, booster)
+    
+    assert np.array_equal(model_store.load_booster(path).predict(x),
+                          booster.predict(x))
+
+
+def test_layout_marks_complete_runs(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        model_store.load_layout(tmp_path)
+    
+    model_store.save_layout(tmp_path, {'feat_names': ['inc_trans_cs'], 'num_bags': 2})
+    assert model_store.load_layout(tmp_path) == {'feat_names': ['inc_trans_cs'], 'num_bags': 2}
+    
+    model_store.invalidate(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        model_store.load_layout(tmp_path)
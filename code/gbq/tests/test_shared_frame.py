@@ -0,0 +1,51 @@
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from shared_frame import AttachedFrame, SharedFrame
+
+
+def _make_df():
+    return pd.DataFrame({
+        'source': ['nhsn', 'ilinet', 'nhsn', None],
+        'location': pd.Categorical(['US', '01', 'US', '01']),
+        'wk_end_date': pd.date_range('2024-01-06', periods=4, freq='7D'),
+        'season_week': np.arange(4),
+        'inc': [1.0, np.nan, 3.0, 4.0],
+        'source_nhsn': np.array([1, 0, 1, 0], dtype=np.uint8)
+    }, index=pd.Index([10, 11, 13, 14], name='row'))
+
+
+def _attached_summary(spec):
+    with AttachedFrame(spec) as frame:
+        return frame.df.groupby('location', observed=True)['inc'].sum().to_dict()
+
+
+def test_shared_frame_round_trip():
+    df = _make_df()
+    with SharedFrame(df) as shared_df:
+        with AttachedFrame(shared_df.spec) as frame:
+            # columns of strings are shared as categorical columns
+            pd.testing.assert_frame_equal(frame.df, df.astype({'source': 'category'}))
+            
+            # numeric columns are used in place, and can't be modified
+            inc = frame.df['inc'].to_numpy()
+            assert np.shares_memory(inc, np.asarray(frame._shm.buf))
+            with pytest.raises(ValueError):
+                inc[0] = 0.0
+            
+            # as are the codes of categorical columns
+            for c in ['source', 'location']:
+                assert np.shares_memory(frame.df[c].cat.codes.to_numpy(),
+                                        np.asarray(frame._shm.buf))
+
+
+def test_shared_frame_attached_in_other_process():
+    df = _make_df()
+    with SharedFrame(df) as shared_df:
+        with Pool(processes=2) as pool:
+            summaries = pool.map(_attached_summary, [shared_df.spec] * 2)
+    
+    assert summaries == [{'01': 4.0, 'US': 4.0}] * 2
@@ -0,0 +1,81 @@
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+import train
+from train import StackedMatrix, to_float_array
+
+
+def test_stacked_matrix_rows_match_stacked_frame():
+    rng = np.random.default_rng(0)
+    base = pd.DataFrame({
+        'source': np.repeat(['nhsn', 'ilinet'], 6),
+        'location': np.tile(np.repeat(['01', 'US'], 3), 2),
+        'wk_end_date': np.tile(pd.date_range('2024-01-06', periods=3, freq='7D'), 4),
+        'location_cat': pd.Categorical(np.tile(np.repeat(['01', None], 3), 2)),
+        'x': rng.normal(size=12)
+    })
+    df = base.loc[np.repeat(np.arange(12), 3)].reset_index(drop=True)
+    df['horizon'] = np.tile([1, 2, 3], 12)
+    # rows are not in stacked order
+    df = df.sample(frac=1.0, random_state=1)
+    feat_names = ['location_cat', 'horizon', 'x']
+    
+    x = StackedMatrix(df, feat_names)
+    
+    assert x.shape == (36, 3)
+    assert x.categorical_feature == [0]
+    assert x._base.shape == (12, 2)
+    row_inds = np.array([0, 5, 5, 35, 17])
+    np.testing.assert_array_equal(x.rows(row_inds),
+                                  to_float_array(df.iloc[row_inds], feat_names))
+    
+    # a subset of the rows, read from df in place
+    row_inds = np.array([35, 2, 17, 3])
+    x = StackedMatrix(df, feat_names, row_inds=row_inds)
+    
+    assert x.shape == (4, 3)
+    np.testing.assert_array_equal(x.rows(np.arange(4)),
+                                  to_float_array(df.iloc[row_inds], feat_names))
+
+
+def test_fit_bag_matches_separate_fits_for_large_bags(monkeypatch):
+    # bags with more rows than subsample_for_bin are binned from a sample of
+    # rows drawn with the seed of each fit; the threshold is lowered here so
+    # that the test data are small
+    subsample_for_bin = 500
+    get_lgb_params = train.get_lgb_params
+    
+    def get_small_bin_params(*args, **kwargs):
+        params, num_boost_round = get_lgb_params(*args, **kwargs)
+        params['subsample_for_bin'] = subsample_for_bin
+        return params, num_boost_round
+    
+    monkeypatch.setattr(train, 'get_lgb_params', get_small_bin_params)
+    
+    rng = np.random.default_rng(0)
+    base = pd.DataFrame(rng.normal(size=(400, 3)), columns=['a', 'b', 'c'])
+    base['source'] = 'nhsn'
+    base['location'] = np.arange(400) % 10
+    base['wk_end_date'] = np.arange(400) // 10
+    df = base.loc[np.repeat(np.arange(400), 3)].reset_index(drop=True)
+    df['horizon'] = np.tile([1, 2, 3], 400)
+    feat_names = ['a', 'b', 'c', 'horizon']
+    x_train = StackedMatrix(df, feat_names)
+    y_train = df['a'].to_numpy() + rng.normal(size=len(df))
+    bag_obs_inds = rng.random(len(df)) < 0.7
+    assert train.is_large_bag(bag_obs_inds)
+    x_test = x_train.rows(np.arange(50))
+    q_levels = [0.1, 0.5, 0.9]
+    seeds = [11, 22, 33]
+    
+    test_preds, _ = train.fit_bag(x_train, y_train, bag_obs_inds, q_levels, seeds, x_test)
+    
+    for q_ind, q_level in enumerate(q_levels):
+        model = lgb.LGBMRegressor(verbosity=-1, objective='quantile', alpha=q_level,
+                                  random_state=seeds[q_ind],
+                                  subsample_for_bin=subsample_for_bin)
+        model.fit(df.loc[bag_obs_inds, feat_names], y_train[bag_obs_inds])
+        np.testing.assert_array_equal(
+            test_preds[:, q_ind],
+            model.predict(pd.DataFrame(x_test, columns=feat_names)))
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+import preprocess
+from preprocess import create_features_and_targets, update_features_and_targets
+
+
+def _make_df():
+    # two sources and three locations with weekly data over three seasons
+    rng = np.random.default_rng(42)
+    dfs = []
+    for source, agg_level in [('nhsn', 'state'), ('ilinet', 'national')]:
+        for location in ['01', '02', 'US']:
+            wk_end_date = pd.date_range('2021-08-07', '2024-03-30', freq='7D')
+            season_start_year = np.where(wk_end_date.month >= 8, wk_end_date.year, wk_end_date.year - 1)
+            dfs.append(pd.DataFrame({
+                'source': source,
+                'agg_level': agg_level,
+                'location': location,
+                'season': [f'{y}/{str(y + 1)[2:]}' for y in season_start_year],
+                'season_week': (wk_end_date - pd.to_datetime([f'{y}-08-01' for y in season_start_year])).days // 7 + 1,
+                'wk_end_date': wk_end_date,
+                'log_pop': 1.0,
+                'inc_trans_cs': rng.normal(size=len(wk_end_date))
+            }))
+    
+    return pd.concat(dfs, axis=0).reset_index(drop=True)
+
+
+def test_update_features_and_targets_matches_full_recompute():
+    df = _make_df()
+    curr_feat_names = ['inc_trans_cs', 'season_week', 'log_pop']
+    
+    # previous week's data: without the last week, and with one value that
+    # is later revised
+    df_prev = df.loc[df['wk_end_date'] < df['wk_end_date'].max()].copy()
+    revised = (df_prev['source'] == 'nhsn') & (df_prev['location'] == '02') & \
+              (df_prev['wk_end_date'] == '2024-03-02')
+    df_prev.loc[revised, 'inc_trans_cs'] += 1.0
+    df_prev_feat, _ = create_features_and_targets(df_prev, True, 4, curr_feat_names)
+    
+    expected_df, expected_feat_names = create_features_and_targets(df, False, 4, curr_feat_names)
+    actual_df, actual_feat_names = update_features_and_targets(df, df_prev_feat, False, 4, curr_feat_names)
+    
+    assert actual_feat_names == expected_feat_names
+    pd.testing.assert_frame_equal(actual_df, expected_df)
+
+
+def test_update_features_and_targets_with_rescaled_history(monkeypatch):
+    # inc_trans_cs is centered and scaled by factors computed from the whole
+    # series of each source and location, so a new week of data changes it
+    # at all earlier dates
+    df_inc = _make_df().rename(columns={'inc_trans_cs': 'inc_trans'})
+    curr_feat_names = ['inc_trans_cs', 'season_week', 'log_pop']
+    
+    def center_and_scale(df):
+        grouped = df.groupby(['source', 'location'])['inc_trans']
+        df = df.assign(inc_trans_scale_factor=grouped.transform(lambda x: x.quantile(0.95)) - 0.01)
+        df['inc_trans_cs'] = df['inc_trans'] / (df['inc_trans_scale_factor'] + 0.01)
+        df['inc_trans_center_factor'] = df.groupby(['source', 'location'])['inc_trans_cs'] \
+            .transform('mean')
+        df['inc_trans_cs'] = df['inc_trans_cs'] - df['inc_trans_center_factor']
+        return df
+    
+    df_inc['inc_trans'] = df_inc['inc_trans'].abs() + 1.0
+    df_prev = center_and_scale(df_inc.loc[df_inc['wk_end_date'] < df_inc['wk_end_date'].max()])
+    df = center_and_scale(df_inc)
+    assert not np.allclose(df_prev['inc_trans_cs'], df.loc[df_prev.index, 'inc_trans_cs'])
+    df_prev_feat, _ = create_features_and_targets(df_prev, True, 4, curr_feat_names)
+    
+    # number of rows for which windowed features are computed
+    num_featurized = []
+    add_window_features = preprocess._add_window_features
+    def count_window_features(df):
+        num_featurized.append(len(df))
+        return add_window_features(df)
+    monkeypatch.setattr(preprocess, '_add_window_features', count_window_features)
+    
+    expected_df, expected_feat_names = create_features_and_targets(df, True, 4, curr_feat_names)
+    actual_df, actual_feat_names = update_features_and_targets(df, df_prev_feat, True, 4, curr_feat_names)
+    
+    assert actual_feat_names == expected_feat_names
+    pd.testing.assert_frame_equal(actual_df, expected_df, check_exact=False, rtol=1e-9)
+    # only the trailing rows of each series are featurized again
+    assert num_featurized[1] < num_featurized[0] / 10
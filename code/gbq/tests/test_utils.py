@@ -0,0 +1,31 @@
+import datetime
+
+from utils import build_configs
+
+
+def test_build_configs_short_run_does_not_modify_shared_config():
+    model_config, run_config = build_configs(
+        model_name='gbq_qr', ref_date=datetime.date(2024, 3, 30),
+        output_root=None, artifact_store_root=None, short_run=True)
+    assert model_config.num_bags == 10
+    assert run_config.q_levels == [0.025, 0.50, 0.975]
+    
+    # a later run in the same process gets the model-default settings
+    model_config, run_config = build_configs(
+        model_name='gbq_qr', ref_date=datetime.date(2024, 3, 30),
+        output_root=None, artifact_store_root=None)
+    assert model_config.num_bags == 100
+    assert len(run_config.q_levels) == 23
+
+
+def test_build_configs_short_run_scales_adaptive_bags_min():
+    model_config, _ = build_configs(
+        model_name='gbq_qr_adaptive_bags', ref_date=datetime.date(2024, 3, 30),
+        output_root=None, artifact_store_root=None, short_run=True)
+    assert model_config.num_bags == 10
+    assert model_config.adaptive_bags_min == 3
+    
+    model_config, _ = build_configs(
+        model_name='gbq_qr_adaptive_bags', ref_date=datetime.date(2024, 3, 30),
+        output_root=None, artifact_store_root=None)
+    assert model_config.adaptive_bags_min == 30
@@ -0,0 +1,73 @@
+import datetime
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import model_store
+from run import _build_model_dir, train_and_save
+from utils import build_configs
+
+
+def _make_df(n_weeks):
+    # featurized data for two locations, with a season of 52 weeks starting
+    # each October; the targets of the last week are missing
+    dates = pd.date_range('2018-10-06', periods=n_weeks, freq='7D')
+    rng = np.random.default_rng(0)
+    n_rows = 2 * n_weeks
+    df = pd.DataFrame({
+        'source': 'nhsn',
+        'agg_level': 'state',
+        'location': np.repeat(['01', 'US'], n_weeks),
+        'wk_end_date': np.tile(dates, 2),
+        'season': np.tile([f'{2018 + i // 52}/{19 + i // 52}' for i in range(n_weeks)], 2),
+        'season_week': np.tile(np.arange(n_weeks) % 52 + 1, 2),
+        'inc_trans_cs': rng.normal(size=n_rows),
+        'inc_trans_center_factor': 0.5,
+        'inc_trans_scale_factor': 1.0,
+        'pop': 1e6,
+        'horizon': 1,
+        'delta_target': rng.normal(size=n_rows)
+    })
+    df.loc[df['wk_end_date'] == dates[-1], 'delta_target'] = np.nan
+    
+    return df, ['inc_trans_cs', 'horizon'], dates[-1].date()
+
+
+def _run_week(tmp_path, n_weeks, **config):
+    df, feat_names, ref_date = _make_df(n_weeks)
+    model_config, run_config = build_configs(
+        model_name='gbq_qr', ref_date=ref_date,
+        output_root=tmp_path / 'model-output',
+        artifact_store_root=tmp_path / 'model-artifacts',
+        short_run=True, save_models=True, warm_start=True)
+    model_config.num_bags = 3
+    for k, v in config.items():
+        setattr(model_config, k, v)
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        train_and_save(model_config, run_config, df, feat_names)
+    
+    return model_store.load_layout(
+        _build_model_dir(tmp_path / 'model-artifacts', model_config, ref_date))
+
+
+def test_warm_started_bags_keep_their_seasons(tmp_path):
+    # the season 2023/24 starts in the third week of the chain
+    layouts = [_run_week(tmp_path, n_weeks) for n_weeks in [264, 265, 266]]
+    
+    assert [l['warm_start_weeks'] for l in layouts] == [0, 1, 2]
+    assert '2023/24' not in layouts[1]['seasons']['all']['train']
+    assert '2023/24' in layouts[2]['seasons']['all']['train']
+    assert layouts[1]['seasons']['all']['bags'] == layouts[0]['seasons']['all']['bags']
+    assert layouts[2]['seasons']['all']['bags'] == \
+        [b + ['2023/24'] for b in layouts[0]['seasons']['all']['bags']]
+
+
+def test_warm_start_chains_end_with_a_refit(tmp_path):
+    layouts = [_run_week(tmp_path, n_weeks, warm_start_max_weeks=1) \
+               for n_weeks in [260, 261, 262]]
+    
+    assert [l['warm_started'] for l in layouts] == [False, True, False]
+    assert [l['warm_start_weeks'] for l in layouts] == [0, 1, 0]
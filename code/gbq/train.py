@@ -0,0 +1,523 @@
+import numbers
+
+import numpy as np
+import pandas as pd
+
+import lightgbm as lgb
+from joblib import cpu_count
+
+import model_store
+from feat_importance import IMPORTANCE_TYPES
+
+
+def get_n_jobs(num_workers, num_threads=None):
+    '''
+    Number of LightGBM threads to use for each fit when `num_workers` fits are
+    run at the same time, so that the workers together use each available
+    core about once.
+    
+    Parameters
+    ----------
+    num_workers: integer number of fits running concurrently
+    num_threads: optional integer number of cores available to all of the
+        fits; by default, the number of physical cores
+    
+    Returns
+    -------
+    integer number of threads, or None to use the LightGBM default when
+    fits are run one at a time on all physical cores
+    '''
+    if num_threads is None:
+        if num_workers == 1:
+            return None
+        
+        num_threads = cpu_count(only_physical_cores=True)
+    
+    return max(num_threads // num_workers, 1)
+
+
+def get_lgb_params(q_level, seed, n_jobs=None):
+    '''
+    Parameters for one quantile regression fit, matching those used by
+    `lgb.LGBMRegressor(verbosity=-1, objective='quantile', alpha=q_level,
+    random_state=seed)`.
+
+    Parameters
+    ----------
+    q_level: float, quantile level
+    seed: integer random seed for the fit
+    n_jobs: number of LightGBM threads; None uses the number of physical cores
+
+    Returns
+    -------
+    Dictionary of parameters for `lgb.train`, and the number of boosting rounds
+    '''
+    model = lgb.LGBMRegressor(verbosity=-1, objective='quantile',
+                              alpha=q_level, random_state=seed)
+    params = model.get_params()
+    num_boost_round = params.pop('n_estimators')
+    for p in ['importance_type', 'class_weight', 'n_jobs']:
+        params.pop(p)
+
+    params['metric'] = 'quantile'
+    params['num_threads'] = cpu_count(only_physical_cores=True) if n_jobs is None else n_jobs
+
+    return params, num_boost_round
+
+
+class StackedMatrix():
+    '''
+    Compact representation of a horizon-stacked training feature matrix.
+    
+    After `create_features_and_targets`, each combination of source, location
+    and date is repeated once per forecast horizon, and all features other than
+    the horizon are the same in every copy. Here those features are stored
+    once per combination as a single contiguous float64 array, built column by
+    column from `df` without an intermediate copy of its rows, and each row of
+    the stacked matrix is an index into that array plus its horizon. Rows are
+    assembled in batches as LightGBM reads them, so the full stacked matrix is
+    never built in memory.
+    '''
+    def __init__(self, df, feat_names, key_cols=['source', 'location', 'wk_end_date'],
+                 stacked_col='horizon', row_inds=None):
+        '''
+        Parameters
+        ----------
+        df: Pandas data frame with one row per instance and stacked horizon
+        feat_names: list of names of columns with features, including
+            `stacked_col`
+        key_cols: list of names of columns that together with `stacked_col`
+            identify a row
+        stacked_col: name of the column that varies across stacked copies
+        row_inds: optional array of integer positions of the rows of `df` to
+            use, in order; by default, all rows. The rows are read from the
+            columns of `df` without copying `df`.
+        '''
+        if row_inds is None:
+            row_inds = np.arange(df.shape[0])
+        
+        self.feat_names = list(feat_names)
+        self.categorical_feature = [i for i, f in enumerate(self.feat_names) \
+                                    if isinstance(df[f].dtype, pd.CategoricalDtype)]
+        self.shape = (len(row_inds), len(self.feat_names))
+        
+        self._stacked_ind = self.feat_names.index(stacked_col)
+        self._base_inds = [i for i in range(len(self.feat_names)) if i != self._stacked_ind]
+        # the stacked values are small integers, and the base row indices
+        # are below the number of rows, so both are stored compactly
+        self._stacked_values = df[stacked_col].to_numpy()[row_inds].astype(np.float32)
+        
+        # index of the base row for each row, and base features from the first
+        # row for each combination of key values. Key columns are factorized
+        # one at a time, which needs less memory than grouping by all of them.
+        base_row = np.zeros(len(row_inds), dtype=np.int64)
+        for c in key_cols:
+            codes, uniques = pd.factorize(df[c].iloc[row_inds], use_na_sentinel=False)
+            base_row, _ = pd.factorize(base_row * len(uniques) + codes)
+        _, first_rows = np.unique(base_row, return_index=True)
+        self._base_row = base_row.astype(np.int32)
+        del base_row, codes
+        first_rows = row_inds[first_rows]
+        self._base = np.empty((len(first_rows), len(self._base_inds)))
+        for j, i in enumerate(self._base_inds):
+            self._base[:, j] = _float_values(df[self.feat_names[i]], first_rows)
+    
+    
+    def rows(self, row_inds):
+        '''
+        Rows of the stacked matrix as a 2d float64 array
+        
+        Parameters
+        ----------
+        row_inds: array of integer row positions
+        '''
+        x = np.empty((len(row_inds), self.shape[1]))
+        x[:, self._base_inds] = self._base[self._base_row[row_inds]]
+        x[:, self._stacked_ind] = self._stacked_values[row_inds]
+        return x
+    
+    
+    def sequence(self, row_inds, extra=None):
+        '''
+        lgb.Sequence giving LightGBM batched access to a subset of rows
+        
+        Parameters
+        ----------
+        row_inds: array of integer row positions; may contain repeats
+        extra: optional 2d array of additional columns appended to the rows,
+            with one row per entry of `row_inds`
+        '''
+        return _StackedSequence(self, row_inds, extra)
+
+
+class _StackedSequence(lgb.Sequence):
+    def __init__(self, matrix, row_inds, extra=None):
+        self.matrix = matrix
+        self.row_inds = row_inds
+        self.extra = extra
+    
+    
+    def __len__(self):
+        return len(self.row_inds)
+    
+    
+    def __getitem__(self, idx):
+        if isinstance(idx, numbers.Integral):
+            return self[[idx]][0]
+        
+        x = self.matrix.rows(self.row_inds[idx])
+        if self.extra is not None:
+            x = np.column_stack([x, self.extra[idx]])
+        
+        return x
+
+
+def to_float_array(df, feat_names):
+    '''
+    Features as a contiguous 2d float64 array, with categorical features
+    represented by their codes, as LightGBM does for Pandas data frames.
+    
+    Parameters
+    ----------
+    df: Pandas data frame
+    feat_names: list of names of columns with features
+    
+    Returns
+    -------
+    numpy array with one row per row of `df` and one column per feature
+    '''
+    x = np.empty((df.shape[0], len(feat_names)))
+    for j, f in enumerate(feat_names):
+        x[:, j] = _float_values(df[f])
+    
+    return x
+
+
+def _float_values(col, row_inds=None):
+    # values of a column, or of the rows of it at positions `row_inds`, as a
+    # float64 array, with categorical values represented by their codes
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        values = col.cat.codes.to_numpy()
+        if row_inds is not None:
+            values = values[row_inds]
+        values = values.astype(np.float64)
+        values[values == -1] = np.nan
+        return values
+    
+    values = col.to_numpy()
+    if row_inds is not None:
+        values = values[row_inds]
+    return values.astype(np.float64, copy=False)
+
+
+def make_bag_dataset(x_train, y_train, bag_obs_inds, seed, as_array=False,
+                     shared_bins=False):
+    '''
+    Build the LightGBM Dataset for one bag. The features are binned once when
+    the Dataset is constructed, and the binned Dataset can then be shared by
+    fits for several quantile levels in the bag.
+    
+    When a bag has more rows than `subsample_for_bin`, LightGBM bins a random
+    sample of the rows, which `lgb.LGBMRegressor` draws with a data seed
+    derived from the seed of the fit. By default, the Dataset of such a bag
+    is binned as for the fit with `seed`, and can only be used for that fit
+    (see `is_large_bag`). Smaller bags are binned from all of their rows, so
+    their Dataset can be used for the fits with any seed.
+    
+    Parameters
+    ----------
+    x_train: StackedMatrix with training instances in rows, features in columns
+    y_train: numpy array with target values
+    bag_obs_inds: boolean array indicating which rows of x_train are in the bag
+    seed: integer random seed of the fit the Dataset is built for
+    as_array: boolean; if True, the Dataset keeps the bag's rows as an array,
+        as needed to continue training from an init model
+    shared_bins: boolean; if True, a bag with more rows than
+        `subsample_for_bin` is binned from a sample of rows drawn with `seed`,
+        and its Dataset can be used for the fits with any seed. Their models
+        differ from those of separate `lgb.LGBMRegressor` fits.
+    
+    Returns
+    -------
+    lgb.Dataset for the bag
+    '''
+    params, _ = get_lgb_params(q_level=0.5, seed=seed)
+    if not is_large_bag(bag_obs_inds):
+        # the data seed only controls the sample of rows used for binning,
+        # which includes all rows here
+        params['data_random_seed'] = 0
+    elif shared_bins:
+        params['data_random_seed'] = seed
+    else:
+        # LightGBM samples the rows used for binning differently for Sequence
+        # inputs, so the rows are passed as an array to keep the bins of
+        # `lgb.LGBMRegressor`
+        as_array = True
+    
+    row_inds = np.flatnonzero(bag_obs_inds)
+    if as_array:
+        # continued training also needs an array, to compute the initial
+        # scores from the init model
+        data = x_train.rows(row_inds)
+    else:
+        # the raw data is only a view of x_train, so it is cheap to keep;
+        # lgb.train needs it to accept the categorical features set here
+        data = [x_train.sequence(row_inds)]
+    
+    train_set = lgb.Dataset(data,
+                            label=y_train[row_inds],
+                            feature_name=x_train.feat_names,
+                            categorical_feature=x_train.categorical_feature,
+                            params=params,
+                            free_raw_data=False)
+    train_set.construct()
+    
+    return train_set
+
+
+def is_large_bag(bag_obs_inds):
+    '''
+    Whether a bag has more rows than LightGBM's `subsample_for_bin`, so that
+    its bins depend on the seed of the fit unless `shared_bins` is set in
+    `make_bag_dataset`.
+    
+    Parameters
+    ----------
+    bag_obs_inds: boolean array indicating which rows are in the bag
+    '''
+    params, _ = get_lgb_params(q_level=0.5, seed=0)
+    return np.sum(bag_obs_inds) > params['subsample_for_bin']
+
+
+def fit_quantile_model(train_set, q_level, seed, n_jobs=None,
+                       init_model=None, num_boost_round=None):
+    '''
+    Fit a quantile regression model for one combination of bag and quantile
+    level.
+    
+    Parameters
+    ----------
+    train_set: lgb.Dataset for the bag from `make_bag_dataset`, built for
+        this fit's seed if the bins depend on it
+    q_level: float, quantile level
+    seed: integer random seed for the fit
+    n_jobs: number of LightGBM threads; None uses the number of physical cores
+    init_model: optional lgb.Booster to continue training from
+    num_boost_round: optional number of boosting rounds, overriding the
+        LightGBM default; with `init_model`, the number of rounds added
+    
+    Returns
+    -------
+    fitted lgb.Booster
+    '''
+    params, default_num_boost_round = get_lgb_params(q_level, seed, n_jobs)
+    if num_boost_round is None:
+        num_boost_round = default_num_boost_round
+    
+    # the data seed of a constructed Dataset cannot be changed
+    if 'data_random_seed' in train_set.params:
+        params['data_random_seed'] = train_set.params['data_random_seed']
+    
+    return lgb.train(params, train_set, num_boost_round=num_boost_round,
+                     init_model=init_model)
+
+
+def fit_bag(x_train, y_train, bag_obs_inds, q_levels, seeds, x_test, n_jobs=None,
+            model_paths=None, init_model_paths=None, num_boost_round=None,
+            shared_bins=False):
+    '''
+    Fit quantile regression models at all quantile levels for one bag, and
+    obtain test set predictions and feature importance scores.
+    
+    Parameters
+    ----------
+    x_train: StackedMatrix with training instances in rows, features in columns
+    y_train: numpy array with target values
+    bag_obs_inds: boolean array indicating which rows of x_train are in the bag
+    q_levels: list of quantile levels
+    seeds: array of integer random seeds, one per quantile level
+    x_test: numpy array with test instances in rows, features in columns
+    n_jobs: number of LightGBM threads per fit; None uses the number of
+        physical cores
+    model_paths: optional list of paths from `model_store.booster_path`, one
+        per quantile level, at which to save the fitted boosters
+    init_model_paths: optional list of paths from `model_store.booster_path`,
+        one per quantile level, of stored boosters to continue training from
+    num_boost_round: optional number of boosting rounds for each fit; with
+        `init_model_paths`, the number of rounds added to the stored boosters
+    shared_bins: boolean; if True, a bag with more rows than
+        `subsample_for_bin` is binned once for all quantile levels, rather
+        than once per fit as by `lgb.LGBMRegressor`; see `make_bag_dataset`
+    
+    Returns
+    -------
+    tuple with:
+    - numpy array of test set predictions with one row per row of `x_test` and
+      one column per quantile level
+    - numpy array of feature importance scores, with dimensions (quantile
+      level, importance type, feature); see `feat_importance.IMPORTANCE_TYPES`
+    '''
+    # binned training data for the bag, shared by all quantile levels unless
+    # the bins of the bag depend on the seed of each fit
+    per_fit_bins = is_large_bag(bag_obs_inds) and not shared_bins
+    if not per_fit_bins:
+        train_set = make_bag_dataset(x_train, y_train, bag_obs_inds, seeds[0],
+                                     as_array=init_model_paths is not None,
+                                     shared_bins=shared_bins)
+    
+    test_preds = np.empty((x_test.shape[0], len(q_levels)))
+    feat_importance = np.empty((len(q_levels), len(IMPORTANCE_TYPES),
+                                len(x_train.feat_names)))
+    for q_ind, q_level in enumerate(q_levels):
+        init_model = None
+        if init_model_paths is not None:
+            init_model = model_store.load_booster(init_model_paths[q_ind])
+        
+        if per_fit_bins:
+            train_set = make_bag_dataset(x_train, y_train, bag_obs_inds, seeds[q_ind])
+        
+        model = fit_quantile_model(
+            train_set, q_level, seeds[q_ind], n_jobs=n_jobs,
+            init_model=init_model, num_boost_round=num_boost_round)
+        
+        if model_paths is not None:
+            model_store.save_booster(model_paths[q_ind], model)
+        
+        feat_importance[q_ind] = _feature_importance(model)
+        test_preds[:, q_ind] = _predict(model, x_test, n_jobs)
+    
+    return test_preds, feat_importance
+
+
+def fit_joint_bag(x_train, y_train, bag_obs_inds, q_levels, seed, x_test,
+                  q_levels_per_row, num_boost_round, n_jobs=None,
+                  model_path=None, init_model_path=None):
+    '''
+    Fit a single quantile regression model for all quantile levels in one
+    bag, taking the quantile level as a feature, and obtain test set
+    predictions and feature importance scores.
+    
+    Each training instance in the bag is repeated for `q_levels_per_row`
+    quantile levels drawn at random, and the model minimizes the pinball loss
+    at the quantile level of each repeat.
+    
+    Parameters
+    ----------
+    x_train: StackedMatrix with training instances in rows, features in columns
+    y_train: numpy array with target values
+    bag_obs_inds: boolean array indicating which rows of x_train are in the bag
+    q_levels: list of quantile levels
+    seed: integer random seed for the quantile levels drawn and the fit
+    x_test: numpy array with test instances in rows, features in columns
+    q_levels_per_row: number of quantile levels drawn for each instance
+    num_boost_round: number of boosting rounds; with `init_model_path`, the
+        number of rounds added to the stored booster
+    n_jobs: number of LightGBM threads; None uses the number of physical cores
+    model_path: optional path from `model_store.booster_path` at which to
+        save the fitted booster
+    init_model_path: optional path from `model_store.booster_path` of a
+        stored booster to continue training from
+    
+    Returns
+    -------
+    tuple with:
+    - numpy array of test set predictions with one row per row of `x_test` and
+      one column per quantile level
+    - numpy array of feature importance scores as for `fit_bag`, for a
+      single model and the features in `x_train` followed by the quantile
+      level
+    '''
+    rng = np.random.default_rng(seed)
+    row_inds = np.flatnonzero(bag_obs_inds)
+    q_inds = np.argsort(rng.random((len(row_inds), len(q_levels))), axis=1) \
+        [:, :q_levels_per_row]
+    row_inds = np.repeat(row_inds, q_levels_per_row)
+    tau = np.asarray(q_levels)[q_inds.ravel()]
+    
+    params, _ = get_lgb_params(q_level=0.5, seed=seed, n_jobs=n_jobs)
+    params['objective'] = _pinball_objective(tau)
+    params['metric'] = 'None'
+    
+    init_model = None
+    if init_model_path is not None:
+        # continued training computes initial scores from the raw data, which
+        # must then be an array
+        init_model = model_store.load_booster(init_model_path)
+        data = np.column_stack([x_train.rows(row_inds), tau])
+    else:
+        data = [x_train.sequence(row_inds, extra=tau[:, np.newaxis])]
+    
+    train_set = lgb.Dataset(data,
+                            label=y_train[row_inds],
+                            feature_name=x_train.feat_names + ['q_level'],
+                            categorical_feature=x_train.categorical_feature,
+                            params=params,
+                            free_raw_data=False)
+    model = lgb.train(params, train_set, num_boost_round=num_boost_round,
+                      init_model=init_model)
+    
+    if model_path is not None:
+        model_store.save_booster(model_path, model)
+    
+    return _predict_joint(model, x_test, q_levels, n_jobs), \
+        _feature_importance(model)[np.newaxis]
+
+
+def _feature_importance(model):
+    # importance scores of each type, one row per type
+    return np.stack([model.feature_importance(importance_type=importance_type) \
+                     for importance_type in IMPORTANCE_TYPES])
+
+
+def _pinball_objective(tau):
+    # gradient and hessian of the pinball loss at quantile level tau, as for
+    # LightGBM's quantile objective
+    def objective(preds, train_set):
+        grad = np.where(preds > train_set.get_label(), 1 - tau, -tau)
+        return grad, np.ones_like(grad)
+    
+    return objective
+
+
+def _predict_joint(model, x_test, q_levels, n_jobs):
+    # predictions at each quantile level, one column per level
+    x = np.vstack([np.column_stack([x_test, np.full(x_test.shape[0], q_level)]) \
+                   for q_level in q_levels])
+    return _predict(model, x, n_jobs).reshape(len(q_levels), x_test.shape[0]).T
+
+
+def predict_bag(model_paths, x_test, n_jobs=None, joint_q_levels=None):
+    '''
+    Obtain test set predictions from the stored boosters for one bag.
+    
+    Parameters
+    ----------
+    model_paths: list of paths from `model_store.booster_path`, one per
+        quantile level, or a single path for a model from `fit_joint_bag`
+    x_test: numpy array with test instances in rows, features in columns
+    n_jobs: number of LightGBM threads; None uses the LightGBM default
+    joint_q_levels: for a model from `fit_joint_bag`, the list of quantile
+        levels at which to predict
+    
+    Returns
+    -------
+    numpy array of test set predictions with one row per row of `x_test` and
+    one column per quantile level
+    '''
+    if joint_q_levels is not None:
+        model = model_store.load_booster(model_paths[0])
+        return _predict_joint(model, x_test, joint_q_levels, n_jobs)
+    
+    test_preds = np.empty((x_test.shape[0], len(model_paths)))
+    for q_ind, model_path in enumerate(model_paths):
+        model = model_store.load_booster(model_path)
+        test_preds[:, q_ind] = _predict(model, x_test, n_jobs)
+    
+    return test_preds
+
+
+def _predict(model, x_test, n_jobs):
+    if n_jobs is None:
+        return model.predict(x_test)
+    
+    return model.predict(x_test, num_threads=n_jobs)
@@ -1,14 +1,34 @@
 import argparse
+import copy
 import importlib
+import math
+import sys
 from pathlib import Path
 from types import SimpleNamespace
 
 import datetime
 
-def parse_args():
+# modules shared by the gbq and sarix models
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+
+from feat_importance import FORMATS as FEAT_IMPORTANCE_FORMATS
+from hub_output import OUTPUT_FORMATS
+
+
+MODEL_NAMES = ['gbq_qr', 'gbq_qr_no_level', 'gbq_qr_no_reporting_adj', 'gbq_qr_nhsn_only',
+               'gbq_qr_fit_locations_separately', 'gbq_qr_no_transform',
+               'gbq_qr_joint_quantiles', 'gbq_qr_sparse_quantiles', 'gbq_qr_adaptive_bags']
+
+
+def parse_args(argv=None):
     '''
     Parse arguments to the gbq_qr.py script
     
+    Parameters
+    ----------
+    argv: optional list of command line arguments; by default, the arguments
+        of the current process
+    
     Returns
     -------
     Two configuration objects collecting settings for the model and the run:
@@ -17,28 +37,118 @@ def parse_args():
         - `ref_date`: the reference date for the forecast
         - `output_root`: `pathlib.Path` object with the root directory for
             saving model outputs
+        - `output_format`: file format for model outputs, one of
+            `hub_output.OUTPUT_FORMATS`
         - `max_horizon`: integer, maximum forecast horizon relative to the
             last observed data
         - `q_levels`: list of floats with quantile levels for predictions
         - `q_labels`: list of strings with names for the quantile levels
+        - `save_feat_importance`: boolean; if True, save feature importance
+            scores in the artifact store
+        - `feat_importance_format`: file format for feature importance
+            scores, 'csv' or 'parquet'
+        - `num_workers`: integer number of bags to fit in parallel
+        - `location_workers`: integer number of locations to fit in parallel,
+            for models that are fit to each location separately
+        - `num_threads`: integer number of cores available to the run, which
+            are split among the concurrent fits, or None to use all physical
+            cores
+        - `vintage_store_dir`: `pathlib.Path` with the directory of a
+            `vintage_store.VintageStore` to load flu data from, or None to
+            load them with `FluDataLoader`
+        - `feature_cache_dir`: `pathlib.Path` with a directory for caching
+            featurized data, or None to disable caching
+        - `incremental_features`: boolean; if True, featurize by updating
+            the latest cached features for the same data series
+        - `save_models`: boolean; if True, save the fitted models in the
+            artifact store
+        - `predict_only`: boolean; if True, generate predictions from the
+            models saved by an earlier run instead of fitting models
+        - `warm_start`: boolean; if True, continue training from the models
+            saved for the previous week's reference date
     '''
     parser = _make_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    
+    return build_configs(model_name=args.model_name,
+                         ref_date=args.ref_date,
+                         output_root=args.output_root,
+                         artifact_store_root=args.artifact_store_root,
+                         output_format=args.output_format,
+                         short_run=args.short_run,
+                         save_feat_importance=args.save_feat_importance,
+                         feat_importance_format=args.feat_importance_format,
+                         num_workers=args.num_workers,
+                         location_workers=args.location_workers,
+                         num_threads=args.num_threads,
+                         vintage_store_dir=args.vintage_store_dir,
+                         feature_cache_dir=args.feature_cache_dir,
+                         incremental_features=args.incremental_features,
+                         save_models=args.save_models,
+                         predict_only=args.predict_only,
+                         warm_start=args.warm_start)
+
+
+def build_configs(model_name, ref_date, output_root, artifact_store_root,
+                  output_format='csv', short_run=False, save_feat_importance=False,
+                  feat_importance_format='csv', num_workers=1,
+                  location_workers=1, num_threads=None, vintage_store_dir=None,
+                  feature_cache_dir=None, incremental_features=False,
+                  save_models=False, predict_only=False, warm_start=False):
+    '''
+    Build the configuration objects for one model run. Arguments correspond
+    to the command line arguments described in `_make_parser`.
+    
+    Returns
+    -------
+    Two configuration objects, `model_config` and `run_config`, as described
+    in `parse_args`. `model_config` is a copy, so it can be modified without
+    affecting other runs in the same process.
+    '''
+    ref_date = _validate_ref_date(ref_date)
+    
+    if incremental_features and feature_cache_dir is None:
+        raise ValueError('incremental_features requires a feature_cache_dir')
     
-    ref_date = _validate_ref_date(args.ref_date)
-    model_name = args.model_name
+    if save_models and predict_only:
+        raise ValueError('save_models and predict_only cannot both be set')
     
-    model_config = importlib.import_module(f'configs.{model_name}').config
+    if warm_start and predict_only:
+        raise ValueError('warm_start and predict_only cannot both be set')
+    
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'output_format must be one of {OUTPUT_FORMATS}')
+    
+    if feat_importance_format not in FEAT_IMPORTANCE_FORMATS:
+        raise ValueError(f'feat_importance_format must be one of {FEAT_IMPORTANCE_FORMATS}')
+    
+    model_config = copy.deepcopy(
+        importlib.import_module(f'configs.{model_name}').config)
     
     run_config = SimpleNamespace(
         ref_date=ref_date,
-        output_root=args.output_root,
-        artifact_store_root=args.artifact_store_root,
-        save_feat_importance=args.save_feat_importance
+        output_root=output_root,
+        output_format=output_format,
+        artifact_store_root=artifact_store_root,
+        save_feat_importance=save_feat_importance,
+        feat_importance_format=feat_importance_format,
+        num_workers=num_workers,
+        location_workers=location_workers,
+        num_threads=num_threads,
+        vintage_store_dir=vintage_store_dir,
+        feature_cache_dir=feature_cache_dir,
+        incremental_features=incremental_features,
+        save_models=save_models,
+        predict_only=predict_only,
+        warm_start=warm_start
     )
     
-    if args.short_run:
-        # override model-specified num_bags to a smaller value
+    if short_run:
+        # override model-specified num_bags to a smaller value, and scale the
+        # minimum number of bags for adaptive bagging with it, so that
+        # adaptive bagging can stop early in short runs too
+        model_config.adaptive_bags_min = math.ceil(
+            model_config.adaptive_bags_min * 10 / model_config.num_bags)
         model_config.num_bags = 10
         
         # maximum forecast horizon
@@ -71,8 +181,7 @@ def _make_parser():
                         default=None)
     parser.add_argument('--model_name',
                         help='Model name',
-                        choices=['gbq_qr', 'gbq_qr_no_level', 'gbq_qr_no_reporting_adj', 'gbq_qr_nhsn_only',
-                                 'gbq_qr_fit_locations_separately', 'gbq_qr_no_transform'],
+                        choices=MODEL_NAMES,
                         default='gbq_qr')
     parser.add_argument('--short_run',
                         help='Flag to do a short run; overrides model-default num_bags to 10 and uses 3 quantile levels',
@@ -81,6 +190,10 @@ def _make_parser():
                         help='Path to a directory in which model outputs are saved',
                         type=lambda s: Path(s),
                         default=Path('../../submissions-hub/model-output'))
+    parser.add_argument('--output_format',
+                        help='File format for model outputs; parquet and arrow files are typed following the hub\'s tasks.json and are faster to read than csv files',
+                        choices=OUTPUT_FORMATS,
+                        default='csv')
     parser.add_argument('--artifact_store_root',
                         help='Path to a directory in which artifacts related to model runs are saved',
                         type=lambda s: Path(s),
@@ -88,6 +201,49 @@ def _make_parser():
     parser.add_argument('--save_feat_importance',
                         help='Flag to save feature importances',
                         action='store_true')
+    parser.add_argument('--feat_importance_format',
+                        help='File format for feature importances saved with --save_feat_importance; parquet files are smaller and faster to load',
+                        choices=FEAT_IMPORTANCE_FORMATS,
+                        default='csv')
+    parser.add_argument('--num_workers',
+                        help='Number of bags to fit in parallel; the available cores are split among the workers',
+                        type=int,
+                        default=1)
+    parser.add_argument('--location_workers',
+                        help='Number of locations to fit in parallel, for models that are fit to each location separately; each location fits --num_workers bags in parallel, and the available cores are split among all of them',
+                        type=int,
+                        default=1)
+    parser.add_argument('--num_threads',
+                        help='Number of cores available to the run, which are split among the bags and locations fit in parallel; by default, all physical cores',
+                        type=int,
+                        default=None)
+    parser.add_argument('--vintage_store_dir',
+                        help='Optional path to a local store of flu data vintages; data for a reference date are loaded from the store if an earlier run stored them, without network access, and are added to it otherwise',
+                        type=lambda s: Path(s),
+                        default=None)
+    parser.add_argument('--feature_cache_dir',
+                        help='Optional path to a directory in which featurized data are cached and reused by later runs on the same data',
+                        type=lambda s: Path(s),
+                        default=None)
+    parser.add_argument('--incremental_features',
+                        help='Flag to featurize by updating the most recent features in the feature cache for the same data series, recomputing only windows affected by new or revised data; requires --feature_cache_dir',
+                        action='store_true')
+    parser.add_argument('--save_models',
+                        help='Flag to save the fitted models in the artifact store, for use with --predict_only',
+                        action='store_true')
+    parser.add_argument('--predict_only',
+                        help='Flag to generate predictions from the models saved by an earlier run with --save_models for the same model and reference date, without refitting; used to rerun after revisions to the test data',
+                        action='store_true')
+    parser.add_argument('--warm_start',
+                        help='Flag to continue training from the models saved with --save_models for the previous week\'s reference date, adding a few boosting rounds to each; models are fit from scratch if those are unavailable or use different features',
+                        action='store_true')
+    parser.add_argument('--server_socket',
+                        help='Optional path to the Unix socket of a forecast server started with --serve; the run is done by the server instead of this process',
+                        type=lambda s: Path(s),
+                        default=None)
+    parser.add_argument('--serve',
+                        help='Flag to start a forecast server listening on --server_socket, which keeps imported modules and featurized data in memory across runs',
+                        action='store_true')
     
     return parser
 
@@ -1,6 +1,7 @@
 import os
 import time
 
+from jax import random
 import jax.numpy as jnp
 
 import numpyro
@@ -8,6 +9,39 @@ from numpyro.contrib.control_flow import scan
 import numpyro.distributions as dist
 
 
+def ref_date_rng_key(ref_date):
+    '''
+    Random number generator key determined by a reference date, so that
+    repeated fits for the same reference date draw the same samples
+    
+    Parameters
+    ----------
+    ref_date: datetime.date
+        Reference date of the fit
+    
+    Returns
+    -------
+    random.PRNGKey
+    '''
+    return random.PRNGKey(ref_date.toordinal())
+
+
+def set_parallel_chains(num_chains):
+    '''
+    Make `num_chains` CPU devices available to JAX, so that `GLG.fit` with
+    `chain_method='parallel'` runs that many chains at the same time, one per
+    core. JAX reads the number of devices when it is first used in a process,
+    so this must be called before then, for example before
+    `ref_date_rng_key`; later calls have no effect.
+    
+    Parameters
+    ----------
+    num_chains: integer
+        Number of chains to run in parallel
+    '''
+    numpyro.set_host_device_count(num_chains)
+
+
 class GLG():
     '''
     Class for a hierarchical generalized logistic growth model.
@@ -297,7 +331,7 @@ class GLG():
     
     def fit(self, y_0, s_0, w_0, y_1, s_1, w_1, w_xmas,
             rng_key, num_warmup=1000, num_samples=1000, num_chains=1,
-            print_summary=False):
+            chain_method='parallel', print_summary=False):
         '''
         Fit model using MCMC
         
@@ -312,13 +346,22 @@ class GLG():
         w_xmas: array with shape (self.num_seasons,)
             Season week in which Christmas occurred for each season
         rng_key: random.PRNGKey
-            Random number generator key to be used for MCMC sampling
+            Random number generator key to be used for MCMC sampling, for
+            example from `ref_date_rng_key`. With several chains, it is split
+            into one key per chain.
         num_warmup: integer
-            Number of warmup steps for the MCMC algorithm
+            Number of warmup steps for each MCMC chain
         num_samples: integer
-            Number of sampling steps for the MCMC algorithm
+            Number of samples to draw in each MCMC chain; a caller that wants
+            a total number of samples divides it among the chains
         num_chains: integer
             Number of MCMC chains to run
+        chain_method: string
+            'parallel' to run the chains at the same time, one per JAX device,
+            or 'sequential' to run them one after another. On CPU, JAX has one
+            device unless `set_parallel_chains(num_chains)` is called before
+            JAX is first used in the process; without enough devices, the
+            chains are run sequentially.
         print_summary: boolean
             If True, print a summary of estimation results
         
@@ -333,6 +376,7 @@ class GLG():
             num_warmup=num_warmup,
             num_samples=num_samples,
             num_chains=num_chains,
+            chain_method=chain_method,
             progress_bar=False if 'NUMPYRO_SPHINXBUILD' in os.environ else True)
         
         if self.transform is None:
@@ -348,6 +392,9 @@ class GLG():
             y_trans_0 = jnp.sqrt(0.01 + y_0)
             y_trans_1 = jnp.sqrt(0.01 + y_1)
         
+        if num_chains > 1:
+            rng_key = random.split(rng_key, num_chains)
+        
         self.mcmc.run(rng_key,
                       y_trans_0=y_trans_0, s_0=s_0, w_0=w_0,
                       y_trans_1=y_trans_1, s_1=s_1, w_1=w_1,
@@ -0,0 +1,285 @@
+import argparse
+import datetime
+import os
+import sys
+import time
+import traceback
+from multiprocessing import get_context
+from pathlib import Path
+
+import pandas as pd
+
+# modules shared by the gbq and sarix models
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+
+from hub_output import FILE_SUFFIXES, OUTPUT_FORMATS
+from sarix_model import get_sarix_preds, load_sarix_data
+from scheduler import THREAD_ENV_VARS, _thread_env, available_cores
+from utils import build_configs
+
+
+# columns of the manifest returned by `run_sarix_batch`
+MANIFEST_COLUMNS = ['model_name', 'ref_date', 'status', 'save_path', 'error',
+                    'load_seconds', 'compile_seconds', 'sampling_seconds', 'seconds']
+
+
+def run_sarix_batch(model_names, ref_dates, output_root, artifact_store_root,
+                    output_format='csv', short_run=False, vintage_store_dir=None,
+                    compilation_cache=False, num_chains=1, save_samples=False,
+                    processes=1, skip_existing=False):
+    '''
+    Generate predictions from several SARIX models for several reference
+    dates within one process, or within a pool of processes. JAX is imported
+    and initialized once per process rather than once per model run, and
+    functions that JAX has compiled for earlier runs are kept for later runs
+    in the same process. For each reference date, the flu data are loaded
+    once for each distinct set of data settings (`sources` and
+    `power_transform`) and reused by all models with those settings.
+    
+    With a pool of processes, each reference date is a task in the pool, so
+    the data for a reference date are loaded by one process only. The cores
+    available to this process are split among the processes, and the thread
+    pools of OpenMP, BLAS and XLA in each process are limited to its share.
+    With several MCMC chains, each process runs its chains in parallel, so
+    `processes * num_chains` should be at most the number of cores.
+    
+    Parameters
+    ----------
+    model_names: list of model names, each the name of a module in `configs`
+    ref_dates: list of reference dates, as `datetime.date` objects or strings
+        in format YYYY-MM-DD
+    output_root: `pathlib.Path` with the root directory for saving model outputs
+    artifact_store_root: `pathlib.Path` with the root directory for saving
+        artifacts related to model runs
+    output_format: file format for model outputs, one of
+        `hub_output.OUTPUT_FORMATS`
+    short_run: boolean; if True, do short runs as for
+        `sarix_model.py --short_run`
+    vintage_store_dir: optional `pathlib.Path` with the directory of a
+        `vintage_store.VintageStore` to load flu data from
+    compilation_cache: boolean; if True, programs compiled by JAX are saved
+        in a cache under `artifact_store_root`, and loaded from it by later
+        processes, as for `sarix_model.py --compilation_cache`
+    num_chains: number of MCMC chains for each model run, run in parallel,
+        which split the samples, as for `sarix_model.py --num_chains`
+    save_samples: boolean; if True, the predictive and posterior samples of
+        each model run are saved in the artifact store, as for
+        `sarix_model.py --save_samples`
+    processes: number of reference dates to run in parallel
+    skip_existing: boolean; if True, model runs whose outputs already exist
+        in `output_root`, in any output format, are skipped, so that an
+        interrupted batch can be resumed by repeating the call
+    
+    Returns
+    -------
+    Pandas data frame with one row per combination of model name and reference
+    date, giving the `model_name`, `ref_date`, `status` ('success', 'skipped'
+    or 'failed'), `save_path`, `error`, and the times in seconds spent loading
+    data (`load_seconds`, counted for the first run that uses the data),
+    making the programs that JAX runs for the fit (`compile_seconds`),
+    running them (`sampling_seconds`) and in total (`seconds`)
+    '''
+    ref_dates = [_as_date(ref_date) for ref_date in ref_dates]
+    config_kwargs = dict(
+        output_root=output_root,
+        artifact_store_root=artifact_store_root,
+        output_format=output_format,
+        short_run=short_run,
+        vintage_store_dir=vintage_store_dir,
+        compilation_cache=compilation_cache,
+        num_chains=num_chains,
+        save_samples=save_samples)
+    
+    if processes == 1:
+        manifest = [_run_ref_date(model_names, ref_date, config_kwargs, skip_existing) \
+                    for ref_date in ref_dates]
+    else:
+        manifest = _run_pool(model_names, ref_dates, config_kwargs, skip_existing,
+                             processes)
+    
+    return pd.DataFrame([record for records in manifest for record in records],
+                        columns=MANIFEST_COLUMNS)
+
+
+def _run_ref_date(model_names, ref_date, config_kwargs, skip_existing):
+    '''
+    Run all models for one reference date, sharing loaded data across models
+    with the same data settings.
+    
+    Returns
+    -------
+    list of manifest records, one per model
+    '''
+    data_cache = dict()
+    records = list()
+    for model_name in model_names:
+        start_time = time.time()
+        record = {'model_name': model_name, 'ref_date': ref_date, 'load_seconds': 0.0}
+        try:
+            model_config, run_config = build_configs(
+                model_name=model_name, ref_date=ref_date, **config_kwargs)
+            
+            existing_path = _existing_output(model_config, run_config)
+            if skip_existing and existing_path is not None:
+                record.update(status='skipped', save_path=str(existing_path), error=None)
+            else:
+                data_key = _get_data_key(model_config, run_config)
+                if data_key not in data_cache:
+                    load_start = time.time()
+                    data_cache[data_key] = load_sarix_data(model_config, run_config)
+                    record['load_seconds'] = time.time() - load_start
+                
+                timings = dict()
+                save_path = get_sarix_preds(model_config, run_config, data_cache[data_key],
+                                            timings=timings)
+                record.update(status='success', save_path=str(save_path), error=None,
+                              **timings)
+        except Exception:
+            record.update(status='failed', save_path=None,
+                          error=traceback.format_exc())
+        
+        record['seconds'] = time.time() - start_time
+        records.append(record)
+    
+    return records
+
+
+def _run_pool(model_names, ref_dates, config_kwargs, skip_existing, processes):
+    '''
+    Run all models for all reference dates in a pool of processes, with one
+    task per reference date.
+    
+    Returns
+    -------
+    list of lists of manifest records, one list per reference date
+    '''
+    threads = max(len(available_cores()) // processes, 1)
+    # the pool processes are started with spawn, so that they don't inherit
+    # the state of JAX in this process, and take their thread limits from the
+    # environment when they start, before NumPy and JAX are imported
+    environ = dict(os.environ)
+    os.environ.update({var: value for var, value in _thread_env(threads).items() \
+                       if var in THREAD_ENV_VARS + ['XLA_FLAGS']})
+    try:
+        pool = get_context('spawn').Pool(processes=processes)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+    
+    with pool:
+        return pool.starmap(
+            _run_ref_date,
+            [(model_names, ref_date, config_kwargs, skip_existing) for ref_date in ref_dates],
+            chunksize=1)
+
+
+def _get_data_key(model_config, run_config):
+    return (tuple(model_config.sources), model_config.power_transform)
+
+
+def _existing_output(model_config, run_config):
+    # path of the model output file for the run, in any output format, or
+    # None if there is none
+    output_dir = run_config.output_root / f'UMass-{model_config.model_name}'
+    for suffix in FILE_SUFFIXES.values():
+        save_path = output_dir / f'{str(run_config.ref_date)}-UMass-{model_config.model_name}{suffix}'
+        if save_path.exists():
+            return save_path
+    
+    return None
+
+
+def _as_date(ref_date):
+    if isinstance(ref_date, str):
+        return datetime.date.fromisoformat(ref_date)
+    
+    return ref_date
+
+
+def _make_parser():
+    configs_dir = Path('configs')
+    available_models = [f.name[:-3] for f in list(configs_dir.glob('*.py')) if f.name != 'base.py']
+    parser = argparse.ArgumentParser(description='Run SARIX models for flu prediction for several reference dates')
+    parser.add_argument('--ref_dates',
+                        help='reference dates for predictions in format YYYY-MM-DD; Saturdays',
+                        nargs='+',
+                        type=lambda s: datetime.date.fromisoformat(s),
+                        required=True)
+    parser.add_argument('--model_names',
+                        help='Model names',
+                        nargs='+',
+                        choices=available_models,
+                        default=['sarix_p8_4rt_thetashared_sigmanone_xmas_spike'])
+    parser.add_argument('--short_run',
+                        help='Flag to do short runs; uses fewer MCMC samples and 3 quantile levels',
+                        action='store_true')
+    parser.add_argument('--output_root',
+                        help='Path to a directory in which model outputs are saved',
+                        type=lambda s: Path(s),
+                        default=Path('../../submissions-hub/model-output'))
+    parser.add_argument('--output_format',
+                        help='File format for model outputs',
+                        choices=OUTPUT_FORMATS,
+                        default='csv')
+    parser.add_argument('--artifact_store_root',
+                        help='Path to a directory in which artifacts related to model runs are saved',
+                        type=lambda s: Path(s),
+                        default=Path('../../submissions-hub/model-artifacts'))
+    parser.add_argument('--num_chains',
+                        help='Number of MCMC chains for each model run, run in parallel on as many cores; the samples are split among the chains',
+                        type=int,
+                        default=1)
+    parser.add_argument('--save_samples',
+                        help='Flag to save the predictive samples, and the posterior samples of the model parameters, of each model run in the artifact store; quantiles can be recomputed from the predictive samples with requantile.py',
+                        action='store_true')
+    parser.add_argument('--processes',
+                        help='Number of reference dates to run in parallel, in a pool of processes that split the available cores',
+                        type=int,
+                        default=1)
+    parser.add_argument('--vintage_store_dir',
+                        help='Optional path to a local store of flu data vintages; vintages loaded by earlier runs are read from the store without network access',
+                        type=lambda s: Path(s),
+                        default=None)
+    parser.add_argument('--compilation_cache',
+                        help='Flag to save the programs compiled by JAX in a cache under the artifact store, from which later runs load them instead of compiling them again',
+                        action='store_true')
+    parser.add_argument('--skip_existing',
+                        help='Flag to skip model runs whose outputs already exist, so that an interrupted batch can be resumed',
+                        action='store_true')
+    parser.add_argument('--manifest_path',
+                        help='Optional path to a csv file in which to save the results manifest, with the time taken by each run',
+                        type=lambda s: Path(s),
+                        default=None)
+    
+    return parser
+
+
+def main():
+    args = _make_parser().parse_args()
+    
+    manifest = run_sarix_batch(model_names=args.model_names,
+                               ref_dates=args.ref_dates,
+                               output_root=args.output_root,
+                               artifact_store_root=args.artifact_store_root,
+                               output_format=args.output_format,
+                               short_run=args.short_run,
+                               vintage_store_dir=args.vintage_store_dir,
+                               compilation_cache=args.compilation_cache,
+                               num_chains=args.num_chains,
+                               save_samples=args.save_samples,
+                               processes=args.processes,
+                               skip_existing=args.skip_existing)
+    
+    if args.manifest_path is not None:
+        args.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest.to_csv(args.manifest_path, index=False)
+    
+    print(manifest[['model_name', 'ref_date', 'status', 'load_seconds',
+                    'compile_seconds', 'sampling_seconds', 'seconds']])
+    
+    if (manifest['status'] == 'failed').any():
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import jax
+from jax import monitoring
+
+
+# events recorded by JAX with the duration of each step of making a program:
+# tracing a function, lowering it to XLA, compiling it with XLA, and
+# retrieving it from the persistent compilation cache instead of compiling it
+COMPILE_EVENTS = [
+    '/jax/core/compile/jaxpr_trace_duration',
+    '/jax/core/compile/jaxpr_to_mlir_module_duration',
+    '/jax/core/compile/backend_compile_duration',
+    '/jax/compilation_cache/cache_retrieval_time_sec'
+]
+
+def enable_compilation_cache(cache_dir):
+    '''
+    Save the programs compiled by JAX in an on-disk cache, from which later
+    processes load them instead of compiling them again. A program is reused
+    if it is identical to a cached program, which requires, among other
+    things, arrays of the same shapes; SARIX fits for different reference
+    dates have series of different lengths, so they do not share programs. JAX reads this setting when it first
+    compiles a program, so this must be called before any JAX computations in
+    the process.
+    
+    Parameters
+    ----------
+    cache_dir: `pathlib.Path` with the cache directory, which is created if
+        it does not exist; it can be shared by processes on several hosts
+    '''
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    jax.config.update('jax_compilation_cache_dir', str(cache_dir))
+
+
+class CompileTimer():
+    '''
+    Measures the time spent making programs while in a `with` block: tracing
+    and lowering functions, compiling them with XLA, and loading them from the
+    compilation cache. Nested functions are traced while their callers are
+    traced, so the time is that of the union of the recorded intervals, which
+    counts overlapping intervals once.
+    '''
+    def __enter__(self):
+        self._intervals = list()
+        with _lock:
+            _active_timers.append(self)
+        return self
+    
+    
+    def __exit__(self, *args):
+        with _lock:
+            _active_timers.remove(self)
+    
+    
+    @property
+    def seconds(self):
+        '''
+        Elapsed compile time, in seconds
+        '''
+        total = 0.0
+        merged_start, merged_end = None, None
+        for interval_start, interval_end in sorted(self._intervals):
+            if merged_end is None or interval_start > merged_end:
+                if merged_end is not None:
+                    total += merged_end - merged_start
+                merged_start, merged_end = interval_start, interval_end
+            else:
+                merged_end = max(merged_end, interval_end)
+        if merged_end is not None:
+            total += merged_end - merged_start
+        
+        return total
+
+
+_lock = threading.Lock()
+_active_timers = list()
+
+
+def _record_compile_event(event, duration, **kwargs):
+    if event not in COMPILE_EVENTS:
+        return
+    
+    # listeners are called when a step ends
+    end = time.perf_counter()
+    with _lock:
+        for timer in _active_timers:
+            timer._intervals.append((end - duration, end))
+
+
+monitoring.register_event_duration_secs_listener(_record_compile_event)
@@ -0,0 +1,148 @@
+import argparse
+import datetime
+import sys
+from pathlib import Path
+
+# modules shared by the gbq and sarix models
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+
+from hub_output import FILE_SUFFIXES, OUTPUT_FORMATS, get_hub_schema, write_model_output
+from sample_store import INVERSE_TRANSFORMS, get_quantile_output, get_sample_output, load_samples
+from utils import build_configs, build_save_path
+
+
+def requantile(model_name, ref_date, artifact_store_root, output_root,
+               output_format='csv', q_levels=None, horizons=None,
+               inverse_transform='quantiles', output_type='quantile',
+               num_samples=None):
+    '''
+    Recompute model outputs from the predictive samples saved by a model run
+    with `--save_samples`, without fitting the model again.
+    
+    Parameters
+    ----------
+    model_name: string name of the model
+    ref_date: reference date, as a `datetime.date` object
+    artifact_store_root: `pathlib.Path` with the root directory of the
+        artifact store in which the samples were saved
+    output_root: `pathlib.Path` with the root directory for saving model outputs
+    output_format: file format for model outputs, one of
+        `hub_output.OUTPUT_FORMATS`
+    q_levels: optional list of floats with quantile levels; by default, the
+        quantile levels of a model run
+    horizons: optional list of integer hub horizons to include; by default,
+        all horizons in the samples
+    inverse_transform: one of `sample_store.INVERSE_TRANSFORMS`
+    output_type: 'quantile' for quantiles, or 'sample' for the samples
+        themselves, in the hubverse sample format
+    num_samples: optional number of samples to include in sample outputs;
+        by default, all samples
+    
+    Returns
+    -------
+    `pathlib.Path` of the saved model outputs
+    '''
+    model_config, run_config = build_configs(
+        model_name=model_name,
+        ref_date=ref_date,
+        output_root=output_root,
+        artifact_store_root=artifact_store_root,
+        output_format=output_format)
+    
+    predictions, last_obs, metadata = load_samples(artifact_store_root, model_name,
+                                                   run_config.ref_date)
+    
+    if output_type == 'quantile':
+        if q_levels is None:
+            q_levels, q_labels = run_config.q_levels, run_config.q_labels
+        else:
+            q_labels = [f'{q:g}' for q in q_levels]
+        preds_df = get_quantile_output(predictions, last_obs, q_levels, q_labels,
+                                       metadata['power_transform'], run_config.ref_date,
+                                       horizons=horizons,
+                                       inverse_transform=inverse_transform)
+    elif output_type == 'sample':
+        preds_df = get_sample_output(predictions, last_obs, metadata['power_transform'],
+                                     run_config.ref_date, horizons=horizons,
+                                     num_samples=num_samples)
+    else:
+        raise ValueError("output_type must be 'quantile' or 'sample'")
+    
+    save_path = build_save_path(
+        root=output_root,
+        run_config=run_config,
+        model_config=model_config,
+        suffix=FILE_SUFFIXES[output_format]
+    )
+    write_model_output(preds_df, save_path, output_format, get_hub_schema(output_root))
+    
+    return save_path
+
+
+def _make_parser():
+    parser = argparse.ArgumentParser(description='Recompute SARIX model outputs from saved predictive samples')
+    parser.add_argument('--model_name',
+                        help='Model name',
+                        required=True)
+    parser.add_argument('--ref_dates',
+                        help='reference dates of the saved samples in format YYYY-MM-DD; Saturdays',
+                        nargs='+',
+                        type=lambda s: datetime.date.fromisoformat(s),
+                        required=True)
+    parser.add_argument('--artifact_store_root',
+                        help='Path to the directory in which artifacts related to model runs, including the samples, were saved',
+                        type=lambda s: Path(s),
+                        default=Path('../../submissions-hub/model-artifacts'))
+    parser.add_argument('--output_root',
+                        help='Path to a directory in which model outputs are saved; outputs for the same model and reference date are replaced',
+                        type=lambda s: Path(s),
+                        required=True)
+    parser.add_argument('--output_format',
+                        help='File format for model outputs',
+                        choices=OUTPUT_FORMATS,
+                        default='csv')
+    parser.add_argument('--q_levels',
+                        help='Quantile levels; by default, the 23 quantile levels of a model run',
+                        nargs='+',
+                        type=float,
+                        default=None)
+    parser.add_argument('--horizons',
+                        help='Hub horizons to include; by default, all horizons in the samples',
+                        nargs='+',
+                        type=int,
+                        default=None)
+    parser.add_argument('--inverse_transform',
+                        help='"quantiles" to transform quantiles of the samples back to the original scale, as model runs do, or "samples" to compute quantiles of the samples transformed back to the original scale',
+                        choices=INVERSE_TRANSFORMS,
+                        default='quantiles')
+    parser.add_argument('--output_type',
+                        help='"quantile" for quantiles, or "sample" for the samples in the hubverse sample format; the retrospective and FluSight hubs do not accept sample outputs',
+                        choices=['quantile', 'sample'],
+                        default='quantile')
+    parser.add_argument('--num_samples',
+                        help='Number of samples to include in sample outputs; by default, all samples',
+                        type=int,
+                        default=None)
+    
+    return parser
+
+
+def main():
+    args = _make_parser().parse_args()
+    
+    for ref_date in args.ref_dates:
+        save_path = requantile(model_name=args.model_name,
+                               ref_date=ref_date,
+                               artifact_store_root=args.artifact_store_root,
+                               output_root=args.output_root,
+                               output_format=args.output_format,
+                               q_levels=args.q_levels,
+                               horizons=args.horizons,
+                               inverse_transform=args.inverse_transform,
+                               output_type=args.output_type,
+                               num_samples=args.num_samples)
+        print(save_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,38 @@
 # This script should be run with code/sarix_model as the working directory:
 # python retrospective-experiments/sarix_experiments.py
+#
+# Model runs are done by batch.run_sarix_batch, in a pool with one process per
+# core, so that JAX is imported once per process, and each reference date's
+# data are loaded once and shared by all models. Runs whose outputs are
+# already in the hub are skipped, so if the script is interrupted, rerunning
+# it resumes from where it stopped. Programs compiled by JAX are cached under
+# the artifact store, so that they are not compiled again by a rerun, and the
+# predictive samples of each run are saved there, so that outputs for other
+# quantile levels can be computed with requantile.py without refitting. A
+# manifest with the time taken by each run, with compile time and sampling
+# time separately, is saved to retrospective-experiments/logs/sarix_experiments.
+#
+# To split the runs across several hosts, run the script on each host with
+# the same --queue_dir, a directory on a shared file system such as an NFS
+# share that is mounted at the same path on every host. The runs are then
+# added to a work queue in that directory (see work_queue.py), and each host
+# runs them as a worker until none are left, one process per run:
+# python retrospective-experiments/sarix_experiments.py --queue_dir /nfs/queues/sarix_experiments
 
+import argparse
+import os
+import sys
 import datetime
-import subprocess
 from itertools import product
+from pathlib import Path
+
+# modules in code/sarix_model, and modules shared with code/gbq in code/common
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.join(os.getcwd(), '..', 'common'))
+
+from batch import run_sarix_batch
+from scheduler import available_cores, sarix_job
+from work_queue import enqueue, run_worker
 
 # model_names = [
 #     f'sarix_p{p}_4rt_theta{theta_pooling}_sigmanone_xmas_spike' \
@@ -19,20 +48,43 @@ ref_dates = [
         for i in range(30)
 ]
 
-def run_command(command):
-    """Run system command"""
-    subprocess.run(command)
+output_root = '../../retrospective-hub/model-output'
+artifact_store_root = '../../retrospective-hub/model-artifacts'
 
+log_dir = Path('retrospective-experiments/logs/sarix_experiments')
 
-output_root = '../../retrospective-hub/model-output'
 
-commands = [[
-    "python",
-    "sarix_model.py",
-    "--ref_date", ref_date,
-    "--output_root", output_root,
-    "--model_name", model_name]
-    for (model_name, ref_date) in product(model_names, ref_dates)]
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queue_dir',
+                        help='Optional path to a work queue directory shared by several workers; each worker, on any host, runs this script with the same --queue_dir',
+                        type=lambda s: Path(s),
+                        default=None)
+    args = parser.parse_args()
+    
+    if args.queue_dir is None:
+        manifest = run_sarix_batch(model_names, ref_dates,
+                                   output_root=Path(output_root),
+                                   artifact_store_root=Path(artifact_store_root),
+                                   compilation_cache=True,
+                                   save_samples=True,
+                                   processes=min(len(available_cores()), len(ref_dates)),
+                                   skip_existing=True)
+        log_dir.mkdir(parents=True, exist_ok=True)
+        manifest.to_csv(log_dir / 'manifest.csv', index=False)
+    else:
+        jobs = [sarix_job(model_name, ref_date, output_root, threads=1,
+                          args=['--artifact_store_root', artifact_store_root,
+                                '--compilation_cache', '--save_samples']) \
+                for (model_name, ref_date) in product(model_names, ref_dates)]
+        enqueue(args.queue_dir, jobs)
+        manifest = run_worker(args.queue_dir)
+    print(manifest['status'].value_counts())
+    
+    if (manifest['status'] == 'failed').any():
+        raise SystemExit(1)
+
 
-for command in commands:
-    run_command(command)
+# the batch's pool processes import this module, and must not rerun the grid
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+# subdirectory of a model's directory in the artifact store with its samples
+SAMPLES_SUBDIR = 'samples'
+
+# kinds of samples saved for a model run: predictive samples, and posterior
+# samples of the model's parameters
+SAMPLE_KINDS = ['predictive', 'posterior']
+
+# columns of the last observation for each location that are used to
+# transform predictions back to the original scale
+LAST_OBS_COLS = ['location', 'wk_end_date', 'inc_trans_center_factor',
+                 'inc_trans_scale_factor', 'pop']
+
+# ways of computing quantiles on the original scale: quantiles of the
+# samples on the transformed scale, transformed back to the original scale
+# (as for model runs), or quantiles of the samples transformed back to the
+# original scale
+INVERSE_TRANSFORMS = ['quantiles', 'samples']
+
+
+def samples_path(artifact_store_root, model_name, ref_date, kind='predictive'):
+    '''
+    Path of the samples of a model for a reference date in the artifact
+    store.
+    
+    Parameters
+    ----------
+    artifact_store_root: `pathlib.Path` with the root directory of the
+        artifact store
+    model_name: string name of the model
+    ref_date: reference date, as a `datetime.date` object or a string in
+        format YYYY-MM-DD
+    kind: one of `SAMPLE_KINDS`
+    
+    Returns
+    -------
+    `pathlib.Path` of the samples file
+    '''
+    if kind not in SAMPLE_KINDS:
+        raise ValueError(f'kind must be one of {SAMPLE_KINDS}')
+    
+    return artifact_store_root / f'UMass-{model_name}' / SAMPLES_SUBDIR / \
+        f'{str(ref_date)}-UMass-{model_name}-{kind}.arrow'
+
+
+def save_samples(artifact_store_root, model_name, ref_date, predictions, last_obs,
+                 power_transform, posterior=None):
+    '''
+    Save the predictive samples from a model run, and optionally the
+    posterior samples of the model's parameters, in uncompressed Arrow IPC
+    files in the artifact store, with one row per MCMC draw. Each file is
+    written to a temporary file and renamed, so readers never see a
+    partially written file.
+    
+    Parameters
+    ----------
+    artifact_store_root: `pathlib.Path` with the root directory of the
+        artifact store
+    model_name: string name of the model
+    ref_date: reference date, as a `datetime.date` object
+    predictions: array of predictions on the transformed scale, with shape
+        (number of samples, number of locations, number of forecast steps)
+    last_obs: Pandas data frame with the last observation for each location,
+        in the order of the locations in `predictions`, with the columns in
+        `LAST_OBS_COLS`
+    power_transform: power transform applied to the data, as in the model's
+        configuration
+    posterior: optional dictionary of arrays with the posterior samples of
+        the model's parameters, each with the draws along its first dimension
+    '''
+    # the last observations are kept in the file's metadata, with dates as
+    # strings
+    metadata = {
+        'model_name': model_name,
+        'ref_date': str(ref_date),
+        'power_transform': power_transform,
+        'last_obs': last_obs[LAST_OBS_COLS] \
+            .assign(wk_end_date=lambda x: x['wk_end_date'].dt.strftime('%Y-%m-%d')) \
+            .to_dict(orient='list')
+    }
+    _write_draws(samples_path(artifact_store_root, model_name, ref_date, 'predictive'),
+                 {'predictions': predictions}, metadata)
+    
+    if posterior is not None:
+        _write_draws(samples_path(artifact_store_root, model_name, ref_date, 'posterior'),
+                     posterior, {'model_name': model_name, 'ref_date': str(ref_date)})
+
+
+def load_samples(artifact_store_root, model_name, ref_date):
+    '''
+    Load the predictive samples saved by `save_samples`. The file is memory
+    mapped, and the array of predictions is a read-only view of it, so the
+    samples are read from disk as they are used.
+    
+    Parameters
+    ----------
+    artifact_store_root: `pathlib.Path` with the root directory of the
+        artifact store
+    model_name: string name of the model
+    ref_date: reference date, as a `datetime.date` object or a string in
+        format YYYY-MM-DD
+    
+    Returns
+    -------
+    tuple of the array of predictions on the transformed scale, with shape
+    (number of samples, number of locations, number of forecast steps), a
+    Pandas data frame with the last observation for each location, and a
+    dictionary with the `model_name`, `ref_date` and `power_transform`
+    '''
+    arrays, metadata = _read_draws(
+        samples_path(artifact_store_root, model_name, ref_date, 'predictive'))
+    last_obs = pd.DataFrame(metadata['last_obs']) \
+        .assign(wk_end_date=lambda x: pd.to_datetime(x['wk_end_date']))
+    
+    return arrays['predictions'], last_obs, \
+        {k: metadata[k] for k in ['model_name', 'ref_date', 'power_transform']}
+
+
+def load_posterior_samples(artifact_store_root, model_name, ref_date):
+    '''
+    Load the posterior samples of a model's parameters saved by
+    `save_samples`. As for `load_samples`, the arrays are read-only views of
+    the memory mapped file.
+    
+    Parameters
+    ----------
+    artifact_store_root, model_name, ref_date: as for `load_samples`
+    
+    Returns
+    -------
+    dictionary of arrays with the posterior samples of the model's
+    parameters, each with the draws along its first dimension
+    '''
+    arrays, _ = _read_draws(
+        samples_path(artifact_store_root, model_name, ref_date, 'posterior'))
+    return arrays
+
+
+def get_quantile_output(predictions, last_obs, q_levels, q_labels, power_transform,
+                        ref_date, horizons=None, inverse_transform='quantiles'):
+    '''
+    Quantiles of predictive samples in hub format.
+    
+    Parameters
+    ----------
+    predictions: array of predictions on the transformed scale, with shape
+        (number of samples, number of locations, number of forecast steps)
+    last_obs: Pandas data frame with the last observation for each location,
+        in the order of the locations in `predictions`
+    q_levels: list of floats with quantile levels
+    q_labels: list of strings with names for the quantile levels
+    power_transform: power transform applied to the data, as in the model's
+        configuration
+    ref_date: reference date, as a `datetime.date` object
+    horizons: optional list of integer hub horizons to include; by default,
+        all horizons
+    inverse_transform: one of `INVERSE_TRANSFORMS`
+    
+    Returns
+    -------
+    Pandas data frame with model outputs in hub format
+    '''
+    if inverse_transform not in INVERSE_TRANSFORMS:
+        raise ValueError(f'inverse_transform must be one of {INVERSE_TRANSFORMS}')
+    
+    if inverse_transform == 'quantiles':
+        pred_qs = _to_original_scale(
+            np.percentile(predictions, np.array(q_levels) * 100, axis=0),
+            last_obs, power_transform)
+    else:
+        pred_qs = np.percentile(_to_original_scale(predictions, last_obs, power_transform),
+                                np.array(q_levels) * 100, axis=0)
+    
+    num_steps = predictions.shape[2]
+    preds_df = pd.concat([
+        pd.DataFrame(pred_qs[i, :, :]) \
+        .set_axis(last_obs['location'], axis='index') \
+        .set_axis(np.arange(1, num_steps+1), axis='columns') \
+        .assign(output_type_id = q_label) \
+        for i, q_label in enumerate(q_labels)
+    ]) \
+    .reset_index() \
+    .melt(['location', 'output_type_id'], var_name='horizon')
+    
+    return _to_hub_format(preds_df, last_obs, ref_date, 'quantile', horizons)
+
+
+def get_sample_output(predictions, last_obs, power_transform, ref_date,
+                      horizons=None, num_samples=None):
+    '''
+    Predictive samples on the original scale in hub format, with output type
+    'sample' and the index of each sample as its output type id. Each
+    sample is a trajectory across horizons for one location.
+    
+    Parameters
+    ----------
+    predictions, last_obs, power_transform, ref_date, horizons: as for
+        `get_quantile_output`
+    num_samples: optional number of samples to include, which are the first
+        samples; by default, all samples
+    
+    Returns
+    -------
+    Pandas data frame with model outputs in hub format
+    '''
+    if num_samples is not None:
+        predictions = predictions[:num_samples]
+    
+    values = _to_original_scale(predictions, last_obs, power_transform)
+    num_samples, num_locations, num_steps = values.shape
+    preds_df = pd.DataFrame({
+        'location': np.repeat(last_obs['location'].values, num_steps * num_samples),
+        'output_type_id': np.tile(np.arange(num_samples), num_locations * num_steps),
+        'horizon': np.tile(np.repeat(np.arange(1, num_steps + 1), num_samples), num_locations),
+        'value': np.transpose(values, (1, 2, 0)).ravel()
+    })
+    
+    return _to_hub_format(preds_df, last_obs, ref_date, 'sample', horizons)
+
+
+def _to_original_scale(values, last_obs, power_transform):
+    # values has locations and forecast steps in its last two dimensions
+    center = last_obs['inc_trans_center_factor'].values[:, np.newaxis]
+    scale = last_obs['inc_trans_scale_factor'].values[:, np.newaxis]
+    pop = last_obs['pop'].values[:, np.newaxis]
+    
+    values = (values + center) * scale
+    if power_transform == '4rt':
+        values = np.maximum(values, 0.0) ** 4
+    else:
+        values = np.maximum(values, 0.0) ** 2
+    
+    values = (values - 0.01 - 0.75**4) * pop / 100000
+    return np.maximum(values, 0.0)
+
+
+def _to_hub_format(preds_df, last_obs, ref_date, output_type, horizons):
+    # preds_df has columns location, output_type_id, horizon (the forecast
+    # step relative to the last observation) and value
+    preds_df = preds_df.merge(last_obs[['location', 'wk_end_date']], on='location', how='left')
+    
+    # keep just required columns and rename to match hub format
+    preds_df = preds_df[['location', 'wk_end_date', 'horizon', 'output_type_id', 'value']]
+    
+    preds_df['target_end_date'] = preds_df['wk_end_date'] + pd.to_timedelta(7*preds_df['horizon'], unit='days')
+    preds_df['reference_date'] = ref_date
+    preds_df['horizon'] = preds_df['horizon'] - 2
+    preds_df['output_type'] = output_type
+    preds_df['target'] = 'wk inc flu hosp'
+    preds_df.drop(columns='wk_end_date', inplace=True)
+    
+    if horizons is not None:
+        preds_df = preds_df.loc[preds_df['horizon'].isin(horizons)].reset_index(drop=True)
+    
+    return preds_df
+
+
+def _write_draws(save_path, arrays, metadata):
+    # one row per draw, with a fixed size list column for each array, so
+    # that the values of each array are contiguous in the file; the shape of
+    # each array after its first dimension is kept in the metadata
+    columns = dict()
+    shapes = dict()
+    for name, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        shapes[name] = list(values.shape[1:])
+        columns[name] = pa.FixedSizeListArray.from_arrays(
+            pa.array(values.reshape(-1)), int(np.prod(values.shape[1:])))
+    table = pa.table(columns) \
+        .replace_schema_metadata({'sarix_samples': json.dumps(dict(metadata, shapes=shapes))})
+    
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = save_path.with_name(save_path.name + f'.tmp{os.getpid()}')
+    try:
+        with pa.OSFile(str(tmp_path), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, save_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _read_draws(path):
+    # the arrays are views of the memory map, which stays open while they
+    # are in use
+    table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+    metadata = json.loads(table.schema.metadata[b'sarix_samples'])
+    arrays = {
+        name: table.column(name).chunk(0).flatten().to_numpy() \
+            .reshape([table.num_rows] + shape) \
+        for name, shape in metadata['shapes'].items()
+    }
+    
+    return arrays, metadata
@@ -1,14 +1,31 @@
 import os
+import sys
 from pathlib import Path
 
+# modules shared by the gbq and sarix models
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+
+from forecast_server import DataCache, parse_server_args, run_client, serve
+
+if __name__ == '__main__':
+    # a run done by a forecast server is submitted before the modules for
+    # model fitting are imported, which this process does not need
+    server_socket, start_server, argv = parse_server_args(sys.argv[1:])
+    if server_socket is not None and not start_server:
+        run_client(server_socket, argv)
+        sys.exit(0)
+
 from itertools import chain, product
 
 import datetime
 
 import math
+import time
 import numpy as np
 import pandas as pd
 
+import numpyro
+
 from iddata.loader import FluDataLoader
 from iddata.utils import get_holidays
 
@@ -16,24 +33,69 @@ import datetime
 
 from sarix import sarix
 
+from compilation import CompileTimer, enable_compilation_cache
+from hub_output import FILE_SUFFIXES, get_hub_schema, write_model_output
+from sample_store import get_quantile_output, save_samples
 from utils import parse_args, build_save_path
+from vintage_store import VintageStore
 
 
 def main():
+    server_socket, start_server, argv = parse_server_args(sys.argv[1:])
+    if start_server:
+        serve(server_socket, _make_job_runner())
+        return
+    
     # parse arguments
-    model_config, run_config = parse_args()
+    model_config, run_config = parse_args(argv)
     print(model_config.model_name)
     print(run_config.ref_date)
     
     # fit model and generate predictions
-    get_sarix_preds(model_config, run_config)
+    timings = dict()
+    get_sarix_preds(model_config, run_config, timings=timings)
+    print(f'compile time: {timings["compile_seconds"]:.1f}s, '
+          f'sampling time: {timings["sampling_seconds"]:.1f}s')
 
 
-def get_sarix_preds(model_config, run_config):
-    fdl = FluDataLoader()
-    df = fdl.load_data(nhsn_kwargs={'as_of': run_config.ref_date},
-                       sources=model_config.sources,
-                       power_transform=model_config.power_transform)
+def _make_job_runner():
+    # loaded data are kept in memory for the most recent data settings and
+    # reference dates; JAX keeps the functions it has compiled
+    data_cache = DataCache()
+    
+    def run_job(argv):
+        model_config, run_config = parse_args(argv)
+        key = (run_config.ref_date, run_config.vintage_store_dir,
+               tuple(model_config.sources), model_config.power_transform)
+        df = data_cache.get(key, lambda: load_sarix_data(model_config, run_config))
+        return get_sarix_preds(model_config, run_config, df)
+    
+    return run_job
+
+
+def load_sarix_data(model_config, run_config):
+    if run_config.vintage_store_dir is None:
+        fdl = FluDataLoader()
+    else:
+        fdl = VintageStore(run_config.vintage_store_dir)
+    return fdl.load_data(nhsn_kwargs={'as_of': run_config.ref_date},
+                         sources=model_config.sources,
+                         power_transform=model_config.power_transform)
+
+
+def get_sarix_preds(model_config, run_config, df=None, timings=None):
+    if run_config.compilation_cache_dir is not None:
+        enable_compilation_cache(run_config.compilation_cache_dir)
+    
+    if run_config.num_chains > 1:
+        # chains run in parallel on separate host devices; JAX reads the
+        # number of devices when it is first used in a process, so this has
+        # no effect in a process that has already used it, and chains then
+        # run one after another
+        numpyro.set_host_device_count(run_config.num_chains)
+    
+    if df is None:
+        df = load_sarix_data(model_config, run_config)
     
     # season week relative to christmas
     df = df.merge(
@@ -46,67 +108,62 @@ def get_sarix_preds(model_config, run_config):
     .assign(delta_xmas = lambda x: x['season_week'] - x['xmas_week'])
     df['xmas_spike'] = np.maximum(3 - np.abs(df['delta_xmas']), 0)
     
+    # the series have one more time step each week, so fits for different
+    # reference dates do not share compiled programs; see README.md
     xy_colnames = ["inc_trans_cs"] + model_config.x
     batched_xy = df[xy_colnames].values.reshape(len(df['location'].unique()), -1, len(xy_colnames))
     
-    sarix_fit_all_locs_theta_pooled = sarix.SARIX(
-        xy = batched_xy,
-        p = model_config.p,
-        d = model_config.d,
-        P = model_config.P,
-        D = model_config.D,
-        season_period = model_config.season_period,
-        transform='none', # transformations are handled outside of SARIX
-        theta_pooling=model_config.theta_pooling,
-        sigma_pooling=model_config.sigma_pooling,
-        forecast_horizon = run_config.max_horizon,
-        num_warmup = run_config.num_warmup,
-        num_samples = run_config.num_samples,
-        num_chains = run_config.num_chains)
-    
-    pred_qs = np.percentile(sarix_fit_all_locs_theta_pooled.predictions[..., :, :, 0],
-                            np.array(run_config.q_levels) * 100, axis=0)
+    # the time spent making the sampler's programs, including loading them
+    # from the compilation cache, is measured separately from the rest of
+    # the fit, which is mostly sampling
+    fit_start = time.time()
+    with CompileTimer() as compile_timer:
+        sarix_fit_all_locs_theta_pooled = sarix.SARIX(
+            xy = batched_xy,
+            p = model_config.p,
+            d = model_config.d,
+            P = model_config.P,
+            D = model_config.D,
+            season_period = model_config.season_period,
+            transform='none', # transformations are handled outside of SARIX
+            theta_pooling=model_config.theta_pooling,
+            sigma_pooling=model_config.sigma_pooling,
+            forecast_horizon = run_config.max_horizon,
+            num_warmup = run_config.num_warmup,
+            num_samples = run_config.num_samples,
+            num_chains = run_config.num_chains)
+    if timings is not None:
+        timings['compile_seconds'] = compile_timer.seconds
+        timings['sampling_seconds'] = time.time() - fit_start - compile_timer.seconds
     
+    # predictive samples on the transformed scale, with shape (number of
+    # samples, number of locations, number of forecast steps)
+    predictions = np.asarray(sarix_fit_all_locs_theta_pooled.predictions[..., :, :, 0])
     df_nhsn_last_obs = df.groupby(['location']).tail(1)
     
-    preds_df = pd.concat([
-        pd.DataFrame(pred_qs[i, :, :]) \
-        .set_axis(df_nhsn_last_obs['location'], axis='index') \
-        .set_axis(np.arange(1, run_config.max_horizon+1), axis='columns') \
-        .assign(output_type_id = q_label) \
-        for i, q_label in enumerate(run_config.q_labels)
-    ]) \
-    .reset_index() \
-    .melt(['location', 'output_type_id'], var_name='horizon') \
-    .merge(df_nhsn_last_obs, on='location', how='left')
+    if run_config.save_samples:
+        # SARIX keeps the posterior samples of the model's parameters from
+        # its MCMC run in `samples`
+        save_samples(run_config.artifact_store_root, model_config.model_name,
+                     run_config.ref_date, predictions, df_nhsn_last_obs,
+                     model_config.power_transform,
+                     posterior=getattr(sarix_fit_all_locs_theta_pooled, 'samples', None))
     
-    # build data frame with predictions on the original scale
-    preds_df['value'] = (preds_df['value'] + preds_df['inc_trans_center_factor']) * preds_df['inc_trans_scale_factor']
-    if model_config.power_transform == '4rt':
-        preds_df['value'] = np.maximum(preds_df['value'], 0.0) ** 4
-    else:
-        preds_df['value'] = np.maximum(preds_df['value'], 0.0) ** 2
-    
-    preds_df['value'] = (preds_df['value'] - 0.01 - 0.75**4) * preds_df['pop'] / 100000
-    preds_df['value'] = np.maximum(preds_df['value'], 0.0)
-    
-    # keep just required columns and rename to match hub format
-    preds_df = preds_df[['location', 'wk_end_date', 'horizon', 'output_type_id', 'value']]
-    
-    preds_df['target_end_date'] = preds_df['wk_end_date'] + pd.to_timedelta(7*preds_df['horizon'], unit='days')
-    preds_df['reference_date'] = run_config.ref_date
-    preds_df['horizon'] = preds_df['horizon'] - 2
-    preds_df['output_type'] = 'quantile'
-    preds_df['target'] = 'wk inc flu hosp'
-    preds_df.drop(columns='wk_end_date', inplace=True)
+    preds_df = get_quantile_output(predictions, df_nhsn_last_obs,
+                                   run_config.q_levels, run_config.q_labels,
+                                   model_config.power_transform, run_config.ref_date)
     
     # save
     save_path = build_save_path(
         root=run_config.output_root,
         run_config=run_config,
-        model_config=model_config
+        model_config=model_config,
+        suffix=FILE_SUFFIXES[run_config.output_format]
     )
-    preds_df.to_csv(save_path, index=False)
+    write_model_output(preds_df, save_path, run_config.output_format,
+                       get_hub_schema(run_config.output_root))
+    
+    return save_path
 
 
 if __name__ == '__main__':
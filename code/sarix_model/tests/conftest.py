@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# the modules under test are in the parent directory; the test directory is
+# not a package, so that test modules of gbq, sarix_model and common can be
+# collected together
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,73 @@
+import datetime
+from pathlib import Path
+
+import batch
+from batch import MANIFEST_COLUMNS, run_sarix_batch
+from utils import build_save_path
+
+
+MODEL_NAMES = ['sarix_p2_4rt_thetanone_sigmanone', 'sarix_p4_4rt_thetanone_sigmanone']
+REF_DATES = ['2024-01-06', '2024-01-13']
+
+
+def _patch_model_runs(monkeypatch, fail_model=None):
+    # replaces loading data and fitting models; returns the list of loads
+    loads = list()
+    
+    def load_sarix_data(model_config, run_config):
+        loads.append(run_config.ref_date)
+        return {'ref_date': run_config.ref_date}
+    
+    def get_sarix_preds(model_config, run_config, df, timings):
+        assert df['ref_date'] == run_config.ref_date
+        if model_config.model_name == fail_model:
+            raise ValueError('model failed')
+        
+        timings.update(compile_seconds=1.0, sampling_seconds=2.0)
+        save_path = build_save_path(run_config.output_root, run_config, model_config)
+        save_path.write_text('')
+        return save_path
+    
+    monkeypatch.setattr(batch, 'load_sarix_data', load_sarix_data)
+    monkeypatch.setattr(batch, 'get_sarix_preds', get_sarix_preds)
+    return loads
+
+
+def test_run_sarix_batch_shares_data_across_models(tmp_path, monkeypatch):
+    loads = _patch_model_runs(monkeypatch)
+    
+    manifest = run_sarix_batch(MODEL_NAMES, REF_DATES, tmp_path / 'model-output',
+                               tmp_path / 'model-artifacts')
+    
+    assert list(manifest.columns) == MANIFEST_COLUMNS
+    assert manifest['model_name'].tolist() == MODEL_NAMES * 2
+    assert manifest['ref_date'].tolist() == \
+        [datetime.date(2024, 1, 6)] * 2 + [datetime.date(2024, 1, 13)] * 2
+    assert (manifest['status'] == 'success').all()
+    # both models use the same data settings, so the data for each reference
+    # date are loaded once, by the first model
+    assert loads == [datetime.date(2024, 1, 6), datetime.date(2024, 1, 13)]
+    assert (manifest['load_seconds'][[1, 3]] == 0.0).all()
+    assert (manifest['compile_seconds'] == 1.0).all()
+    assert (manifest['sampling_seconds'] == 2.0).all()
+    for save_path in manifest['save_path']:
+        assert Path(save_path).exists()
+
+
+def test_run_sarix_batch_records_failures_and_skips_existing(tmp_path, monkeypatch):
+    _patch_model_runs(monkeypatch, fail_model=MODEL_NAMES[1])
+    
+    manifest = run_sarix_batch(MODEL_NAMES, REF_DATES, tmp_path / 'model-output',
+                               tmp_path / 'model-artifacts')
+    
+    assert manifest['status'].tolist() == ['success', 'failed'] * 2
+    assert manifest['error'][0] is None
+    assert 'model failed' in manifest['error'][1]
+    
+    # a rerun skips the runs that succeeded, and runs the failed ones again
+    loads = _patch_model_runs(monkeypatch)
+    manifest = run_sarix_batch(MODEL_NAMES, REF_DATES, tmp_path / 'model-output',
+                               tmp_path / 'model-artifacts', skip_existing=True)
+    
+    assert manifest['status'].tolist() == ['skipped', 'success'] * 2
+    assert loads == [datetime.date(2024, 1, 6), datetime.date(2024, 1, 13)]
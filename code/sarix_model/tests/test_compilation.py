@@ -0,0 +1,89 @@
+import datetime
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from jax import monitoring
+
+import compilation
+import sarix_model
+from compilation import CompileTimer, _record_compile_event
+from utils import build_configs
+
+
+TRACE_EVENT = '/jax/core/compile/jaxpr_trace_duration'
+COMPILE_EVENT = '/jax/core/compile/backend_compile_duration'
+
+
+def _record_at(monkeypatch, end, event, duration):
+    # records an event that ends at time `end`
+    monkeypatch.setattr(compilation, 'time', SimpleNamespace(perf_counter=lambda: end))
+    _record_compile_event(event, duration)
+
+
+def test_compile_timer_counts_overlapping_intervals_once(monkeypatch):
+    with CompileTimer() as timer:
+        # a nested function is traced within the trace of its caller, from
+        # 0.5 to 1.0 within 0.2 to 2.0
+        _record_at(monkeypatch, 1.0, TRACE_EVENT, 0.5)
+        _record_at(monkeypatch, 2.0, TRACE_EVENT, 1.8)
+        # compiling starts before the trace ends, from 1.5 to 3.0
+        _record_at(monkeypatch, 3.0, COMPILE_EVENT, 1.5)
+        # a separate compilation, from 4.0 to 4.5
+        _record_at(monkeypatch, 4.5, COMPILE_EVENT, 0.5)
+        # other events are not counted
+        _record_at(monkeypatch, 6.0, '/jax/other', 5.0)
+    
+    # events after the block are not counted
+    _record_at(monkeypatch, 8.0, COMPILE_EVENT, 1.0)
+    
+    assert timer.seconds == pytest.approx(2.8 + 0.5)
+
+
+def test_compile_timer_without_events():
+    with CompileTimer() as timer:
+        pass
+    
+    assert timer.seconds == 0.0
+
+
+class _FakeSARIX():
+    # spends 0.2 seconds making programs and 0.1 seconds sampling
+    def __init__(self, xy, forecast_horizon, num_samples, **kwargs):
+        time.sleep(0.2)
+        monitoring.record_event_duration_secs(COMPILE_EVENT, 0.2)
+        time.sleep(0.1)
+        self.predictions = np.zeros((num_samples, xy.shape[0], forecast_horizon, 1))
+
+
+def test_get_sarix_preds_separates_compile_and_sampling_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(sarix_model, 'sarix', SimpleNamespace(SARIX=_FakeSARIX))
+    monkeypatch.setattr(sarix_model, 'get_holidays', lambda: pd.DataFrame({
+        'season': ['2023/24'], 'holiday': ['Christmas Day'],
+        'date': [datetime.date(2023, 12, 25)], 'season_week': [17]
+    }))
+    model_config, run_config = build_configs(
+        model_name='sarix_p2_4rt_thetanone_sigmanone',
+        ref_date=datetime.date(2024, 1, 6),
+        output_root=tmp_path / 'model-output',
+        artifact_store_root=tmp_path / 'model-artifacts',
+        short_run=True)
+    df = pd.DataFrame({
+        'location': np.repeat(['01', 'US'], 10),
+        'season': '2023/24',
+        'season_week': np.tile(np.arange(8, 18), 2),
+        'wk_end_date': np.tile(pd.date_range('2023-10-28', periods=10, freq='7D'), 2),
+        'inc_trans_cs': np.linspace(-1.0, 1.0, 20),
+        'inc_trans_center_factor': 0.5,
+        'inc_trans_scale_factor': 1.0,
+        'pop': 1e6
+    })
+    
+    timings = dict()
+    save_path = sarix_model.get_sarix_preds(model_config, run_config, df, timings=timings)
+    
+    assert save_path.exists()
+    assert timings['compile_seconds'] == pytest.approx(0.2, abs=0.01)
+    assert timings['sampling_seconds'] == pytest.approx(0.1, abs=0.05)
@@ -0,0 +1,78 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from requantile import requantile
+from sample_store import get_quantile_output, load_posterior_samples, load_samples, \
+    save_samples
+
+
+MODEL_NAME = 'sarix_p2_4rt_thetanone_sigmanone'
+REF_DATE = datetime.date(2024, 1, 6)
+
+
+def _make_samples():
+    rng = np.random.default_rng(42)
+    # 40 samples for 2 locations and 7 forecast steps
+    predictions = rng.normal(size=(40, 2, 7)).astype(np.float32)
+    last_obs = pd.DataFrame({
+        'location': ['01', 'US'],
+        'wk_end_date': pd.to_datetime(['2023-12-23', '2023-12-23']),
+        'inc_trans_center_factor': [0.5, 0.8],
+        'inc_trans_scale_factor': [1.2, 1.5],
+        'pop': [5e6, 3e8]
+    })
+    posterior = {
+        'theta': rng.normal(size=(40, 2, 3)),
+        'sigma': rng.gamma(1.0, size=40)
+    }
+    return predictions, last_obs, posterior
+
+
+def test_save_load_samples_round_trip(tmp_path):
+    predictions, last_obs, posterior = _make_samples()
+    save_samples(tmp_path, MODEL_NAME, REF_DATE, predictions, last_obs, '4rt',
+                 posterior=posterior)
+    
+    loaded_predictions, loaded_last_obs, metadata = load_samples(tmp_path, MODEL_NAME, REF_DATE)
+    loaded_posterior = load_posterior_samples(tmp_path, MODEL_NAME, REF_DATE)
+    
+    np.testing.assert_array_equal(loaded_predictions, predictions)
+    assert loaded_predictions.dtype == np.float32
+    # the arrays are read-only views of the memory mapped files
+    assert not loaded_predictions.flags.writeable
+    assert not loaded_posterior['theta'].flags.writeable
+    pd.testing.assert_frame_equal(loaded_last_obs, last_obs)
+    assert metadata == {'model_name': MODEL_NAME, 'ref_date': '2024-01-06',
+                        'power_transform': '4rt'}
+    assert sorted(loaded_posterior) == ['sigma', 'theta']
+    for name in posterior:
+        np.testing.assert_array_equal(loaded_posterior[name], posterior[name])
+    
+    # no temporary files are left behind
+    assert len(list((tmp_path / f'UMass-{MODEL_NAME}' / 'samples').iterdir())) == 2
+
+
+def test_requantile_matches_quantile_output(tmp_path):
+    predictions, last_obs, _ = _make_samples()
+    artifact_store_root = tmp_path / 'model-artifacts'
+    output_root = tmp_path / 'model-output'
+    save_samples(artifact_store_root, MODEL_NAME, REF_DATE, predictions, last_obs, '4rt')
+    
+    for q_levels, horizons in [(None, None), ([0.1, 0.5, 0.9], [0, 1])]:
+        save_path = requantile(MODEL_NAME, REF_DATE, artifact_store_root, output_root,
+                               q_levels=q_levels, horizons=horizons)
+        
+        if q_levels is None:
+            q_levels = [0.01, 0.025, 0.05, 0.10, 0.15, 0.20, 0.25, 0.30,
+                        0.35, 0.40, 0.45, 0.50, 0.55, 0.60, 0.65, 0.70,
+                        0.75, 0.80, 0.85, 0.90, 0.95, 0.975, 0.99]
+        expected_df = get_quantile_output(predictions, last_obs, q_levels,
+                                          [f'{q:g}' for q in q_levels], '4rt', REF_DATE,
+                                          horizons=horizons)
+        expected_path = tmp_path / 'expected.csv'
+        expected_df.to_csv(expected_path, index=False)
+        
+        assert save_path == output_root / f'UMass-{MODEL_NAME}' / f'2024-01-06-UMass-{MODEL_NAME}.csv'
+        pd.testing.assert_frame_equal(pd.read_csv(save_path), pd.read_csv(expected_path))
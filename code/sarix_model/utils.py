@@ -3,16 +3,28 @@
 # In a future refactor, we should consolidate
 
 import argparse
+import copy
 import importlib
+import sys
 from pathlib import Path
 from types import SimpleNamespace
 
 import datetime
 
-def parse_args():
+# modules shared by the gbq and sarix models
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'common'))
+
+from hub_output import OUTPUT_FORMATS
+
+def parse_args(argv=None):
     '''
     Parse arguments to the sarix_model.py script
     
+    Parameters
+    ----------
+    argv: optional list of command line arguments; by default, the arguments
+        of the current process
+    
     Returns
     -------
     Two configuration objects collecting settings for the model and the run:
@@ -21,27 +33,79 @@ def parse_args():
         - `ref_date`: the reference date for the forecast
         - `output_root`: `pathlib.Path` object with the root directory for
             saving model outputs
+        - `output_format`: file format for model outputs, one of
+            `hub_output.OUTPUT_FORMATS`
         - `max_horizon`: integer, maximum forecast horizon relative to the
             last observed data
         - `q_levels`: list of floats with quantile levels for predictions
         - `q_labels`: list of strings with names for the quantile levels
+        - `vintage_store_dir`: `pathlib.Path` with the directory of a
+            `vintage_store.VintageStore` to load flu data from, or None to
+            load them with `FluDataLoader`
+        - `num_warmup`, `num_samples`, `num_chains`: integer numbers of
+            MCMC warmup steps per chain, samples per chain and chains; the
+            total number of samples is split among the chains, which run in
+            parallel, one per host device
+        - `save_samples`: boolean; if True, save the predictive samples and
+            the posterior samples of the model parameters in the artifact
+            store (see `sample_store.py`)
+        - `compilation_cache_dir`: `pathlib.Path` with the directory of the
+            on-disk cache of programs compiled by JAX, under the artifact
+            store, or None to compile them in every process
     '''
     parser = _make_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    
+    return build_configs(model_name=args.model_name,
+                         ref_date=args.ref_date,
+                         output_root=args.output_root,
+                         artifact_store_root=args.artifact_store_root,
+                         output_format=args.output_format,
+                         short_run=args.short_run,
+                         save_feat_importance=args.save_feat_importance,
+                         vintage_store_dir=args.vintage_store_dir,
+                         compilation_cache=args.compilation_cache,
+                         num_chains=args.num_chains,
+                         save_samples=args.save_samples)
+
+
+def build_configs(model_name, ref_date, output_root, artifact_store_root,
+                  output_format='csv', short_run=False, save_feat_importance=False,
+                  vintage_store_dir=None, compilation_cache=False, num_chains=1,
+                  save_samples=False):
+    '''
+    Build the configuration objects for one model run. Arguments correspond
+    to the command line arguments described in `_make_parser`.
     
-    ref_date = _validate_ref_date(args.ref_date)
-    model_name = args.model_name
+    Returns
+    -------
+    Two configuration objects, `model_config` and `run_config`, as described
+    in `parse_args`. `model_config` is a copy, so it can be modified without
+    affecting other runs in the same process.
+    '''
+    ref_date = _validate_ref_date(ref_date)
     
-    model_config = importlib.import_module(f'configs.{model_name}').config
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'output_format must be one of {OUTPUT_FORMATS}')
+    
+    if num_chains < 1:
+        raise ValueError('num_chains must be a positive integer')
+    
+    model_config = copy.deepcopy(
+        importlib.import_module(f'configs.{model_name}').config)
     
     run_config = SimpleNamespace(
         ref_date=ref_date,
-        output_root=args.output_root,
-        artifact_store_root=args.artifact_store_root,
-        save_feat_importance=args.save_feat_importance
+        output_root=output_root,
+        output_format=output_format,
+        artifact_store_root=artifact_store_root,
+        save_feat_importance=save_feat_importance,
+        vintage_store_dir=vintage_store_dir,
+        save_samples=save_samples,
+        compilation_cache_dir=artifact_store_root / 'jax-compilation-cache' if compilation_cache else None
     )
     
-    if args.short_run:
+    if short_run:
         # override model-specified num_bags to a smaller value
         # model_config.num_bags = 10
         
@@ -54,8 +118,9 @@ def parse_args():
         
         if model_config.model_class == "sarix":
             run_config.num_warmup = 200
-            run_config.num_samples = 200
-            run_config.num_chains = 1
+            # each chain draws its share of the samples, rounded up
+            run_config.num_samples = -(-200 // num_chains)
+            run_config.num_chains = num_chains
     else:
         # maximum forecast horizon
         run_config.max_horizon = 5
@@ -71,8 +136,8 @@ def parse_args():
         
         if model_config.model_class == "sarix":
             run_config.num_warmup = 1000
-            run_config.num_samples = 1000
-            run_config.num_chains = 1
+            run_config.num_samples = -(-1000 // num_chains)
+            run_config.num_chains = num_chains
     
     return model_config, run_config
 
@@ -96,6 +161,10 @@ def _make_parser():
                         help='Path to a directory in which model outputs are saved',
                         type=lambda s: Path(s),
                         default=Path('../../submissions-hub/model-output'))
+    parser.add_argument('--output_format',
+                        help='File format for model outputs; parquet and arrow files are typed following the hub\'s tasks.json and are faster to read than csv files',
+                        choices=OUTPUT_FORMATS,
+                        default='csv')
     parser.add_argument('--artifact_store_root',
                         help='Path to a directory in which artifacts related to model runs are saved',
                         type=lambda s: Path(s),
@@ -103,6 +172,27 @@ def _make_parser():
     parser.add_argument('--save_feat_importance',
                         help='Flag to save feature importances',
                         action='store_true')
+    parser.add_argument('--save_samples',
+                        help='Flag to save the predictive samples, and the posterior samples of the model parameters, in the artifact store; quantiles can be recomputed from the predictive samples with requantile.py',
+                        action='store_true')
+    parser.add_argument('--vintage_store_dir',
+                        help='Optional path to a local store of flu data vintages; data for a reference date are loaded from the store if an earlier run stored them, without network access, and are added to it otherwise',
+                        type=lambda s: Path(s),
+                        default=None)
+    parser.add_argument('--num_chains',
+                        help='Number of MCMC chains, run in parallel on as many cores; the samples are split among the chains, so that the total number of samples is the same as with one chain',
+                        type=int,
+                        default=1)
+    parser.add_argument('--compilation_cache',
+                        help='Flag to save the programs compiled by JAX in a cache under the artifact store, from which later runs load them instead of compiling them again',
+                        action='store_true')
+    parser.add_argument('--server_socket',
+                        help='Optional path to the Unix socket of a forecast server started with --serve; the run is done by the server instead of this process',
+                        type=lambda s: Path(s),
+                        default=None)
+    parser.add_argument('--serve',
+                        help='Flag to start a forecast server listening on --server_socket, which keeps imported modules, loaded data and JAX\'s compiled functions in memory across runs',
+                        action='store_true')
     
     return parser
 
@@ -125,9 +215,9 @@ def _validate_ref_date(ref_date):
         raise TypeError('ref_date must be a datetime.date object')
 
 
-def build_save_path(root, run_config, model_config, subdir=None):
+def build_save_path(root, run_config, model_config, subdir=None, suffix='.csv'):
     save_dir = root / f'UMass-{model_config.model_name}'
     if subdir is not None:
         save_dir = save_dir / subdir
     save_dir.mkdir(parents=True, exist_ok=True)
-    return save_dir / f'{str(run_config.ref_date)}-UMass-{model_config.model_name}.csv'
+    return save_dir / f'{str(run_config.ref_date)}-UMass-{model_config.model_name}{suffix}'